@@ -1,32 +1,104 @@
-from fastapi import FastAPI, HTTPException, BackgroundTasks, Request
-from pydantic import BaseModel, HttpUrl
-from typing import Dict, Any
+from fastapi import FastAPI, HTTPException, Request
+from pydantic import BaseModel, Field, HttpUrl
+from typing import Dict, Any, AsyncGenerator, AsyncIterator, Awaitable, Callable, Set, Optional, List, Literal
 from pathlib import Path
-from fastapi.responses import FileResponse
+from fastapi.responses import StreamingResponse, PlainTextResponse, JSONResponse
+from starlette.types import Receive, Scope, Send
+import os
+import json
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, AsyncExitStack
+import re
+import mimetypes
+from urllib.parse import quote
+import asyncio
+import contextvars
 import logging # Import logging
 
 # Assuming downloader.py and processor.py are in the same directory (backend)
-from .downloader import get_video_info
-from .processor import generate_temp_filepath, download_stream, run_ffmpeg_mux, cleanup_files, FFMPEG_EXE_PATH
+from .downloader import get_video_info, warm_extractor_pool, normalize_url, expand_playlist, select_formats
+from .processor import (download_stream, run_ffmpeg_mux, stream_ffmpeg_mux, cleanup_files, get_http_client, close_http_client,
+                        probe_ffmpeg, TEMP_DIR_BASE)
+from . import cache
+from .coalesce import SingleFlight, SharedStream
+from .jobs import JobManager, JobStore, Job, DONE, FAILED
+from .batch import BatchItem, ZipStreamWriter, run_pipeline
+from .progress import ProgressReporter, download_callback, mux_callback
+from . import metrics
+from . import scheduler
+from . import scratch
+from .scratch import ScratchDir
+from .outputs import OutputFileResponse, find_output, output_url
+from .logconfig import configure_logging
+from .config import (EXTRACT_WORKERS, MAX_CONCURRENT_JOBS, JOB_WORKERS, JOB_RETENTION, JOB_MAX_PRIORITY,
+                     BATCH_MAX_ITEMS, BATCH_PIPELINE_DEPTH, DISK_HEADROOM, DISK_RESERVATION_DEFAULT)
 
-# Configure basic logging for the app
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(module)s - %(message)s')
+configure_logging()
 logger = logging.getLogger(__name__)
 
-# Check if FFMPEG_EXE_PATH is the placeholder and try to find ffmpeg in PATH if so
-effective_ffmpeg_path = FFMPEG_EXE_PATH
-if FFMPEG_EXE_PATH == "C:\\ffmpeg\\bin\\ffmpeg.exe" or not Path(FFMPEG_EXE_PATH).exists():
-    logger.info(f"Default FFMPEG_EXE_PATH '{FFMPEG_EXE_PATH}' is placeholder or not found. Attempting to find ffmpeg in PATH.")
-    import shutil
-    found_ffmpeg = shutil.which("ffmpeg")
-    if found_ffmpeg:
-        logger.info(f"Found ffmpeg in PATH: {found_ffmpeg}")
-        effective_ffmpeg_path = found_ffmpeg
-    else:
-        logger.warning("ffmpeg not found in PATH. Muxing will likely fail unless FFMPEG_EXE_PATH is correctly set manually or ffmpeg is installed and in PATH.")
-        # effective_ffmpeg_path remains the placeholder, run_ffmpeg_mux will handle its non-existence if called
+# yt-dlp extraction is blocking, so it runs on a bounded thread pool.
+# The job semaphore caps how much work a single worker keeps in flight;
+# downloads, muxes and disk space are admitted by the scheduler.
+extract_executor = ThreadPoolExecutor(max_workers=EXTRACT_WORKERS, thread_name_prefix="extract")
+job_semaphore = asyncio.Semaphore(MAX_CONCURRENT_JOBS)
+disk_budget = scheduler.DiskBudget(TEMP_DIR_BASE, DISK_HEADROOM)
+
+# Single-flight registries: concurrent requests for the same URL share one
+# extraction, and requests for the same video and formats share one job.
+inflight_extractions = SingleFlight()
+inflight_jobs = SingleFlight()
+# Progress of the jobs in inflight_jobs, so requests that join can follow along
+inflight_progress: Dict[str, ProgressReporter] = {}
+# Streaming jobs in progress, keyed by output cache key
+shared_streams: Dict[str, SharedStream] = {}
+# Strong references to detached producer tasks so they are not garbage collected
+_producer_tasks: Set[asyncio.Task] = set()
+
+async def get_video_info_async(video_url: str) -> Dict[str, Any]:
+    """
+    Runs the blocking get_video_info on the extraction thread pool.
+    Concurrent calls for equivalent URLs share a single extraction.
+    """
+    async def extract() -> Dict[str, Any]:
+        loop = asyncio.get_running_loop()
+        # Run in a copy of the current context so trace spans keep the request's trace ID
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(extract_executor, context.run, get_video_info, video_url)
+
+    video_info = await inflight_extractions.do(normalize_url(video_url), extract)
+    return dict(video_info)
 
-app = FastAPI(title="VidGrabber API", version="0.2.0") # Version bump
+async def expand_playlist_async(playlist_url: str) -> Dict[str, Any]:
+    """
+    Runs the blocking playlist expansion on the extraction thread pool.
+    """
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(extract_executor, context.run, expand_playlist, playlist_url)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Build the YoutubeDL instances in the background so startup is not delayed
+    asyncio.get_running_loop().run_in_executor(extract_executor, warm_extractor_pool)
+    # Validate FFmpeg once (a no-op if the preloading server already did)
+    await asyncio.to_thread(probe_ffmpeg)
+    # Remove whatever crashed workers left behind, then keep scratch space in check
+    removed = await asyncio.to_thread(scratch.sweep_orphans)
+    if removed:
+        logger.info("Startup sweep removed %s orphaned scratch entries", removed)
+    janitor = asyncio.create_task(scratch.run_janitor())
+    snapshots = asyncio.create_task(metrics.run_snapshots())
+    job_manager.start()
+    yield
+    await job_manager.stop()
+    janitor.cancel()
+    snapshots.cancel()
+    await asyncio.gather(snapshots, return_exceptions=True) # Lets it write its final snapshot
+    scratch.release_worker_dir()
+    await close_http_client()
+    extract_executor.shutdown(wait=False, cancel_futures=True)
+
+app = FastAPI(title="VidGrabber API", version="0.3.0", lifespan=lifespan) # Version bump
 
 # Add CORS middleware (from previous step, assuming it's needed for frontend)
 from fastapi.middleware.cors import CORSMiddleware
@@ -37,14 +109,52 @@ app.add_middleware(
     allow_methods=["*"],  # Allows all methods (GET, POST, etc.)
     allow_headers=["*"],  # Allows all headers
 )
+app.add_middleware(metrics.MetricsMiddleware)
+
+class FormatSelection(BaseModel):
+    # Quality limits; the best formats within them are chosen, and a
+    # progressive (already muxed) format is passed through without muxing
+    max_height: Optional[int] = Field(None, gt=0)
+    # Video codec family, e.g. "h264", "h265", "vp9" or "av1"
+    vcodec: Optional[str] = None
+    # Bytes, video and audio combined
+    max_filesize: Optional[int] = Field(None, gt=0)
+
+    def format_selection(self) -> Dict[str, Any]:
+        return {name: value for name, value in (("max_height", self.max_height), ("vcodec", self.vcodec),
+                                                ("max_filesize", self.max_filesize)) if value is not None}
+
+class JobRequest(FormatSelection):
+    url: HttpUrl
+    # Lower numbers run first; clamped to 0..JOB_MAX_PRIORITY, so 0 (the default) is the highest
+    priority: int = 0
+
+class BatchRequest(FormatSelection):
+    # Explicit video URLs and/or a playlist to expand; playlist entries come after the URLs
+    urls: List[HttpUrl] = []
+    playlist_url: Optional[HttpUrl] = None
+    # "manifest" returns a job per video right away; "zip" streams one archive of all videos
+    output: Literal["manifest", "zip"] = "manifest"
 
-class VideoUrlRequest(BaseModel):
+class VideoUrlRequest(FormatSelection):
     url: HttpUrl
+    # When true, ffmpeg reads the stream URLs directly and the muxed
+    # fragmented MP4 is streamed to the client while it is produced.
+    stream: bool = False
 
 @app.get("/")
 async def read_root():
     return {"message": "Welcome to VidGrabber API. Use POST /api/process_and_download_video to process videos."}
 
+@app.get("/api/health")
+async def health() -> Dict[str, Any]:
+    """
+    Liveness check. Also reports the worker's PID and the FFmpeg found at startup.
+    """
+    ffmpeg = probe_ffmpeg()
+    return {"status": "ok", "pid": os.getpid(),
+            "ffmpeg": ffmpeg.get("version"), "ffmpeg_error": ffmpeg.get("error")}
+
 # Old endpoint - can be deprecated or removed later if not needed
 @app.post("/api/download")
 async def old_process_video_url(request: VideoUrlRequest) -> Dict[str, Any]:
@@ -52,7 +162,8 @@ async def old_process_video_url(request: VideoUrlRequest) -> Dict[str, Any]:
     # This endpoint is superseded by /api/process_and_download_video for muxing.
     # Returning the raw info as before, but with a deprecation warning in logs / potentially in response.
     video_url_str = str(request.url)
-    video_data = get_video_info(video_url_str) # This now returns video/audio URLs for muxing
+    video_data = await get_video_info_async(video_url_str) # This now returns video/audio URLs for muxing
+    index = video_data.pop("format_index", None)
     if not video_data:
         raise HTTPException(status_code=500, detail="Failed to retrieve video information: No data returned.")
     if video_data.get("error"):
@@ -61,88 +172,944 @@ async def old_process_video_url(request: VideoUrlRequest) -> Dict[str, Any]:
         elif "not found" in video_data["error"].lower() or "unable to extract" in video_data["error"].lower(): status_code = 404
         elif "private video" in video_data["error"].lower(): status_code = 403
         raise HTTPException(status_code=status_code, detail=video_data["error"])
+    video_data["formats"] = index.describe() if index is not None else []
     return video_data
 
 
 @app.post("/api/process_and_download_video")
-async def process_and_download_video(request: VideoUrlRequest, background_tasks: BackgroundTasks):
+async def process_and_download_video(request: VideoUrlRequest):
     """
     Processes a video URL: downloads separate video & audio, muxes them,
-    and returns the final video file for download.
-    Temporary files are cleaned up in the background.
+    and returns the final video file for download. If the selected format is
+    progressive it is relayed from the source as is instead.
+    Concurrent requests for the same video share one extraction and one job.
     """
     video_url_str = str(request.url)
-    logger.info(f"Processing request for URL: {video_url_str}")
+    logger.info("Processing request for URL: %s", video_url_str)
 
-    # --- 1. Get Video Info (Stream URLs, Title, etc.) ---
-    video_info = get_video_info(video_url_str)
+    selection = request.format_selection()
+    if request.stream:
+        return await _stream_video(video_url_str, selection)
+    return await _process_video(video_url_str, selection)
+
+
+async def _get_stream_urls(video_url_str: str, selection: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Fetches video info, selects formats within the limits in `selection`
+    (see FormatSelection), and makes sure the stream URLs are present.
+    Raises HTTPException with a suitable status code otherwise.
+    """
+    video_info = await get_video_info_async(video_url_str)
     if video_info.get("error"):
-        logger.error(f"Failed to get video info: {video_info['error']}")
+        logger.error("Failed to get video info: %s", video_info['error'])
         # Use status codes from downloader if available and more specific
         status_code = 400
         if "Unsupported URL" in video_info["error"]: status_code = 400
         elif "not found" in video_info["error"].lower() or "unable to extract" in video_info["error"].lower(): status_code = 404
         elif "private video" in video_info["error"].lower(): status_code = 403
         raise HTTPException(status_code=status_code, detail=f"Failed to get video info: {video_info['error']}")
+    if selection:
+        # The default selection (no limits) was already made during extraction
+        video_info = select_formats(video_info, **selection)
+        if video_info.get("error"):
+            raise HTTPException(status_code=404, detail=video_info["error"])
 
     video_stream_url = video_info.get("video_url")
     audio_stream_url = video_info.get("audio_url")
+    if not video_stream_url or not (audio_stream_url or video_info.get("progressive")):
+        logger.error("Could not find both video and audio streams. Video URL: %s, Audio URL: %s", video_stream_url, audio_stream_url)
+        raise HTTPException(status_code=404, detail="Could not find separate video and audio streams for muxing. The video might be video-only, audio-only, or suitable formats are unavailable.")
+    return video_info
+
+
+def _expected_disk_usage(video_info: Dict[str, Any], streaming: bool = False) -> int:
+    """
+    Scratch space a job for video_info needs, from the stream sizes in the
+    metadata: the downloaded inputs plus a muxed output of about the same size,
+    or just the output when FFmpeg reads the streams directly or the format is
+    progressive.
+    """
+    if video_info.get("progressive"):
+        return video_info.get("video_filesize") or DISK_RESERVATION_DEFAULT
+    sizes = (video_info.get("video_filesize"), video_info.get("audio_filesize"))
+    if not all(sizes):
+        return DISK_RESERVATION_DEFAULT
+    return sum(sizes) * (1 if streaming else 2)
+
+
+def _output_cache_key(video_info: Dict[str, Any]):
+    if video_info.get("progressive"):
+        return cache.cache_key(video_info.get("extractor"), video_info.get("video_id"), video_info.get("video_format_id"))
+    return cache.cache_key(video_info.get("extractor"), video_info.get("video_id"),
+                           video_info.get("video_format_id"), video_info.get("audio_format_id"))
+
+
+def _media_type(filename: str) -> str:
+    return mimetypes.guess_type(filename)[0] or 'video/mp4'
+
+
+def _content_disposition(filename: str) -> str:
+    """
+    Content-Disposition for a download, built the way FileResponse builds it.
+    Header values must be latin-1, so a name with other characters (most
+    video titles outside English) gets an ASCII fallback plus the full name
+    in RFC 5987 form.
+    """
+    quoted = quote(filename)
+    if quoted == filename:
+        return f'attachment; filename="{filename}"'
+    fallback = re.sub(r'[^\x20-\x7e]|["\\]', '_', filename)
+    return f"attachment; filename=\"{fallback}\"; filename*=utf-8''{quoted}"
+
+
+def _output_response(path: Path, filename: str) -> OutputFileResponse:
+    """
+    Serves a finished file with Range, If-Range and ETag support. The
+    Content-Location header names the URL the file stays downloadable from,
+    so an interrupted download can be resumed there with a Range request
+    instead of processing the video again.
+    """
+    try:
+        return OutputFileResponse(path, filename, media_type=_media_type(filename),
+                                  headers={"Content-Location": output_url(path, filename)})
+    except FileNotFoundError:
+        raise HTTPException(status_code=410, detail="The file is no longer available. Please submit the video again.")
+
+
+def _cached_response(video_info: Dict[str, Any]):
+    """
+    Returns the response for a cached muxed output, or None on a cache miss.
+    """
+    key = _output_cache_key(video_info)
+    cached_path = cache.lookup(key) if key else None
+    if cached_path is None:
+        return None
+    logger.info("Serving cached output %s", cached_path.name)
+    return _output_response(cached_path, video_info.get("suggested_filename", "downloaded_video.mp4"))
+
+
+class _ClosingStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse that awaits `on_close` once the response is over,
+    however it ends: sent in full, cut short by the client, or failed before
+    the body iterator started (in which case a finally block inside the
+    iterator never runs). `on_close` must be safe to call more than once.
+    """
+
+    def __init__(self, content: AsyncGenerator[bytes, None], on_close: Callable[[], Awaitable[None]], **kwargs: Any) -> None:
+        super().__init__(content, **kwargs)
+        self._on_close = on_close
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            # Close the iterator first so its own cleanup runs now rather than at garbage collection
+            await self.body_iterator.aclose()
+            await self._on_close()
+
+
+async def _proxy_progressive(video_info: Dict[str, Any]):
+    """
+    Relays a progressive format from the source to the client as it arrives,
+    with no scratch file and no FFmpeg run. Used when the output has no stable
+    identity to share or cache it under. The download holds a download slot
+    and is paced like any other. The upstream response headers are awaited
+    before responding, so a failing source still surfaces as an HTTP error.
+    """
+    import httpx
+    url = video_info["video_url"]
+    filename = video_info.get("suggested_filename", "downloaded_video.mp4")
+    # Built before anything is acquired, so nothing here can fail while holding the slot
+    headers = {"Content-Disposition": _content_disposition(filename)}
+    media_type = _media_type(filename)
+    upstream = AsyncExitStack()
+    try:
+        await upstream.enter_async_context(scheduler.download_slot(url))
+        response = await upstream.enter_async_context(get_http_client().stream("GET", url))
+        response.raise_for_status()
+    except httpx.HTTPError as e:
+        await upstream.aclose()
+        logger.error("Failed to fetch progressive format %s: %s", video_info.get("video_format_id"), e)
+        raise HTTPException(status_code=502, detail="Failed to fetch the video from its source.")
+    except BaseException:
+        await upstream.aclose()
+        raise
+
+    if response.headers.get("content-length") and not response.headers.get("content-encoding"):
+        headers["Content-Length"] = response.headers["content-length"]
+    logger.info("Passing through progressive format %s", video_info.get("video_format_id"))
+
+    async def body() -> AsyncIterator[bytes]:
+        try:
+            with metrics.JOBS_IN_FLIGHT.track("proxy"), metrics.timed("proxy"):
+                async for chunk in response.aiter_bytes():
+                    await scheduler.pace(url, len(chunk))
+                    yield chunk
+        finally:
+            await upstream.aclose()
+
+    try:
+        # The response closes the upstream too, in case body() never starts
+        return _ClosingStreamingResponse(body(), upstream.aclose, media_type=media_type, headers=headers)
+    except BaseException:
+        await upstream.aclose()
+        raise
+
+
+async def _upstream_chunks(url: str, progress: Optional[ProgressReporter] = None) -> AsyncIterator[bytes]:
+    """
+    Yields a progressive format as it arrives from the source while holding a
+    job and a download slot, paced like any other download. Raises
+    HTTPException 502 if the source fails.
+    """
+    import httpx
+    on_progress = download_callback(progress, "video") if progress is not None else None
+    async with job_semaphore, scheduler.download_slot(url):
+        with metrics.JOBS_IN_FLIGHT.track("proxy"), metrics.timed("proxy"):
+            try:
+                async with get_http_client().stream("GET", url) as response:
+                    response.raise_for_status()
+                    length = response.headers.get("content-length")
+                    total = int(length) if length and not response.headers.get("content-encoding") else None
+                    received = 0
+                    async for chunk in response.aiter_bytes():
+                        await scheduler.pace(url, len(chunk))
+                        received += len(chunk)
+                        if on_progress is not None:
+                            on_progress(received, total)
+                        yield chunk
+            except httpx.HTTPError as e:
+                logger.error("Failed to fetch progressive format from source: %s", e)
+                raise HTTPException(status_code=502, detail="Failed to fetch the video from its source.")
+
+
+async def _muxed_chunks(video_stream_url: str, audio_stream_url: str,
+                        progress: Optional[ProgressReporter] = None,
+                        duration: Optional[float] = None) -> AsyncIterator[bytes]:
+    """
+    Yields the muxed output of a streaming FFmpeg run while holding a job and a mux slot.
+    """
+    on_progress = mux_callback(progress, duration) if progress is not None else None
+    async with job_semaphore, scheduler.mux_gate.slot():
+        with metrics.JOBS_IN_FLIGHT.track("stream"):
+            async for chunk in stream_ffmpeg_mux(video_stream_url, audio_stream_url, progress=on_progress):
+                yield chunk
+
+
+async def _stream_video(video_url_str: str, selection: Optional[Dict[str, Any]] = None):
+    """
+    Streams a fragmented MP4 to the client while FFmpeg is still producing it,
+    or a progressive format as it arrives from the source.
+    """
+    video_info = await _get_stream_urls(video_url_str, selection)
+    cached = _cached_response(video_info)
+    if cached is not None:
+        return cached
+    return await _stream_output(video_info)
+
+
+async def _stream_output(video_info: Dict[str, Any]):
+    """
+    Streams the output for video_info while it is being produced. Concurrent
+    requests for the same video and formats attach to one producer, which
+    moves the finished output into the cache; if a file job for it is already
+    in flight, its file is served once ready instead. Output is awaited before
+    responding so startup failures still surface as a proper HTTP error
+    instead of a truncated download.
+    """
     suggested_filename = video_info.get("suggested_filename", "downloaded_video.mp4")
+    headers = {"Content-Disposition": _content_disposition(suggested_filename)}
 
-    if not video_stream_url or not audio_stream_url:
-        logger.error(f"Could not find both video and audio streams. Video URL: {video_stream_url}, Audio URL: {audio_stream_url}")
-        raise HTTPException(status_code=404, detail="Could not find separate video and audio streams for muxing. The video might be video-only, audio-only, or suitable formats are unavailable.")
+    key = _output_cache_key(video_info)
+    if key is None:
+        # Without a stable identity the output can be neither shared nor cached
+        if video_info.get("progressive"):
+            return await _proxy_progressive(video_info)
+        return await _direct_stream(video_info, headers)
 
-    logger.info(f"Found video stream: {'Available' if video_stream_url else 'Not Available'}")
-    logger.info(f"Found audio stream: {'Available' if audio_stream_url else 'Not Available'}")
+    shared = shared_streams.get(key)
+    if shared is not None:
+        logger.info("Attaching to in-flight stream %s", key[:16])
+    elif key not in inflight_jobs:
+        # Reserve before registering, so a 503 leaves nothing behind for others to join
+        reservation = await disk_budget.reserve(_expected_disk_usage(video_info, streaming=True))
+        # Another request for the same key may have started the work while this one waited
+        shared = shared_streams.get(key)
+        if shared is None and key not in inflight_jobs:
+            shared = _start_shared_stream(key, video_info, reservation)
+        else:
+            reservation.release()
+    if shared is None:
+        # A file job is producing this output already; wait for it rather than fetch the video again
+        return _output_response(await _produce_shared_file(key, video_info), suggested_filename)
 
-    # --- 2. Define Temporary File Paths ---
-    temp_video_path = generate_temp_filepath(prefix="vid", extension=".mp4") # Assuming mp4 video
-    temp_audio_path = generate_temp_filepath(prefix="aud", extension=".m4a") # Assuming m4a audio
-    muxed_output_path = generate_temp_filepath(prefix="muxed_", extension=".mp4")
+    chunks = shared.reader()
+    try:
+        await shared.wait_for_output()
+    except RuntimeError as e:
+        await chunks.aclose()
+        if isinstance(shared.error, HTTPException): # No capacity, or the source failed
+            raise shared.error
+        logger.error("Shared stream produced no output: %s", e)
+        raise HTTPException(status_code=500, detail="Failed to process video (muxing error). Check server logs for FFmpeg details.")
+    # Closes the reader and its file as soon as the response ends, even if the client went away mid-stream
+    return _ClosingStreamingResponse(chunks, chunks.aclose, media_type=_media_type(suggested_filename), headers=headers)
 
-    files_to_cleanup = [temp_video_path, temp_audio_path, muxed_output_path]
 
+def _start_shared_stream(key: str, video_info: Dict[str, Any], reservation: scheduler.DiskReservation) -> SharedStream:
+    """
+    Registers a SharedStream for key and starts its producer in the background.
+    The producer is the in-flight job for key, so file requests join it too.
+    """
+    scratch_dir = ScratchDir("stream")
     try:
-        # --- 3. Download Video Stream ---
-        logger.info(f"Downloading video to {temp_video_path}")
-        if not download_stream(video_stream_url, temp_video_path):
-            logger.error("Failed to download video stream.")
-            raise HTTPException(status_code=500, detail="Failed to download video stream.")
-
-        # --- 4. Download Audio Stream ---
-        logger.info(f"Downloading audio to {temp_audio_path}")
-        if not download_stream(audio_stream_url, temp_audio_path):
-            logger.error("Failed to download audio stream.")
-            raise HTTPException(status_code=500, detail="Failed to download audio stream.")
-
-        # --- 5. Mux Video and Audio ---
-        logger.info(f"Muxing video and audio to {muxed_output_path} using FFmpeg at {effective_ffmpeg_path}")
-        if not run_ffmpeg_mux(temp_video_path, temp_audio_path, muxed_output_path, ffmpeg_exe_path=effective_ffmpeg_path):
-            logger.error("Failed to mux video and audio.")
-            raise HTTPException(status_code=500, detail="Failed to process video (muxing error). Check server logs for FFmpeg details.")
-
-        # --- 6. Schedule Cleanup & Return File ---
-        logger.info(f"Muxing successful. Preparing file response for {muxed_output_path}")
-        # Add task to cleanup files *after* response is sent
-        background_tasks.add_task(cleanup_files, files_to_cleanup)
-
-        return FileResponse(
-            path=str(muxed_output_path), # Ensure path is string for FileResponse
-            media_type='video/mp4',
-            filename=suggested_filename
-        )
+        shared = SharedStream(scratch_dir.file("output.mp4"))
+    except BaseException:
+        scratch_dir.cleanup()
+        reservation.release()
+        raise
+    shared_streams[key] = shared
+    progress = inflight_progress[key] = ProgressReporter()
+    task = inflight_jobs.start(key, lambda: _produce_shared_stream(key, shared, video_info, scratch_dir,
+                                                                   reservation, progress))
+    _producer_tasks.add(task)
+    task.add_done_callback(_producer_tasks.discard)
+    return shared
+
+
+async def _produce_shared_stream(key: str, shared: SharedStream, video_info: Dict[str, Any], scratch_dir: ScratchDir,
+                                 reservation: scheduler.DiskReservation, progress: ProgressReporter) -> Path:
+    """
+    Runs one streaming mux, or relays one progressive download, into a
+    SharedStream. It is detached from any single client, so it completes even
+    if the first client disconnects, and the finished output is moved into
+    the cache. Removes `scratch_dir` and releases `reservation` when done;
+    readers keep their open file either way.
+    Returns the cached path, for file requests that joined, or raises HTTPException.
+    """
+    try:
+        if video_info.get("progressive"):
+            chunks = _upstream_chunks(video_info["video_url"], progress)
+        else:
+            chunks = _muxed_chunks(video_info["video_url"], video_info["audio_url"],
+                                   progress, video_info.get("duration"))
+        await shared.produce(chunks)
+        return cache.store(key, shared.path)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("Shared stream failed for %s: %s", key[:16], e)
+        raise HTTPException(status_code=500, detail="Failed to process video (muxing error). Check server logs for FFmpeg details.")
+    finally:
+        progress.close()
+        if inflight_progress.get(key) is progress:
+            del inflight_progress[key]
+        scratch_dir.cleanup()
+        reservation.release()
+        if shared_streams.get(key) is shared:
+            del shared_streams[key]
+
+
+async def _direct_stream(video_info: Dict[str, Any], headers: Dict[str, str]) -> StreamingResponse:
+    """
+    Starts an unshared streaming mux and returns its response once the first
+    chunk is available. The mux holds a job and a mux slot, which the response
+    releases however it ends.
+    """
+    chunks = _muxed_chunks(video_info["video_url"], video_info["audio_url"])
+    try:
+        first_chunk = await chunks.__anext__()
+    except (StopAsyncIteration, RuntimeError) as e:
+        await chunks.aclose()
+        logger.error("Streaming mux produced no output: %s", e)
+        raise HTTPException(status_code=500, detail="Failed to process video (muxing error). Check server logs for FFmpeg details.")
+
+    async def body() -> AsyncIterator[bytes]:
+        try:
+            yield first_chunk
+            async for chunk in chunks:
+                yield chunk
+        finally:
+            await chunks.aclose()
+
+    return _ClosingStreamingResponse(body(), chunks.aclose, media_type='video/mp4', headers=headers)
+
+
+async def _process_video(video_url_str: str, selection: Optional[Dict[str, Any]] = None):
+    """
+    Returns the muxed file for a video, from the cache if possible. Concurrent
+    requests for the same video and formats wait on a single job. Outputs that
+    cannot be cached are kept for OUTPUT_RETENTION seconds, so the download
+    can be resumed from the response's Content-Location.
+    """
+    # --- 1. Get Video Info (Stream URLs, Title, etc.) ---
+    video_info = await _get_stream_urls(video_url_str, selection)
+    suggested_filename = video_info.get("suggested_filename", "downloaded_video.mp4")
+
+    cached = _cached_response(video_info)
+    if cached is not None:
+        return cached
+    if video_info.get("progressive"):
+        # Needs no mux, so it is relayed to the client as it arrives
+        return await _stream_output(video_info)
+
+    key = _output_cache_key(video_info)
+    if key is None:
+        # Not cacheable; the janitor removes it once OUTPUT_RETENTION has passed
+        output_path = await _produce_muxed_file(video_info)
+    else:
+        output_path = await _produce_shared_file(key, video_info)
+
+    return _output_response(output_path, suggested_filename)
+
+
+async def _produce_shared_file(key: str, video_info: Dict[str, Any], progress: Optional[ProgressReporter] = None) -> Path:
+    """
+    Starts the cached-file job for key, or joins it if one is already in
+    flight. The job's progress events are relayed into `progress` if given.
+    """
+    if key not in inflight_jobs:
+        inflight_progress[key] = ProgressReporter()
+    source = inflight_progress.get(key)
+    relay = asyncio.create_task(progress.relay(source)) if progress is not None and source is not None else None
+    try:
+        output_path = await inflight_jobs.do(key, lambda: _produce_cached_file(key, video_info, source))
+    except BaseException:
+        if relay is not None:
+            relay.cancel()
+        raise
+    if relay is not None:
+        await relay # The source is closed by now, so this only flushes the remaining events
+    return output_path
+
+
+async def _produce_cached_file(key: str, video_info: Dict[str, Any], progress: Optional[ProgressReporter] = None) -> Path:
+    """
+    Produces the muxed file for video_info and moves it into the cache.
+    """
+    try:
+        muxed_output_path = await _produce_muxed_file(video_info, progress)
+        # The cache now owns the muxed file
+        return cache.store(key, muxed_output_path)
+    finally:
+        if progress is not None:
+            progress.close()
+        inflight_progress.pop(key, None)
+
+
+async def _produce_muxed_file(video_info: Dict[str, Any], progress: Optional[ProgressReporter] = None) -> Path:
+    """
+    Downloads the video and audio streams and muxes them in a scratch directory
+    of their own, which is always removed afterwards. On success the muxed file
+    is moved to the outputs directory first. A progressive format is just
+    downloaded, as it needs no mux.
+    Download and mux progress is reported to `progress` if given.
+    Returns the path of the muxed file, or raises HTTPException.
+    """
+    # --- 2. Define Temporary File Paths ---
+    scratch_dir = ScratchDir()
+    temp_video_path = scratch_dir.file("video.mp4") # Assuming mp4 video
+    temp_audio_path = scratch_dir.file("audio.m4a", expected_size=video_info.get("audio_filesize")) # Assuming m4a audio
+    muxed_output_path = scratch_dir.file("muxed.mp4")
+
+    reservation = None
+    try:
+        reservation = await disk_budget.reserve(_expected_disk_usage(video_info))
+        async with job_semaphore:
+            with metrics.JOBS_IN_FLIGHT.track("file"):
+                if video_info.get("progressive"):
+                    await _download_progressive(video_info, muxed_output_path, progress)
+                else:
+                    await _download_inputs(video_info, temp_video_path, temp_audio_path, progress)
+                    await _mux_inputs(video_info, temp_video_path, temp_audio_path, muxed_output_path, progress)
+
+        logger.info("Muxing successful: %s", muxed_output_path)
+        return scratch_dir.keep(muxed_output_path)
 
     except HTTPException: # Re-raise HTTPExceptions directly
-        # Cleanup files if an HTTPException occurred during the process before FileResponse
-        # Note: if muxing failed and raised HTTPException, files_to_cleanup includes muxed_output_path which might not exist.
-        # cleanup_files handles non-existent files gracefully.
-        background_tasks.add_task(cleanup_files, files_to_cleanup)
         raise
     except Exception as e:
-        logger.error(f"An unexpected error occurred during video processing: {e}", exc_info=True)
-        background_tasks.add_task(cleanup_files, files_to_cleanup) # Try to cleanup before raising
+        logger.error("An unexpected error occurred during video processing: %s", e, exc_info=True)
         raise HTTPException(status_code=500, detail=f"An internal server error occurred: {str(e)}")
+    finally:
+        # --- 5. Cleanup ---
+        # Removes the inputs, and the output too unless it was kept
+        scratch_dir.cleanup()
+        if reservation is not None:
+            reservation.release()
+
+
+async def _download_inputs(video_info: Dict[str, Any], temp_video_path: Path, temp_audio_path: Path,
+                           progress: Optional[ProgressReporter] = None) -> None:
+    """
+    Downloads the video and audio streams of video_info concurrently.
+    Raises HTTPException if either download fails.
+    """
+    # --- 3. Download Video and Audio Streams concurrently ---
+    logger.info("Downloading video to %s and audio to %s", temp_video_path, temp_audio_path)
+    downloads = [
+        asyncio.ensure_future(download_stream(video_info["video_url"], temp_video_path, label="video",
+                                              progress=download_callback(progress, "video") if progress else None)),
+        asyncio.ensure_future(download_stream(video_info["audio_url"], temp_audio_path, label="audio",
+                                              progress=download_callback(progress, "audio") if progress else None)),
+    ]
+    try:
+        video_ok, audio_ok = await asyncio.gather(*downloads)
+    except BaseException:
+        # e.g. one stream was refused admission: stop the other before its file is cleaned up
+        for download in downloads:
+            download.cancel()
+        await asyncio.gather(*downloads, return_exceptions=True)
+        raise
+    if not video_ok:
+        logger.error("Failed to download video stream.")
+        raise HTTPException(status_code=500, detail="Failed to download video stream.")
+    if not audio_ok:
+        logger.error("Failed to download audio stream.")
+        raise HTTPException(status_code=500, detail="Failed to download audio stream.")
+
+
+async def _download_progressive(video_info: Dict[str, Any], output_path: Path,
+                               progress: Optional[ProgressReporter] = None) -> None:
+    """
+    Downloads a progressive format, which is already the finished output.
+    Raises HTTPException if the download fails.
+    """
+    logger.info("Downloading progressive format to %s", output_path)
+    if not await download_stream(video_info["video_url"], output_path, label="video",
+                                 progress=download_callback(progress, "video") if progress else None):
+        logger.error("Failed to download progressive stream.")
+        raise HTTPException(status_code=500, detail="Failed to download video stream.")
+
+
+async def _mux_inputs(video_info: Dict[str, Any], temp_video_path: Path, temp_audio_path: Path, muxed_output_path: Path,
+                      progress: Optional[ProgressReporter] = None) -> None:
+    """
+    Muxes downloaded streams into muxed_output_path while holding a mux slot.
+    Raises HTTPException if FFmpeg fails.
+    """
+    # --- 4. Mux Video and Audio ---
+    logger.info("Muxing video and audio to %s", muxed_output_path)
+    async with scheduler.mux_gate.slot():
+        with metrics.timed("mux"):
+            muxed = await run_ffmpeg_mux(temp_video_path, temp_audio_path, muxed_output_path,
+                                         progress=mux_callback(progress, video_info.get("duration")) if progress else None)
+    if not muxed:
+        logger.error("Failed to mux video and audio.")
+        raise HTTPException(status_code=500, detail="Failed to process video (muxing error). Check server logs for FFmpeg details.")
+
+
+# --- Background jobs ---
+# Jobs run the same pipeline as /api/process_and_download_video, but outside the
+# HTTP request, so slow videos are not cut off by proxy timeouts and a client
+# disconnect does not throw away finished work.
+
+async def _run_job(job: Job) -> None:
+    """
+    Job runner: produces the muxed file for job.url and records it on the job.
+    Background jobs queue for capacity instead of failing with 503.
+    """
+    token = metrics.trace_id.set(job.id)
+    wait_token = scheduler.wait_for_capacity.set(True)
+    try:
+        await _run_job_pipeline(job)
+    finally:
+        scheduler.wait_for_capacity.reset(wait_token)
+        metrics.trace_id.reset(token)
+
+
+async def _run_job_pipeline(job: Job) -> None:
+    job.progress.emit("extracting")
+    video_info = await _get_stream_urls(job.url, job.selection)
+    job.filename = video_info.get("suggested_filename", "downloaded_video.mp4")
+    job.progress.emit("extracted", title=video_info.get("title"), duration=video_info.get("duration"))
+
+    key = _output_cache_key(video_info)
+    if key is None:
+        job.result_path = await _produce_muxed_file(video_info, job.progress)
+        job.owns_result = True
+        return
+    cached_path = cache.lookup(key)
+    if cached_path is None:
+        cached_path = await _produce_shared_file(key, video_info, job.progress)
+    job.result_path = cached_path
+
+# Job state is shared through the store, so any worker process can answer for any job
+job_manager = JobManager(_run_job, workers=JOB_WORKERS, retention=JOB_RETENTION, max_priority=JOB_MAX_PRIORITY,
+                         store=JobStore(TEMP_DIR_BASE / "jobs.sqlite3"))
+
+
+async def _get_job_or_404(job_id: str) -> Job:
+    job = await job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found or expired.")
+    return job
+
+
+@app.post("/api/jobs", status_code=202)
+async def submit_job(request: JobRequest, http_request: Request) -> Dict[str, Any]:
+    """
+    Queues a video for processing and returns its job ID immediately.
+    Jobs are scheduled by priority, then fairly across clients.
+    """
+    client_id = http_request.client.host if http_request.client else "unknown"
+    job = job_manager.submit(str(request.url), client_id, request.priority, request.format_selection())
+    # So the other workers know the job by the time the client asks them about it
+    await job_manager.flush()
+    return job.to_dict()
+
+
+@app.get("/api/jobs/{job_id}")
+async def get_job_status(job_id: str) -> Dict[str, Any]:
+    job = await _get_job_or_404(job_id)
+    status = job.to_dict()
+    if job.status == DONE and job.result_path is not None:
+        status["download_url"] = output_url(job.result_path, job.filename)
+    return status
+
+
+@app.api_route("/api/jobs/{job_id}/result", methods=["GET", "HEAD"])
+async def fetch_job_result(job_id: str):
+    """
+    Returns the finished video of a job, with Range support. Responds 409
+    while the job is still queued or running, and with the job's error status
+    if it failed.
+    """
+    job = await _get_job_or_404(job_id)
+    if job.status == FAILED:
+        raise HTTPException(status_code=job.error_status or 500, detail=job.error)
+    if job.status != DONE:
+        raise HTTPException(status_code=409, detail=f"Job is {job.status}.")
+    if job.result_path is None or not job.result_path.exists():
+        raise HTTPException(status_code=410, detail="The job result is no longer available. Please submit the video again.")
+    return _output_response(job.result_path, job.filename or "downloaded_video.mp4")
+
+
+@app.api_route("/api/outputs/{output_id}", methods=["GET", "HEAD"])
+async def download_output(output_id: str, filename: Optional[str] = None):
+    """
+    Serves a finished video by the ID in a Content-Location or download_url,
+    for as long as it is kept: OUTPUT_RETENTION seconds for outputs that are
+    not cacheable, and the cache's lifetime for cached ones. Any worker can
+    serve it. Supports Range, If-Range and If-None-Match, so an interrupted
+    download resumes from where it stopped.
+    """
+    path = find_output(output_id)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Output not found or expired.")
+    # Only the name part of a client-supplied file name is used
+    filename = Path(filename).name if filename else ""
+    return _output_response(path, filename or f"{output_id[:16]}{path.suffix}")
+
+
+# Seconds between SSE keep-alive comments on an idle event stream
+SSE_HEARTBEAT = 15.0
+
 
-# Ensure to import Path from pathlib at the top
-# from pathlib import Path (already there)
+@app.get("/api/jobs/{job_id}/events")
+async def job_events(job_id: str) -> StreamingResponse:
+    """
+    Server-Sent Events stream of a job's progress: extraction, per-stream
+    download bytes and throughput, FFmpeg mux progress, and the final
+    'done' or 'failed' event. The stream ends when the job finishes.
+    """
+    job = await _get_job_or_404(job_id)
+
+    async def event_stream() -> AsyncIterator[str]:
+        async for event in job.progress.subscribe(heartbeat=SSE_HEARTBEAT):
+            if event is None:
+                yield ": keep-alive\n\n"
+            else:
+                yield f"event: {event['event']}\ndata: {json.dumps(event)}\n\n"
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+# --- Batch and playlist processing ---
+# A batch runs its videos through a three-stage pipeline (extract -> download
+# -> mux) with one item per stage, so extraction of the next video, download
+# of the current one and the mux of the previous one overlap. The bounded
+# queues between stages keep memory and scratch disk use independent of the
+# batch length.
+
+async def _batch_extract(item: BatchItem) -> None:
+    job: Optional[Job] = item.context
+    if job is not None:
+        job.mark_running()
+        job.progress.emit("extracting")
+    video_info = await _get_stream_urls(item.url, item.selection)
+    item.video_info = video_info
+    item.filename = video_info.get("suggested_filename", "downloaded_video.mp4")
+    if job is not None:
+        job.filename = item.filename
+        job.progress.emit("extracted", title=video_info.get("title"), duration=video_info.get("duration"))
+    item.cache_key = _output_cache_key(video_info)
+    if item.cache_key is not None:
+        # A cache hit skips the download and mux stages
+        item.result_path = cache.lookup(item.cache_key)
+
+
+class _BatchProduction:
+    """
+    A batch item's download and mux, registered as the in-flight job for its
+    cache key from the download stage until the mux stage is done, so other
+    requests for the same video join it instead of fetching it again. Its
+    progress is relayed into the item's own job, if there is one.
+    """
+
+    def __init__(self, key: str, job_progress: Optional[ProgressReporter]) -> None:
+        self.key = key
+        self.progress = inflight_progress[key] = ProgressReporter()
+        self._result: asyncio.Future = asyncio.get_running_loop().create_future()
+        inflight_jobs.start(key, self._wait)
+        self.relay = asyncio.create_task(job_progress.relay(self.progress)) if job_progress is not None else None
+
+    async def _wait(self) -> Path:
+        return await self._result
+
+    def succeed(self, output_path: Path) -> None:
+        self._settle(output_path, None)
+
+    def fail(self, error: BaseException) -> None:
+        """Passes a failure on to the requests that joined, as the HTTPException they expect."""
+        if isinstance(error, asyncio.CancelledError):
+            error = HTTPException(status_code=500, detail="The batch producing this video was cancelled.")
+        elif not isinstance(error, HTTPException):
+            error = HTTPException(status_code=500, detail="An internal server error occurred.")
+        self._settle(None, error)
+
+    def _settle(self, output_path: Optional[Path], error: Optional[HTTPException]) -> None:
+        if self._result.done():
+            return
+        if error is None:
+            self._result.set_result(output_path)
+        else:
+            self._result.set_exception(error)
+        self.progress.close()
+        if inflight_progress.get(self.key) is self.progress:
+            del inflight_progress[self.key]
+
+
+def _batch_progress(item: BatchItem) -> Optional[ProgressReporter]:
+    if item.production is not None:
+        return item.production.progress
+    return item.context.progress if item.context is not None else None
+
+
+async def _batch_download(item: BatchItem) -> None:
+    if item.result_path is not None:
+        return
+    if item.cache_key is not None and item.cache_key in inflight_jobs:
+        # Another request is already producing this video; wait for it instead
+        progress = item.context.progress if item.context is not None else None
+        item.result_path = await _produce_shared_file(item.cache_key, item.video_info, progress)
+        return
+    if item.cache_key is not None:
+        item.production = _BatchProduction(item.cache_key, item.context.progress if item.context is not None else None)
+    progress = _batch_progress(item)
+    try:
+        # Held until the mux stage is done with the inputs
+        item.disk_reservation = await disk_budget.reserve(_expected_disk_usage(item.video_info))
+        item.scratch = ScratchDir()
+        async with job_semaphore:
+            if item.video_info.get("progressive"):
+                # Already muxed, so the download goes straight to the output
+                item.input_paths = [item.scratch.file("output.mp4")]
+                await _download_progressive(item.video_info, item.input_paths[0], progress)
+            else:
+                item.input_paths = [item.scratch.file("video.mp4"),
+                                    item.scratch.file("audio.m4a", expected_size=item.video_info.get("audio_filesize"))]
+                await _download_inputs(item.video_info, *item.input_paths, progress)
+    except BaseException as e:
+        if item.scratch is not None:
+            item.scratch.cleanup()
+        item.input_paths = []
+        if item.disk_reservation is not None:
+            item.disk_reservation.release()
+        if item.production is not None:
+            item.production.fail(e)
+        raise
+
+
+async def _batch_mux(item: BatchItem) -> None:
+    if not item.input_paths:
+        return
+    progress = _batch_progress(item)
+    try:
+        if item.video_info.get("progressive"):
+            output_path = item.input_paths[0]
+        else:
+            output_path = item.scratch.file("muxed.mp4")
+            await _mux_inputs(item.video_info, *item.input_paths, output_path, progress)
+        if item.cache_key is not None:
+            item.result_path = cache.store(item.cache_key, output_path)
+        else:
+            item.result_path, item.owns_result = item.scratch.keep(output_path), True
+    except BaseException as e:
+        if item.production is not None:
+            item.production.fail(e)
+        raise
+    finally:
+        item.scratch.cleanup()
+        item.input_paths = []
+        item.disk_reservation.release()
+    if item.production is not None:
+        item.production.succeed(item.result_path)
+        if item.production.relay is not None:
+            await item.production.relay # Flushes the last events into the item's job before it finishes
+
+BATCH_STAGES = (_batch_extract, _batch_download, _batch_mux)
+
+
+def _discard_batch_item(item: BatchItem) -> None:
+    """
+    Cleans up an item that was still in the pipeline when it was stopped.
+    """
+    if item.scratch is not None:
+        item.scratch.cleanup()
+    if item.owns_result:
+        cleanup_files([item.result_path])
+    if item.disk_reservation is not None:
+        item.disk_reservation.release()
+    if item.production is not None:
+        item.production.fail(asyncio.CancelledError())
+    job: Optional[Job] = item.context
+    if job is not None:
+        job.mark_failed("Batch was cancelled", None)
+        job.finish()
+
+
+async def _run_batch_jobs(items: List[BatchItem]) -> None:
+    """
+    Runs a manifest batch in the background, completing each item's job as it
+    leaves the pipeline.
+    """
+    scheduler.wait_for_capacity.set(True) # This task's own context; it queues like other background jobs
+    with metrics.JOBS_IN_FLIGHT.track("batch"):
+        async for item in run_pipeline(items, BATCH_STAGES, BATCH_PIPELINE_DEPTH, discard=_discard_batch_item):
+            job: Job = item.context
+            if item.failed:
+                job.mark_failed(item.error, item.error_status)
+            else:
+                job.result_path, job.owns_result = item.result_path, item.owns_result
+                job.mark_done()
+            job.finish()
+
+
+async def _zip_batch(items: List[BatchItem]) -> AsyncIterator[bytes]:
+    """
+    Streams a ZIP of the batch's videos in submission order. Scratch outputs
+    are deleted as soon as they are in the archive, and failures are listed
+    in an errors.txt member at the end.
+    """
+    writer = ZipStreamWriter()
+    failures: List[str] = []
+    # The archive is already streaming, so items wait for capacity rather than fail
+    scheduler.wait_for_capacity.set(True)
+    pipeline = run_pipeline(items, BATCH_STAGES, BATCH_PIPELINE_DEPTH, discard=_discard_batch_item)
+    with metrics.JOBS_IN_FLIGHT.track("batch"):
+        try:
+            async for item in pipeline:
+                if item.failed:
+                    failures.append(f"{item.index + 1}. {item.url}: {item.error}")
+                    continue
+                try:
+                    async for chunk in writer.add_file_async(f"{item.index + 1:03d} - {item.filename}", item.result_path):
+                        yield chunk
+                except FileNotFoundError: # Evicted from the cache before it was sent
+                    failures.append(f"{item.index + 1}. {item.url}: The processed video is no longer available.")
+                finally:
+                    if item.owns_result:
+                        cleanup_files([item.result_path])
+        finally:
+            # Stops the stages and discards the items in flight as soon as the client goes away
+            await pipeline.aclose()
+    if failures:
+        yield writer.add_bytes("errors.txt", ("\n".join(failures) + "\n").encode("utf-8"))
+    yield writer.close()
+
+
+@app.post("/api/batch")
+async def process_batch(request: BatchRequest, http_request: Request):
+    """
+    Processes a list of video URLs and/or a playlist through the batch pipeline.
+
+    With output="manifest" (the default) it responds 202 right away with one
+    job per video, in order; each job is followed and fetched through the
+    /api/jobs endpoints. With output="zip" it streams a ZIP archive of all
+    videos as they finish.
+    """
+    urls = [str(url) for url in request.urls]
+    title = None
+    if request.playlist_url is not None:
+        playlist = await expand_playlist_async(str(request.playlist_url))
+        if playlist.get("error"):
+            raise HTTPException(status_code=400, detail=f"Failed to expand playlist: {playlist['error']}")
+        title = playlist.get("title")
+        urls.extend(playlist["entries"])
+    if not urls:
+        raise HTTPException(status_code=400, detail="Provide at least one URL or a playlist_url.")
+    if len(urls) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"A batch can contain at most {BATCH_MAX_ITEMS} videos.")
+    logger.info("Processing batch of %s videos (%s)", len(urls), request.output)
+    selection = request.format_selection()
+    items = [BatchItem(index, url, selection) for index, url in enumerate(urls)]
+
+    if request.output == "zip":
+        archive_name = re.sub(r'[^A-Za-z0-9._-]+', '_', title or "videos").strip('_')[:100] or "videos"
+        archive = _zip_batch(items)
+        # Closes the archive, and with it the pipeline, as soon as the response ends
+        return _ClosingStreamingResponse(
+            archive, archive.aclose,
+            media_type="application/zip",
+            headers={"Content-Disposition": f'attachment; filename="{archive_name}.zip"'},
+        )
+
+    client_id = http_request.client.host if http_request.client else "unknown"
+    for item in items:
+        item.context = Job(item.url, client_id, selection=selection)
+        job_manager.track(item.context)
+    await job_manager.flush()
+    task = asyncio.create_task(_run_batch_jobs(items))
+    _producer_tasks.add(task)
+    task.add_done_callback(_producer_tasks.discard)
+    return JSONResponse(status_code=202, content={
+        "title": title,
+        "count": len(items),
+        "jobs": [item.context.to_dict() for item in items],
+    })
+
+
+# --- Metrics ---
+
+def _temp_dir_usage() -> float:
+    """
+    Total size in bytes of everything under TEMP_DIR_BASE (scratch files and cache).
+    """
+    total = 0
+    for root, _, files in os.walk(TEMP_DIR_BASE):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError: # Deleted while walking
+                pass
+    return total
+
+metrics.Gauge("vidgrabber_temp_dir_bytes", "Disk space used under the temp directory.", callback=_temp_dir_usage, shared=True)
+metrics.Gauge("vidgrabber_jobs_queued", "Background jobs waiting for a worker.", callback=lambda: job_manager.queued_count)
+
+
+@app.get("/metrics")
+async def get_metrics() -> PlainTextResponse:
+    """
+    Prometheus text exposition of stage latencies, bytes and throughput,
+    FFmpeg durations, cache hit ratios, job counts and temp-dir usage.
+    Rendered on a thread, as it walks the temp dir and reads the other
+    workers' snapshots.
+    """
+    return PlainTextResponse(await asyncio.to_thread(metrics.render_all), media_type="text/plain; version=0.0.4")
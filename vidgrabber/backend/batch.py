@@ -0,0 +1,209 @@
+import io
+import asyncio
+import logging
+import zipfile
+from pathlib import Path
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterator, List, Optional, Sequence
+
+from fastapi import HTTPException
+
+logger = logging.getLogger(__name__)
+
+# Bytes read from a result file per ZIP write, so memory stays flat for any file size
+ZIP_CHUNK_SIZE = 1024 * 1024
+
+
+class BatchItem:
+    """
+    One video of a batch as it moves through the pipeline stages. Stages fill
+    in the fields they produce; a failed item keeps flowing to the output so
+    results stay in submission order, but later stages skip it.
+    """
+
+    def __init__(self, index: int, url: str, selection: Optional[Dict[str, Any]] = None) -> None:
+        self.index = index
+        self.url = url
+        # Format limits for the extract stage (see downloader.select_formats)
+        self.selection = selection or {}
+        self.video_info: Optional[dict] = None
+        self.cache_key: Optional[str] = None
+        self.filename: Optional[str] = None
+        # The item's ScratchDir and the downloaded inputs in it, waiting for the mux stage
+        self.scratch: Any = None
+        self.input_paths: List[Path] = []
+        self.result_path: Optional[Path] = None
+        # True if result_path is a finished output rather than a cache entry
+        self.owns_result = False
+        self.error: Optional[str] = None
+        self.error_status: Optional[int] = None
+        # Disk space held for the item between the download and mux stages
+        self.disk_reservation: Any = None
+        # Optional per-item context for the stages, e.g. a Job
+        self.context: Any = None
+        # Optional handle the stages use to share the item's work with other requests
+        self.production: Any = None
+
+    @property
+    def failed(self) -> bool:
+        return self.error is not None
+
+
+Stage = Callable[[BatchItem], Awaitable[None]]
+
+
+async def run_pipeline(items: Sequence[BatchItem], stages: Sequence[Stage], depth: int = 1,
+                       discard: Optional[Callable[[BatchItem], None]] = None) -> AsyncIterator[BatchItem]:
+    """
+    Runs every item through `stages` in order and yields the items as they
+    leave the last stage.
+
+    Each stage is a single task working on one item at a time, and stages are
+    connected by queues holding at most `depth` items. So while item N is in
+    the second stage, item N+1 is in the first and item N-1 in the third, and
+    a slow consumer stops the pipeline instead of letting finished work (and
+    its temp files) pile up. At most len(stages) * (depth + 1) + 1 items are
+    in flight at any time, regardless of the batch size.
+
+    If the consumer stops early, the remaining stages are cancelled and
+    `discard` is called for every item that was in flight.
+    """
+    queues: List["asyncio.Queue[Optional[BatchItem]]"] = [asyncio.Queue(maxsize=max(1, depth))
+                                                          for _ in range(len(stages) + 1)]
+    in_flight: List[BatchItem] = []
+
+    async def feed() -> None:
+        for item in items:
+            await queues[0].put(item)
+            in_flight.append(item)
+        await queues[0].put(None)
+
+    async def run_stage(stage: Stage, inbox: asyncio.Queue, outbox: asyncio.Queue) -> None:
+        while True:
+            item = await inbox.get()
+            if item is not None and not item.failed:
+                await _run_stage_on(stage, item)
+            await outbox.put(item)
+            if item is None:
+                return
+
+    tasks = [asyncio.create_task(feed())]
+    tasks += [asyncio.create_task(run_stage(stage, queues[i], queues[i + 1])) for i, stage in enumerate(stages)]
+    try:
+        while True:
+            item = await queues[-1].get()
+            if item is None:
+                return
+            in_flight.remove(item)
+            yield item
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if discard is not None:
+            for item in in_flight:
+                discard(item)
+
+
+async def _run_stage_on(stage: Stage, item: BatchItem) -> None:
+    """
+    Runs one stage on one item, recording a failure on the item instead of
+    letting it stop the pipeline.
+    """
+    try:
+        await stage(item)
+    except HTTPException as e:
+        item.error = str(e.detail)
+        item.error_status = e.status_code
+    except Exception as e:
+        logger.error("Batch item %s (%s) failed unexpectedly: %s", item.index, item.url, e, exc_info=True)
+        item.error = "An internal server error occurred."
+        item.error_status = 500
+
+
+class _ChunkBuffer(io.RawIOBase):
+    """
+    Write-only, non-seekable sink that collects what zipfile writes so it can
+    be handed to the client piece by piece.
+    """
+
+    def __init__(self) -> None:
+        self._chunks: List[bytes] = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+class ZipStreamWriter:
+    """
+    Builds a ZIP archive incrementally. Members are stored without compression
+    (video is already compressed) and written with data descriptors, so no
+    seeking is needed and only one read chunk is buffered at a time.
+    """
+
+    def __init__(self) -> None:
+        self._buffer = _ChunkBuffer()
+        self._zip = zipfile.ZipFile(self._buffer, mode="w", compression=zipfile.ZIP_STORED)
+        self._names: set = set()
+
+    def _unique_name(self, name: str) -> str:
+        stem, dot, ext = name.rpartition(".")
+        candidate, n = name, 1
+        while candidate in self._names:
+            n += 1
+            candidate = f"{stem} ({n}).{ext}" if dot else f"{name} ({n})"
+        self._names.add(candidate)
+        return candidate
+
+    def add_file(self, name: str, path: Path) -> Iterator[bytes]:
+        """
+        Adds the file at path as `name`, yielding archive bytes as they are produced.
+        """
+        with open(path, "rb") as source, self._zip.open(self._unique_name(name), mode="w", force_zip64=True) as member:
+            while True:
+                data = source.read(ZIP_CHUNK_SIZE)
+                if not data:
+                    break
+                member.write(data)
+                chunk = self._buffer.drain()
+                if chunk:
+                    yield chunk
+        # Closing the member writes its data descriptor
+        chunk = self._buffer.drain()
+        if chunk:
+            yield chunk
+
+    async def add_file_async(self, name: str, path: Path) -> AsyncIterator[bytes]:
+        """
+        Like add_file, but reads and packs each chunk on a thread, so the
+        event loop is not blocked on disk reads.
+        """
+        chunks = self.add_file(name, path)
+        try:
+            while True:
+                chunk = await asyncio.to_thread(next, chunks, None)
+                if chunk is None:
+                    return
+                yield chunk
+        finally:
+            if not chunks.gi_running: # Still running on the thread if we were cancelled mid-read
+                chunks.close()
+
+    def add_bytes(self, name: str, data: bytes) -> bytes:
+        self._zip.writestr(self._unique_name(name), data)
+        return self._buffer.drain()
+
+    def close(self) -> bytes:
+        """
+        Writes the central directory and returns the final bytes of the archive.
+        """
+        self._zip.close()
+        return self._buffer.drain()
@@ -0,0 +1,132 @@
+import os
+import time
+import hashlib
+import logging
+from pathlib import Path
+from contextlib import contextmanager
+from typing import Optional, Iterator
+
+from .processor import TEMP_DIR_BASE
+from .config import CACHE_MAX_BYTES, CACHE_TTL
+from .metrics import CACHE_REQUESTS
+
+try:
+    import fcntl # POSIX only; used to serialise eviction across uvicorn workers
+except ImportError: # pragma: no cover - Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Muxed outputs are stored as <key>.mp4 in this directory. It lives under
+# TEMP_DIR_BASE so that storing a finished file is an atomic rename.
+# An entry's atime records when it was last used, for LRU eviction and the
+# TTL. Its mtime is left alone, so it identifies the stored content: an entry
+# that is evicted and produced again gets a new mtime (see outputs.py).
+CACHE_DIR = TEMP_DIR_BASE / "cache"
+LOCK_PATH = CACHE_DIR / ".lock"
+
+
+def cache_key(extractor: Optional[str], video_id: Optional[str], *format_ids: Optional[str]) -> Optional[str]:
+    """
+    Builds a content-addressed cache key from the canonical video identity and
+    the selected format IDs. Returns None if the identity is incomplete.
+    """
+    if not video_id or not all(format_ids):
+        return None
+    raw = "|".join([extractor or "", video_id, *format_ids])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def cache_path(key: str) -> Path:
+    return CACHE_DIR / f"{key}.mp4"
+
+
+def _touch(path: Path, stat: os.stat_result) -> None:
+    """Marks an entry as used now, keeping its mtime."""
+    os.utime(path, ns=(time.time_ns(), stat.st_mtime_ns))
+
+
+@contextmanager
+def _cache_lock() -> Iterator[None]:
+    """
+    Exclusive inter-process lock around eviction. Lookups and stores do not need
+    it because they only rely on atomic renames and unlinks.
+    """
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    if fcntl is None:
+        yield
+        return
+    with open(LOCK_PATH, "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def lookup(key: str) -> Optional[Path]:
+    """
+    Returns the cached file for key, or None on a miss. A hit refreshes the
+    entry's atime, which is what LRU eviction and the TTL are based on.
+    """
+    path = cache_path(key)
+    try:
+        stat = path.stat()
+    except FileNotFoundError:
+        CACHE_REQUESTS.inc(1, "output", "miss")
+        return None
+    if CACHE_TTL and time.time() - stat.st_atime > CACHE_TTL:
+        logger.info("Cache entry expired: %s", path.name)
+        path.unlink(missing_ok=True)
+        CACHE_REQUESTS.inc(1, "output", "miss")
+        return None
+    try:
+        _touch(path, stat)
+    except FileNotFoundError: # Evicted by another worker in the meantime
+        CACHE_REQUESTS.inc(1, "output", "miss")
+        return None
+    CACHE_REQUESTS.inc(1, "output", "hit")
+    return path
+
+
+def store(key: str, source_path: Path) -> Path:
+    """
+    Moves a finished file into the cache and runs eviction.
+    The rename is atomic, so readers never see a partially written entry.
+    """
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    path = cache_path(key)
+    os.replace(source_path, path)
+    _touch(path, path.stat())
+    logger.info("Stored muxed output in cache: %s", path.name)
+    evict(keep=path)
+    return path
+
+
+def evict(keep: Optional[Path] = None) -> None:
+    """
+    Removes expired entries, then least recently used entries until the cache
+    fits in CACHE_MAX_BYTES. `keep` is never evicted (the file about to be served).
+    """
+    with _cache_lock():
+        now = time.time()
+        entries = []
+        for path in CACHE_DIR.glob("*.mp4"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            if CACHE_TTL and now - stat.st_atime > CACHE_TTL and path != keep:
+                path.unlink(missing_ok=True)
+                continue
+            entries.append((stat.st_atime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= CACHE_MAX_BYTES:
+                break
+            if path == keep:
+                continue
+            path.unlink(missing_ok=True)
+            total -= size
+            logger.info("Evicted cache entry %s (%s bytes)", path.name, size)
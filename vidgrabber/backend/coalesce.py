@@ -0,0 +1,122 @@
+import asyncio
+import logging
+from pathlib import Path
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 65536
+
+
+class SingleFlight:
+    """
+    Deduplicates concurrent work by key: the first caller starts the coroutine
+    as a task and later callers with the same key await that same task.
+    The task is shielded, so one caller disconnecting does not cancel the
+    work for everyone else.
+    """
+
+    def __init__(self) -> None:
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._tasks
+
+    async def do(self, key: str, factory: Callable[[], Awaitable[Any]]) -> Any:
+        return await asyncio.shield(self.start(key, factory))
+
+    def start(self, key: str, factory: Callable[[], Awaitable[Any]]) -> asyncio.Task:
+        """
+        Returns the in-flight task for key, starting factory() as a new one if
+        there is none. The task is registered before this returns, so work
+        started in the background is joined by the very next caller.
+        """
+        task = self._tasks.get(key)
+        if task is None:
+            task = asyncio.create_task(factory())
+            self._tasks[key] = task
+            task.add_done_callback(lambda t: self._forget(key, t))
+        else:
+            logger.info("Joining in-flight job %s", key[:16])
+        return task
+
+    def _forget(self, key: str, task: asyncio.Task) -> None:
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+        # Mark the exception as retrieved in case every waiter went away
+        if not task.cancelled():
+            task.exception()
+
+
+class SharedStream:
+    """
+    Fans one producer's output out to any number of readers by teeing it into
+    a file. Readers that join late start from the beginning of the file and
+    then follow it as it grows, so everyone receives the complete output.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.size = 0
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self._changed = asyncio.Condition()
+        # Create the file up front so readers can open it as soon as they attach
+        self._file = open(path, 'wb')
+
+    async def _notify(self) -> None:
+        async with self._changed:
+            self._changed.notify_all()
+
+    async def produce(self, chunks: AsyncIterator[bytes]) -> None:
+        """
+        Writes every chunk to the backing file and wakes waiting readers.
+        """
+        try:
+            async for chunk in chunks:
+                self._file.write(chunk)
+                self._file.flush()
+                self.size += len(chunk)
+                await self._notify()
+        except BaseException as e:
+            self.error = e
+            raise
+        finally:
+            self._file.close()
+            self.done = True
+            await self._notify()
+
+    async def wait_for_output(self) -> None:
+        """
+        Waits until the producer has written its first bytes or finished.
+        Raises RuntimeError if it failed before producing anything.
+        """
+        async with self._changed:
+            await self._changed.wait_for(lambda: self.size > 0 or self.done)
+        if self.size == 0 and self.error is not None:
+            raise RuntimeError(f"Shared stream failed: {self.error}")
+
+    def reader(self) -> AsyncIterator[bytes]:
+        """
+        Returns an iterator over the full output. The file is opened right away,
+        so the reader keeps working even if the file is renamed or unlinked later.
+        """
+        return self._read(open(self.path, 'rb'))
+
+    async def _read(self, f) -> AsyncIterator[bytes]:
+        offset = 0
+        try:
+            while True:
+                if offset < self.size:
+                    data = f.read(min(CHUNK_SIZE, self.size - offset))
+                    offset += len(data)
+                    yield data
+                    continue
+                if self.done:
+                    if self.error is not None:
+                        raise RuntimeError(f"Shared stream failed: {self.error}")
+                    return
+                async with self._changed:
+                    await self._changed.wait_for(lambda: self.size > offset or self.done)
+        finally:
+            f.close()
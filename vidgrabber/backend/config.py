@@ -0,0 +1,141 @@
+import os
+
+# Runtime settings for the backend. Every value can be overridden with an
+# environment variable so a deployment can be tuned without code changes.
+
+
+def _env_int(name: str, default: int) -> int:
+    """
+    Reads an integer setting from the environment, falling back to default
+    when the variable is unset or not a valid integer.
+    """
+    value = os.environ.get(name)
+    if value is None or value.strip() == "":
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        return default
+
+
+def _env_float(name: str, default: float) -> float:
+    """
+    Reads a float setting from the environment, falling back to default
+    when the variable is unset or not a valid number.
+    """
+    value = os.environ.get(name)
+    if value is None or value.strip() == "":
+        return default
+    try:
+        return float(value)
+    except ValueError:
+        return default
+
+
+# Directory for scratch files and the output cache. Defaults to backend/temp_files.
+TEMP_DIR = os.environ.get("VIDGRABBER_TEMP_DIR") or None
+# FFmpeg executable. Defaults to the first ffmpeg in PATH.
+FFMPEG_PATH = os.environ.get("VIDGRABBER_FFMPEG_PATH") or None
+# Level of the application's log output (DEBUG, INFO, WARNING, ...).
+LOG_LEVEL = os.environ.get("VIDGRABBER_LOG_LEVEL", "INFO").upper()
+
+# --- Server (python -m backend.serve) ---
+# Worker processes forked from the preloaded server process.
+WORKERS = _env_int("VIDGRABBER_WORKERS", 1)
+HOST = os.environ.get("VIDGRABBER_HOST", "127.0.0.1")
+PORT = _env_int("VIDGRABBER_PORT", 8000)
+# How often each worker shares its metrics with the others (seconds).
+METRICS_SNAPSHOT_INTERVAL = _env_float("VIDGRABBER_METRICS_SNAPSHOT_INTERVAL", 5.0)
+
+# --- Concurrency limits ---
+# Thread and job limits are per worker process. The mux, download and bandwidth limits
+# are for the whole server; backend.serve splits them between its workers.
+# Threads used to run blocking yt-dlp extraction.
+EXTRACT_WORKERS = _env_int("VIDGRABBER_EXTRACT_WORKERS", 8)
+# Maximum number of process_and_download_video jobs in flight at once, per worker.
+MAX_CONCURRENT_JOBS = _env_int("VIDGRABBER_MAX_CONCURRENT_JOBS", 32)
+# Maximum number of ffmpeg processes running at once.
+MAX_CONCURRENT_MUXES = _env_int("VIDGRABBER_MAX_CONCURRENT_MUXES", 4)
+
+# --- Admission control for upstream fetches ---
+# Stream downloads running at once in total, and connections open at once per upstream site (0 = unlimited).
+MAX_CONCURRENT_DOWNLOADS = _env_int("VIDGRABBER_MAX_CONCURRENT_DOWNLOADS", 16)
+MAX_DOWNLOADS_PER_HOST = _env_int("VIDGRABBER_MAX_DOWNLOADS_PER_HOST", 6)
+# Download bandwidth caps in bytes per second, in total and per upstream site (0 = unlimited).
+DOWNLOAD_BANDWIDTH = _env_int("VIDGRABBER_DOWNLOAD_BANDWIDTH", 0)
+HOST_BANDWIDTH = _env_int("VIDGRABBER_HOST_BANDWIDTH", 0)
+# Free space kept on the temp directory's filesystem beyond all reservations.
+DISK_HEADROOM = _env_int("VIDGRABBER_DISK_HEADROOM", 1024 ** 3)
+# Disk reserved for a job whose stream sizes are not known from the metadata.
+DISK_RESERVATION_DEFAULT = _env_int("VIDGRABBER_DISK_RESERVATION_DEFAULT", 512 * 1024 ** 2)
+# How long a request waits for a download, mux or disk slot before a 503 (seconds).
+# Background jobs and batches always wait.
+ADMISSION_TIMEOUT = _env_float("VIDGRABBER_ADMISSION_TIMEOUT", 10.0)
+# Requests already waiting for one kind of slot beyond which new ones get a 503 right away.
+ADMISSION_QUEUE_LIMIT = _env_int("VIDGRABBER_ADMISSION_QUEUE_LIMIT", 64)
+# Retry-After sent with 503 responses (seconds).
+ADMISSION_RETRY_AFTER = _env_int("VIDGRABBER_ADMISSION_RETRY_AFTER", 10)
+
+# --- Background job queue ---
+# Worker tasks pulling from the job queue.
+JOB_WORKERS = _env_int("VIDGRABBER_JOB_WORKERS", 4)
+# How long finished jobs and their results stay fetchable (seconds).
+JOB_RETENTION = _env_int("VIDGRABBER_JOB_RETENTION", 3600)
+# Lowest job priority a client can ask for. Requested priorities are clamped to
+# 0..JOB_MAX_PRIORITY, so a client can only move its own jobs back, never ahead.
+JOB_MAX_PRIORITY = _env_int("VIDGRABBER_JOB_MAX_PRIORITY", 9)
+
+# --- Batch and playlist processing ---
+# Maximum number of videos in one batch request; longer playlists are truncated.
+BATCH_MAX_ITEMS = _env_int("VIDGRABBER_BATCH_MAX_ITEMS", 200)
+# Items allowed to wait between two pipeline stages (extract -> download -> mux).
+BATCH_PIPELINE_DEPTH = _env_int("VIDGRABBER_BATCH_PIPELINE_DEPTH", 1)
+
+# --- Segmented downloads ---
+# Number of parallel HTTP Range requests used for one large stream.
+DOWNLOAD_SEGMENTS = _env_int("VIDGRABBER_DOWNLOAD_SEGMENTS", 4)
+# Streams smaller than this (bytes) are fetched with a single GET.
+SEGMENT_MIN_SIZE = _env_int("VIDGRABBER_SEGMENT_MIN_SIZE", 8 * 1024 * 1024)
+
+# --- Scratch space ---
+# Job directories idle for longer than this are removed by the janitor (seconds).
+SCRATCH_MAX_AGE = _env_int("VIDGRABBER_SCRATCH_MAX_AGE", 6 * 3600)
+# How long finished outputs that are not in the cache stay downloadable (seconds).
+# Keep it at least JOB_RETENTION so job results stay fetchable.
+OUTPUT_RETENTION = _env_int("VIDGRABBER_OUTPUT_RETENTION", 3600)
+# Size quota for scratch files and finished outputs, excluding the cache (0 = unlimited).
+SCRATCH_MAX_BYTES = _env_int("VIDGRABBER_SCRATCH_MAX_BYTES", 20 * 1024 ** 3)
+# Seconds between janitor passes.
+JANITOR_INTERVAL = _env_int("VIDGRABBER_JANITOR_INTERVAL", 300)
+# Optional memory-backed directory (e.g. /dev/shm) for small audio streams.
+MEMORY_SCRATCH_DIR = os.environ.get("VIDGRABBER_MEMORY_SCRATCH_DIR") or None
+# Largest expected stream size placed in MEMORY_SCRATCH_DIR, and the total it may hold per worker.
+MEMORY_SCRATCH_MAX_FILE = _env_int("VIDGRABBER_MEMORY_SCRATCH_MAX_FILE", 32 * 1024 ** 2)
+MEMORY_SCRATCH_MAX_BYTES = _env_int("VIDGRABBER_MEMORY_SCRATCH_MAX_BYTES", 256 * 1024 ** 2)
+
+# --- Muxed output cache ---
+# Total size budget for cached muxed files; least recently used entries are evicted first.
+CACHE_MAX_BYTES = _env_int("VIDGRABBER_CACHE_MAX_BYTES", 10 * 1024 ** 3)
+# Entries older than this (seconds since last use) are evicted. 0 disables the TTL.
+CACHE_TTL = _env_int("VIDGRABBER_CACHE_TTL", 24 * 3600)
+
+# --- Metadata cache and extractor pool ---
+# Upper bound on how long extracted video info is reused (seconds). Entries
+# expire earlier if the signed stream URLs carry a sooner expiry.
+METADATA_CACHE_TTL = _env_int("VIDGRABBER_METADATA_CACHE_TTL", 3600)
+METADATA_CACHE_MAX_ENTRIES = _env_int("VIDGRABBER_METADATA_CACHE_MAX_ENTRIES", 1024)
+# Number of YoutubeDL instances created up front; defaults to one per extraction thread.
+EXTRACTOR_POOL_SIZE = _env_int("VIDGRABBER_EXTRACTOR_POOL_SIZE", EXTRACT_WORKERS)
+
+# --- HTTP connection pool and retries ---
+HTTP_MAX_CONNECTIONS = _env_int("VIDGRABBER_HTTP_MAX_CONNECTIONS", 100)
+HTTP_MAX_KEEPALIVE = _env_int("VIDGRABBER_HTTP_MAX_KEEPALIVE", 20)
+# Retries per stream (or per segment) after a transient failure.
+DOWNLOAD_RETRIES = _env_int("VIDGRABBER_DOWNLOAD_RETRIES", 5)
+# Exponential backoff between retries: RETRY_BACKOFF * 2**n seconds, capped at RETRY_BACKOFF_MAX.
+RETRY_BACKOFF = _env_float("VIDGRABBER_RETRY_BACKOFF", 0.5)
+RETRY_BACKOFF_MAX = _env_float("VIDGRABBER_RETRY_BACKOFF_MAX", 10.0)
+
+# --- Timeouts (seconds) ---
+HTTP_TIMEOUT = _env_float("VIDGRABBER_HTTP_TIMEOUT", 30.0)
+FFMPEG_TIMEOUT = _env_float("VIDGRABBER_FFMPEG_TIMEOUT", 300.0)
@@ -1,129 +1,467 @@
-import yt_dlp
-from yt_dlp.utils import DownloadError, ExtractorError
 import re # For cleaning filename
+import time
+import queue
 import logging
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Dict, Any, Optional, Iterator, List, NamedTuple, Tuple
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+from .config import METADATA_CACHE_TTL, METADATA_CACHE_MAX_ENTRIES, EXTRACTOR_POOL_SIZE, BATCH_MAX_ITEMS
+from .metrics import timed, CACHE_REQUESTS
+
+if TYPE_CHECKING:
+    import yt_dlp
 
-# Configure basic logging for this module if not already configured by a higher-level module
-# This assumes that if a root logger is configured, this will just use it.
 logger = logging.getLogger(__name__)
-if not logger.handlers: # Check if handlers are already configured
-    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
-
-
-def get_video_info(video_url: str):
-    """
-    Uses yt-dlp to fetch metadata and URLs for the best video and audio streams
-    suitable for muxing.
-    Returns a dictionary with title, thumbnail, video_url, audio_url, and suggested_filename.
-    """
-
-    # Format selection:
-    # - 'bv*[ext=mp4]' : Best video-only stream with mp4 extension.
-    # - 'ba[ext=m4a]' : Best audio-only stream with m4a extension (AAC).
-    # - '/b[ext=mp4]' : Fallback to best overall stream with mp4 extension (might be muxed).
-    # - 'bv*+ba' : Fallback to best video-only and best audio-only of any extension.
-    # - '/b' : Final fallback to best overall of any extension.
-    # Prioritize mp4/m4a for wider compatibility and because FFmpeg handles them well.
-    ydl_opts = {
-        'quiet': True,
-        'no_warnings': True,
-        'skip_download': True,
-        'format': 'bv*[ext=mp4]+ba[ext=m4a]/b[ext=mp4]/bv*+ba/b',
-        # 'format_sort': ['res,fps,hdr:12,vcodec:vp9.2,channels,acodec,size,tbr,asr'], # yt-dlp default sort
-    }
 
+# yt-dlp is imported on first use rather than with this module: its import
+# and extractor registry dominate a worker's startup time and memory. The
+# preloading server (serve.py) calls preload_extractors() before forking, so
+# there the cost is paid once and the pages are shared by all workers.
+
+
+# Formats are not selected by yt-dlp: every format it reports is indexed once
+# by FormatIndex (below), and each request picks from that index according to
+# its own quality constraints.
+YDL_OPTS = {
+    'quiet': True,
+    'no_warnings': True,
+    'skip_download': True,
+}
+
+# Flat extraction only lists the entries of a playlist (URL, ID, title) without
+# resolving each video's formats, so a long playlist expands in one request.
+YDL_FLAT_OPTS = {
+    'quiet': True,
+    'no_warnings': True,
+    'skip_download': True,
+    'extract_flat': 'in_playlist',
+    'playlistend': BATCH_MAX_ITEMS,
+}
+
+# --- Warm extractor pool ---
+# Building a YoutubeDL instance loads and configures the extractor registry,
+# which is expensive. Instances are not thread-safe, so each extraction checks
+# one out of this pool and returns it afterwards.
+_ydl_pool: "queue.Queue[yt_dlp.YoutubeDL]" = queue.Queue(maxsize=max(1, EXTRACTOR_POOL_SIZE))
+
+def preload_extractors() -> None:
+    """
+    Imports yt-dlp and loads all of its extractor classes.
+    """
+    from yt_dlp.extractor import gen_extractor_classes
+    gen_extractor_classes()
+
+def warm_extractor_pool(size: int = EXTRACTOR_POOL_SIZE) -> None:
+    """
+    Pre-initializes up to `size` YoutubeDL instances so the first requests skip the cold setup.
+    """
+    import yt_dlp
+    for _ in range(max(0, size - _ydl_pool.qsize())):
+        try:
+            _ydl_pool.put_nowait(yt_dlp.YoutubeDL(YDL_OPTS))
+        except queue.Full:
+            break
+
+@contextmanager
+def _pooled_ydl() -> Iterator["yt_dlp.YoutubeDL"]:
+    """
+    Checks a YoutubeDL instance out of the pool, creating one if the pool is empty.
+    Instances that raised an unexpected error are discarded instead of returned.
+    """
+    import yt_dlp
+    from yt_dlp.utils import DownloadError, ExtractorError
     try:
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(video_url, download=False)
+        ydl = _ydl_pool.get_nowait()
+    except queue.Empty:
+        ydl = yt_dlp.YoutubeDL(YDL_OPTS)
+    try:
+        yield ydl
+    except (ExtractorError, DownloadError):
+        _release_ydl(ydl) # Normal per-URL failures; the instance itself is fine
+        raise
+    except BaseException:
+        ydl.close()
+        raise
+    else:
+        _release_ydl(ydl)
+
+def _release_ydl(ydl: "yt_dlp.YoutubeDL") -> None:
+    try:
+        _ydl_pool.put_nowait(ydl)
+    except queue.Full:
+        ydl.close()
+
+# --- Metadata cache ---
+# Successful get_video_info results keyed by normalized URL, in LRU order.
+# Each value is (expires_at, info).
+_metadata_cache: "OrderedDict[str, tuple]" = OrderedDict()
+_metadata_lock = threading.Lock()
+# Stream URLs are treated as expired this many seconds before their signed expiry
+EXPIRY_SAFETY_MARGIN = 120
+
+_TRACKING_PARAMS = {'si', 'feature', 'fbclid', 'igshid', 'gclid', 'pp'}
+_YOUTUBE_HOSTS = {'youtube.com', 'm.youtube.com', 'music.youtube.com', 'youtu.be'}
+
+def normalize_url(video_url: str) -> str:
+    """
+    Normalizes a video page URL so equivalent links share one cache entry:
+    lowercases the host, drops fragments and tracking parameters, sorts the
+    query, and rewrites YouTube short/embed/shorts links to the watch form.
+    """
+    parts = urlsplit(video_url.strip())
+    host = parts.netloc.lower()
+    if host.startswith('www.'):
+        host = host[4:]
+    query = [(k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+             if k not in _TRACKING_PARAMS and not k.startswith('utm_')]
+
+    if host in _YOUTUBE_HOSTS:
+        video_id = None
+        if host == 'youtu.be':
+            video_id = parts.path.strip('/').split('/')[0]
+        else:
+            match = re.match(r'^/(?:shorts|embed|live)/([\w-]+)', parts.path)
+            if match:
+                video_id = match.group(1)
+            elif parts.path == '/watch':
+                video_id = dict(query).get('v')
+        if video_id:
+            return f"https://www.youtube.com/watch?v={video_id}"
+
+    path = parts.path.rstrip('/') or '/'
+    return urlunsplit(('https' if parts.scheme in ('http', 'https') else parts.scheme,
+                       host, path, urlencode(sorted(query)), ''))
+
+def _stream_url_expiry(stream_url: Optional[str]) -> Optional[float]:
+    """
+    Returns the expiry timestamp embedded in a signed stream URL (the
+    'expire' query parameter used by googlevideo and similar CDNs), if any.
+    """
+    if not stream_url:
+        return None
+    expire = dict(parse_qsl(urlsplit(stream_url).query)).get('expire')
+    return float(expire) if expire and expire.isdigit() else None
+
+def _cache_expiry(info: Dict[str, Any]) -> float:
+    expires_at = time.time() + METADATA_CACHE_TTL
+    for stream_url in (info.get("video_url"), info.get("audio_url")):
+        signed_expiry = _stream_url_expiry(stream_url)
+        if signed_expiry is not None:
+            expires_at = min(expires_at, signed_expiry - EXPIRY_SAFETY_MARGIN)
+    return expires_at
+
+def get_video_info(video_url: str) -> Dict[str, Any]:
+    """
+    Returns video info for video_url, served from the metadata cache when a
+    fresh entry exists. Only successful results are cached.
+    See _extract_video_info for the returned fields.
+    """
+    key = normalize_url(video_url)
+    now = time.time()
+    with _metadata_lock:
+        entry = _metadata_cache.get(key)
+        if entry is not None:
+            expires_at, info = entry
+            if expires_at > now:
+                _metadata_cache.move_to_end(key)
+                CACHE_REQUESTS.inc(1, "metadata", "hit")
+                return dict(info, original_url=video_url)
+            del _metadata_cache[key]
+
+    CACHE_REQUESTS.inc(1, "metadata", "miss")
+    with timed("extract"):
+        info = _extract_video_info(video_url)
+    if info.get("error"):
+        return info
+
+    expires_at = _cache_expiry(info)
+    if expires_at > now:
+        with _metadata_lock:
+            _metadata_cache[key] = (expires_at, info)
+            _metadata_cache.move_to_end(key)
+            while len(_metadata_cache) > METADATA_CACHE_MAX_ENTRIES:
+                _metadata_cache.popitem(last=False)
+    return dict(info)
+
+def expand_playlist(playlist_url: str) -> Dict[str, Any]:
+    """
+    Lists the video URLs of a playlist (or channel, or similar) using flat
+    extraction, up to BATCH_MAX_ITEMS entries. A URL that is a single video
+    expands to itself.
+    Returns a dictionary with title and entries (a list of URLs), or error.
+    """
+    import yt_dlp
+    from yt_dlp.utils import DownloadError, ExtractorError
+    try:
+        # Flat extraction uses different options than the pooled instances
+        with yt_dlp.YoutubeDL(YDL_FLAT_OPTS) as ydl, timed("expand"):
+            info = ydl.extract_info(playlist_url, download=False)
+    except (ExtractorError, DownloadError) as e:
+        logger.error("Failed to expand playlist %s: %s", playlist_url, e)
+        return {"error": f"Failed to process URL: {str(e)}", "original_url": playlist_url}
+    except Exception as e:
+        logger.error("An unexpected error occurred expanding playlist %s: %s", playlist_url, e, exc_info=True)
+        return {"error": "An unexpected error occurred while listing the playlist.", "original_url": playlist_url}
+
+    if info.get("_type") not in ("playlist", "multi_video"):
+        return {"title": info.get("title"), "entries": [info.get("webpage_url") or playlist_url]}
+
+    entries: List[str] = []
+    for entry in info.get("entries") or []:
+        if not entry:
+            continue # Unavailable or private entries come back as None
+        entry_url = entry.get("url") or entry.get("webpage_url")
+        if entry_url:
+            entries.append(entry_url)
+        if len(entries) >= BATCH_MAX_ITEMS:
+            break
+    if not entries:
+        return {"error": "The playlist has no available videos.", "original_url": playlist_url}
+    return {"title": info.get("title"), "entries": entries}
+
+def _format_filesize(fmt: Dict[str, Any]) -> Optional[int]:
+    """
+    Returns a format's size in bytes: exact if yt-dlp knows it, otherwise its
+    bitrate-based estimate, or None.
+    """
+    size = fmt.get('filesize') or fmt.get('filesize_approx')
+    return int(size) if size else None
+
+# --- Format index ---
+# Codec string prefixes (as reported by yt-dlp) and the family they belong to,
+# so a request for "h264" matches "avc1.64001F" and "av1" matches "av01.0.08M.08".
+_CODEC_FAMILIES = (
+    ("avc", "h264"), ("h264", "h264"),
+    ("hvc", "h265"), ("hev", "h265"), ("h265", "h265"),
+    ("vp09", "vp9"), ("vp9", "vp9"), ("vp8", "vp8"),
+    ("av01", "av1"), ("av1", "av1"),
+)
+
+def codec_family(codec: Optional[str]) -> Optional[str]:
+    """
+    Normalizes a codec string to its family name (h264, h265, vp9, av1, ...).
+    """
+    if not codec or codec == 'none':
+        return None
+    codec = codec.lower()
+    if codec == 'hevc':
+        return "h265"
+    for prefix, family in _CODEC_FAMILIES:
+        if codec.startswith(prefix):
+            return family
+    return codec.split('.')[0]
+
+class IndexedFormat(NamedTuple):
+    format_id: str
+    url: str
+    ext: Optional[str]
+    codec: Optional[str] # Video codec family; None for audio-only formats
+    height: Optional[int]
+    filesize: Optional[int]
+
+class FormatIndex:
+    """
+    The downloadable formats of one video, split into video-only, audio-only
+    and progressive (video with audio) lists, each sorted best first. Built
+    once per extraction and kept in the metadata cache, so choosing formats
+    for a request is a short scan instead of another yt-dlp run.
+
+    Formats in the container FFmpeg writes (mp4 video, m4a audio) rank ahead
+    of higher quality in other containers, as the old yt-dlp format selector
+    'bv*[ext=mp4]+ba[ext=m4a]/b[ext=mp4]/bv*+ba/b' did.
+    """
+
+    def __init__(self, formats: List[Dict[str, Any]]) -> None:
+        video, audio, progressive = [], [], []
+        for fmt in formats:
+            # Manifests (HLS/DASH) would need a segment downloader; skip them
+            if not fmt.get('url') or fmt.get('protocol', 'https') not in ('http', 'https'):
+                continue
+            has_video = fmt.get('vcodec') != 'none'
+            has_audio = fmt.get('acodec') != 'none'
+            entry = IndexedFormat(str(fmt.get('format_id') or ''), fmt['url'], fmt.get('ext'),
+                                  codec_family(fmt.get('vcodec')) if has_video else None,
+                                  fmt.get('height'), _format_filesize(fmt))
+            if has_video and has_audio:
+                progressive.append(((fmt.get('ext') == 'mp4', fmt.get('height') or 0, fmt.get('tbr') or 0), entry))
+            elif has_video:
+                video.append(((fmt.get('ext') == 'mp4', fmt.get('height') or 0, fmt.get('fps') or 0, fmt.get('tbr') or 0), entry))
+            elif has_audio:
+                audio.append(((fmt.get('ext') == 'm4a', fmt.get('abr') or fmt.get('tbr') or 0), entry))
+            # Neither: storyboards and the like
+        self.video: List[IndexedFormat] = [entry for _, entry in sorted(video, key=lambda x: x[0], reverse=True)]
+        self.audio: List[IndexedFormat] = [entry for _, entry in sorted(audio, key=lambda x: x[0], reverse=True)]
+        self.progressive: List[IndexedFormat] = [entry for _, entry in sorted(progressive, key=lambda x: x[0], reverse=True)]
+
+    def select(self, max_height: Optional[int] = None, vcodec: Optional[str] = None,
+               max_filesize: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        """
+        Picks the best formats within the limits: a video-only and an
+        audio-only format to mux, or a progressive format to pass through
+        as is. The progressive format wins if its resolution is at least that
+        of the muxable pair, since it needs no download-and-mux step at all.
+        Formats whose height or size is unknown do not satisfy a limit on it.
+        Returns the selection fields for the video info, or None if nothing fits.
+        """
+        family = codec_family(vcodec) if vcodec else None
 
-            title = info.get("title", "Untitled_Video")
-            # Clean the title to create a safe filename
-            safe_title = re.sub(r'[\/*?:"<>|]', "", title) # Remove illegal characters
-            safe_title = re.sub(r'\s+', '_', safe_title) # Replace spaces with underscores
-            suggested_filename = f"{safe_title[:100]}.mp4" # Limit length and add .mp4 extension
-
-            video_stream_url = None
-            audio_stream_url = None
-
-            # Requested formats are those chosen by yt-dlp based on the format string.
-            # If 'requested_formats' is present, it means yt-dlp selected separate video and audio.
-            if info.get('requested_formats'):
-                video_format = info['requested_formats'][0] # First one is usually video
-                audio_format = info['requested_formats'][1] # Second one is usually audio
-
-                # Check if they are indeed video and audio respectively
-                if video_format.get('vcodec') != 'none' and video_format.get('acodec') == 'none':
-                    video_stream_url = video_format.get('url')
-                if audio_format.get('acodec') != 'none' and audio_format.get('vcodec') == 'none':
-                    audio_stream_url = audio_format.get('url')
-
-                # Fallback if the order is swapped or if one is muxed and the other is audio
-                if not video_stream_url and audio_format.get('vcodec') != 'none' and audio_format.get('acodec') == 'none':
-                     video_stream_url = audio_format.get('url')
-                if not audio_stream_url and video_format.get('acodec') != 'none' and video_format.get('vcodec') == 'none':
-                     audio_stream_url = video_format.get('url')
-
-
-            # If 'requested_formats' isn't there, or if we couldn't get both URLs from it,
-            # it might be that yt-dlp selected a single, already muxed format.
-            # Or, it might be a single video-only or audio-only stream if that's all that matched.
-            if not (video_stream_url and audio_stream_url):
-                # Check if the main 'url' entry is for a pre-muxed file (has both codecs)
-                if info.get('url') and info.get('vcodec') != 'none' and info.get('acodec') != 'none':
-                    # This is a pre-muxed format, we can't use it for muxing with a separate audio.
-                    # This part of the logic indicates that we might need to adjust format selection
-                    # or downloader logic if we *only* want to mux.
-                    # For now, if we hit this, it means our format selector gave us something already muxed.
-                    # This isn't ideal for the muxing flow, but we'll flag it.
-                    # To strictly enforce separate streams, the format selector would be just 'bv*+ba'.
-                    # Let's assume for now the goal is to get *some* video and audio, even if one is from a muxed source
-                    # and the other is a separate audio track (less common).
-                    # The chosen format string 'bv*[ext=mp4]+ba[ext=m4a]/b[ext=mp4]/bv*+ba/b' tries to get separate streams first.
-                    # If it results in a single format in `info['formats']` that is muxed, then `info['url']` will be that.
-
-                    # If we got here, it means the primary format selection likely resulted in a single (possibly muxed) file.
-                    # This is a simplification for now. A more robust solution would iterate through info.get('formats')
-                    # to find distinct video and audio if `requested_formats` is not as expected.
-                    # Given the format string, `requested_formats` *should* be populated if distinct streams are chosen.
-                    # If not, it implies `yt-dlp` chose one of the fallback single formats (e.g., `/b[ext=mp4]`).
-                     return {
-                        "error": "Could not reliably identify separate video and audio streams for muxing. The selected format might be a single file.",
-                        "title": title,
-                        "thumbnail": info.get("thumbnail"),
-                        "suggested_filename": suggested_filename,
-                        "video_url": info.get('url') if info.get('vcodec') != 'none' else None, # If it's a single file, use its URL as video
-                        "audio_url": None # No separate audio URL in this case
-                    }
-
-
-            if not video_stream_url or not audio_stream_url:
-                # This can happen if the video is audio-only, video-only, or format selection failed
-                error_message = "Could not retrieve separate video and audio stream URLs. The content might be audio-only, video-only, or the requested formats are unavailable."
-                if info.get('vcodec') == 'none' and info.get('acodec') != 'none':
-                    error_message = "The content appears to be audio-only."
-                elif info.get('acodec') == 'none' and info.get('vcodec') != 'none':
-                    error_message = "The content appears to be video-only (no audio track)."
-
-                return {"error": error_message, "title": title, "thumbnail": info.get("thumbnail")}
+        def fits(fmt: IndexedFormat) -> bool:
+            if max_height is not None and (fmt.height is None or fmt.height > max_height):
+                return False
+            return family is None or fmt.codec == family
 
+        pair: Optional[Tuple[IndexedFormat, IndexedFormat]] = None
+        for video in self.video:
+            if not fits(video):
+                continue
+            if max_filesize is None:
+                audio = self.audio[0] if self.audio else None
+            elif video.filesize is None or video.filesize >= max_filesize:
+                continue
+            else:
+                budget = max_filesize - video.filesize
+                audio = next((a for a in self.audio if a.filesize is not None and a.filesize <= budget), None)
+            if audio is not None:
+                pair = (video, audio)
+                break
+
+        progressive = next((fmt for fmt in self.progressive if fits(fmt) and (
+            max_filesize is None or (fmt.filesize is not None and fmt.filesize <= max_filesize))), None)
+
+        if progressive is not None and (pair is None or (progressive.height or 0) >= (pair[0].height or 0)):
             return {
-                "title": title,
-                "thumbnail": info.get("thumbnail"),
-                "video_url": video_stream_url,
-                "audio_url": audio_stream_url,
-                "suggested_filename": suggested_filename,
-                "original_url": video_url # Keep original_url for context
+                "progressive": True,
+                "video_url": progressive.url,
+                "audio_url": None,
+                "video_format_id": progressive.format_id,
+                "audio_format_id": None,
+                "video_filesize": progressive.filesize,
+                "audio_filesize": None,
+                "ext": progressive.ext or "mp4",
+                "height": progressive.height,
             }
+        if pair is None:
+            return None
+        video, audio = pair
+        return {
+            "progressive": False,
+            "video_url": video.url,
+            "audio_url": audio.url,
+            "video_format_id": video.format_id,
+            "audio_format_id": audio.format_id,
+            "video_filesize": video.filesize,
+            "audio_filesize": audio.filesize,
+            "ext": "mp4", # The muxed output
+            "height": video.height,
+        }
+
+    def describe(self) -> List[Dict[str, Any]]:
+        """
+        Lists the indexed formats, best first within each kind, for clients
+        choosing a quality.
+        """
+        return [
+            {"format_id": fmt.format_id, "kind": kind, "ext": fmt.ext, "vcodec": fmt.codec,
+             "height": fmt.height, "filesize": fmt.filesize}
+            for kind, formats in (("progressive", self.progressive), ("video", self.video), ("audio", self.audio))
+            for fmt in formats
+        ]
+
+    def available_qualities(self) -> str:
+        """
+        Summarizes the heights and codecs on offer, e.g. "1080p h264, 720p vp9".
+        """
+        seen = []
+        for fmt in sorted(self.progressive + self.video, key=lambda fmt: fmt.height or 0, reverse=True):
+            label = f"{fmt.height}p {fmt.codec}" if fmt.height else (fmt.codec or "unknown")
+            if label not in seen:
+                seen.append(label)
+        return ", ".join(seen) or "none"
+
+def select_formats(video_info: Dict[str, Any], max_height: Optional[int] = None, vcodec: Optional[str] = None,
+                   max_filesize: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Re-selects the streams of a get_video_info result under the given limits.
+    Returns a copy of video_info with the selection fields replaced, or a
+    dictionary with an error if no format fits.
+    """
+    index: Optional[FormatIndex] = video_info.get("format_index")
+    if index is None:
+        return {"error": "No format information is available for this video."}
+    selected = index.select(max_height, vcodec, max_filesize)
+    if selected is None:
+        return {"error": f"No format matches the requested quality. Available: {index.available_qualities()}."}
+    video_info = dict(video_info, **selected)
+    video_info["suggested_filename"] = _with_extension(video_info.get("suggested_filename") or "downloaded_video.mp4", selected["ext"])
+    return video_info
+
+def _with_extension(filename: str, ext: str) -> str:
+    stem, dot, _ = filename.rpartition('.')
+    return f"{stem if dot else filename}.{ext}"
 
+def _extract_video_info(video_url: str) -> Dict[str, Any]:
+    """
+    Uses yt-dlp to fetch metadata and index the formats of video_url, and
+    selects the best streams with no quality limits.
+    Returns a dictionary with title, thumbnail, the selected video_url (and
+    audio_url unless the selection is progressive), suggested_filename, and
+    the FormatIndex for selecting again under other limits.
+    """
+    from yt_dlp.utils import DownloadError, ExtractorError
+
+    try:
+        with _pooled_ydl() as ydl:
+            info = ydl.extract_info(video_url, download=False)
     except ExtractorError as e: # yt-dlp specific error for when it can't process a URL
-        logger.error(f"ExtractorError for {video_url}: {e}")
+        logger.error("ExtractorError for %s: %s", video_url, e)
         return {"error": f"Failed to process URL: {str(e)}", "original_url": video_url} # type: ignore
     except DownloadError as e: # More general yt-dlp download related error
-        logger.error(f"DownloadError for {video_url}: {e}")
+        logger.error("DownloadError for %s: %s", video_url, e)
         return {"error": f"Failed to retrieve video information: {str(e)}", "original_url": video_url}
     except Exception as e:
-        logger.error(f"An unexpected error occurred in get_video_info for {video_url}: {e}", exc_info=True)
+        logger.error("An unexpected error occurred in get_video_info for %s: %s", video_url, e, exc_info=True)
         return {"error": f"An unexpected error occurred while processing video details.", "original_url": video_url}
+    return build_video_info(video_url, info)
+
+def build_video_info(video_url: str, info: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Turns a yt-dlp info dict into the video info returned by get_video_info.
+    """
+    title = info.get("title", "Untitled_Video")
+    # Clean the title to create a safe filename
+    safe_title = re.sub(r'[\/*?:"<>|]', "", title) # Remove illegal characters
+    safe_title = re.sub(r'\s+', '_', safe_title) # Replace spaces with underscores
+    suggested_filename = f"{safe_title[:100]}.mp4" # Limit length and add .mp4 extension
+
+    # Extractors that find a single file report it at the top level instead of in 'formats'
+    index = FormatIndex(info.get('formats') or [info])
+    selected = index.select()
+    if selected is None:
+        # This can happen if the video is audio-only or no format is downloadable over HTTP
+        error_message = "Could not find downloadable video and audio streams. The content might be audio-only, video-only, or only available as a stream manifest."
+        if index.audio and not (index.video or index.progressive):
+            error_message = "The content appears to be audio-only."
+        elif index.video and not (index.audio or index.progressive):
+            error_message = "The content appears to be video-only (no audio track)."
+        return {"error": error_message, "title": title, "thumbnail": info.get("thumbnail")}
+
+    return {
+        "title": title,
+        "thumbnail": info.get("thumbnail"),
+        "duration": info.get("duration"),
+        "suggested_filename": _with_extension(suggested_filename, selected["ext"]),
+        "original_url": video_url, # Keep original_url for context
+        # Canonical identity of the content, used with the format IDs as the output cache key
+        "extractor": info.get("extractor_key"),
+        "video_id": info.get("id"),
+        "format_index": index,
+        # Selected streams: video_url, audio_url, their format IDs and expected
+        # sizes in bytes (None if unknown), progressive, ext and height
+        **selected,
+    }
 
 if __name__ == '__main__':
     # logger = yt_dlp.utils. جوړول شوي_لاګر('TestDownloader') # type: ignore
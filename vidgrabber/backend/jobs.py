@@ -0,0 +1,545 @@
+import json
+import time
+import uuid
+import asyncio
+import logging
+import os
+import queue
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException
+
+from .progress import ProgressReporter
+from . import scratch
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+# How often a follower of a job running in another worker polls the job store (seconds)
+STORE_POLL_INTERVAL = 0.5
+# Longest a state change or event waits before the job store's writer thread
+# writes it (seconds). Everything queued meanwhile goes into one transaction.
+STORE_FLUSH_INTERVAL = 0.25
+# Events that only report how far a stage has got. Of those queued for the
+# same job, stage and stream, only the newest is written.
+_TICK_EVENTS = ("download", "mux")
+
+
+class Job:
+    """
+    A submitted video job. The runner fills in result_path (and optionally
+    filename) on success; failures record an HTTP status and message.
+    """
+
+    def __init__(self, url: str, client_id: str, priority: int = 0, selection: Optional[Dict[str, Any]] = None) -> None:
+        self.id = uuid.uuid4().hex
+        self.url = url
+        # Format limits requested by the client (max_height, vcodec, max_filesize)
+        self.selection = selection or {}
+        self.client_id = client_id
+        self.priority = priority
+        self.status = QUEUED
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.result_path: Optional[Path] = None
+        self.filename: Optional[str] = None
+        # True if the result file belongs to this job and must be deleted with it
+        self.owns_result = False
+        self.error: Optional[str] = None
+        self.error_status: Optional[int] = None
+        # Where state changes are written through to, once registered with a JobManager that has one
+        self.store: Optional["JobStore"] = None
+        self.progress = ProgressReporter()
+        self.progress.emit("queued")
+
+    @classmethod
+    def from_record(cls, record: Dict[str, Any], store: "JobStore") -> "Job":
+        """
+        Read-only snapshot of a job that another worker process runs, as
+        written by to_record. Its progress is followed through the store.
+        """
+        job = cls.__new__(cls)
+        job.id = record["job_id"]
+        job.url = record["url"]
+        job.selection = record["selection"] or {}
+        job.client_id = record["client_id"]
+        job.priority = record["priority"]
+        job.status = record["status"]
+        job.created_at = record["created_at"]
+        job.started_at = record["started_at"]
+        job.finished_at = record["finished_at"]
+        job.result_path = Path(record["result_path"]) if record["result_path"] else None
+        job.filename = record["filename"]
+        job.owns_result = record["owns_result"]
+        job.error = record["error"]
+        job.error_status = record["error_status"]
+        job.store = None
+        job.progress = StoredProgress(store, job.id)
+        return job
+
+    def attach(self, store: "JobStore") -> None:
+        """
+        Writes the job and its events so far to `store`, and every later state
+        change and event as it happens.
+        """
+        self.store = store
+        store.save(self)
+        for event in self.progress.events:
+            store.add_event(self.id, event)
+        self.progress.listener = lambda index, event: store.add_event(self.id, event)
+
+    def _changed(self) -> None:
+        if self.store is not None:
+            self.store.save(self)
+
+    def mark_running(self) -> None:
+        self.status = RUNNING
+        self.started_at = time.time()
+        self.progress.emit("started")
+        self._changed()
+
+    def mark_done(self) -> None:
+        self.status = DONE
+        self.progress.emit("done", filename=self.filename)
+        self._changed()
+
+    def mark_failed(self, error: str, error_status: Optional[int] = 500) -> None:
+        self.status = FAILED
+        self.error = error
+        self.error_status = error_status
+        self._changed()
+
+    def finish(self) -> None:
+        """
+        Stamps the finish time, emits 'failed' if needed and closes the progress log.
+        """
+        if self.finished_at is None:
+            self.finished_at = time.time()
+        if self.status == FAILED:
+            self.progress.emit("failed", error=self.error)
+        self.progress.close()
+        # Saved last, so followers that see finished_at have every event
+        self._changed()
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "job_id": self.id,
+            "url": self.url,
+            "status": self.status,
+            "priority": self.priority,
+            "selection": self.selection,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "filename": self.filename,
+            "error": self.error,
+        }
+
+    def to_record(self) -> Dict[str, Any]:
+        """
+        Everything from_record needs, as JSON-compatible values.
+        """
+        return {
+            **self.to_dict(),
+            "client_id": self.client_id,
+            "result_path": str(self.result_path) if self.result_path is not None else None,
+            "owns_result": self.owns_result,
+            "error_status": self.error_status,
+        }
+
+
+class StoredProgress:
+    """
+    The progress log of a job running in another worker process, followed by
+    polling the job store. Offers the same subscribe() as ProgressReporter.
+    """
+
+    def __init__(self, store: "JobStore", job_id: str) -> None:
+        self._store = store
+        self._job_id = job_id
+
+    async def subscribe(self, heartbeat: Optional[float] = None) -> AsyncIterator[Optional[Dict[str, Any]]]:
+        index, idle = 0, 0.0
+        while True:
+            # Checked before reading the events: a finished job has written all of them
+            record = await asyncio.to_thread(self._store.load, self._job_id)
+            finished = record is None or record["finished_at"] is not None
+            events = await asyncio.to_thread(self._store.events, self._job_id, index)
+            for event in events:
+                yield event
+            index += len(events)
+            if finished:
+                return
+            idle = 0.0 if events else idle
+            await asyncio.sleep(STORE_POLL_INTERVAL)
+            idle += STORE_POLL_INTERVAL
+            if heartbeat is not None and idle >= heartbeat:
+                idle = 0.0
+                yield None
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    finished_at REAL,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS events (
+    job_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (job_id, seq)
+);
+"""
+
+
+class JobStore:
+    """
+    Job state shared by the worker processes of one server (see serve.py), in
+    an SQLite database. A job runs in the worker that accepted it, which writes
+    every state change and progress event through to the store; the status,
+    result and events endpoints of the other workers read it from there.
+
+    Writes are queued and applied by a writer thread of their own, in batches
+    of up to STORE_FLUSH_INTERVAL, so they never block the event loop and a
+    busy job costs one commit per batch rather than one per event. Reads
+    block, and are made from worker threads (see JobManager.get).
+
+    Each job row names its owner by scratch worker directory, so a job whose
+    worker died is reported as failed instead of staying queued forever.
+    Store errors are logged and never fail the job itself.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._pid: Optional[int] = None
+        self._read_lock = threading.Lock()
+        self._writes: "queue.Queue[Tuple[Any, ...]]" = queue.Queue()
+        self._wake = threading.Event()
+        self._writer: Optional[threading.Thread] = None
+        self._writer_pid: Optional[int] = None
+        # Next event number of each unfinished job; used by the writer thread only
+        self._seqs: Dict[str, int] = {}
+
+    def _connect(self) -> sqlite3.Connection:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(_SCHEMA)
+        return conn
+
+    def _read(self, query: str, params: tuple) -> List[tuple]:
+        with self._read_lock:
+            # One connection per process: a forked worker must not share its parent's
+            if self._conn is None or self._pid != os.getpid():
+                self._conn, self._pid = self._connect(), os.getpid()
+            return self._conn.execute(query, params).fetchall()
+
+    def _enqueue(self, *write: Any) -> None:
+        if self._writer is None or self._writer_pid != os.getpid():
+            # Started on first use, so a forked worker gets a writer of its own
+            self._writes, self._seqs = queue.Queue(), {}
+            self._writer = threading.Thread(target=self._write_loop, name="job-store-writer", daemon=True)
+            self._writer_pid = os.getpid()
+            self._writer.start()
+        self._writes.put(write)
+
+    def flush(self) -> None:
+        """
+        Blocks until every write queued so far is in the database.
+        """
+        if self._writer is None or self._writer_pid != os.getpid():
+            return
+        written = threading.Event()
+        self._writes.put(("flush", written))
+        self._wake.set()
+        written.wait()
+
+    def close(self) -> None:
+        """
+        Writes what is still queued, then stops the writer thread and closes
+        this process's connection.
+        """
+        if self._writer is not None and self._writer_pid == os.getpid():
+            self._writes.put(("stop",))
+            self._wake.set()
+            self._writer.join()
+        self._writer, self._writer_pid = None, None
+        with self._read_lock:
+            if self._conn is not None and self._pid == os.getpid():
+                self._conn.close()
+            self._conn, self._pid = None, None
+
+    def save(self, job: Job) -> None:
+        self._enqueue("save", job.id, scratch.worker_name(), job.finished_at, json.dumps(job.to_record()))
+
+    def add_event(self, job_id: str, event: Dict[str, Any]) -> None:
+        tick = (job_id, event["event"], event.get("stream")) if event["event"] in _TICK_EVENTS else None
+        self._enqueue("event", job_id, json.dumps(event), tick)
+
+    def _write_loop(self) -> None:
+        conn: Optional[sqlite3.Connection] = None
+        while True:
+            batch = [self._writes.get()]
+            self._wake.wait(STORE_FLUSH_INTERVAL)
+            self._wake.clear()
+            while True:
+                try:
+                    batch.append(self._writes.get_nowait())
+                except queue.Empty:
+                    break
+            writes = [write for write in batch if write[0] not in ("flush", "stop")]
+            if writes:
+                try:
+                    conn = conn or self._connect()
+                    self._apply(conn, writes)
+                except Exception as e: # Keep the thread alive, or flush() would wait forever
+                    logger.warning("Failed to write %s updates to the job store: %s", len(writes), e)
+            for write in batch:
+                if write[0] == "flush":
+                    write[1].set()
+            if any(write[0] == "stop" for write in batch):
+                if conn is not None:
+                    conn.close()
+                return
+
+    def _apply(self, conn: sqlite3.Connection, writes: List[Tuple[Any, ...]]) -> None:
+        """
+        Applies a batch of queued writes in one transaction, skipping progress
+        ticks that a newer tick in the same batch supersedes.
+        """
+        newest = {write[3]: index for index, write in enumerate(writes) if write[0] == "event" and write[3] is not None}
+        conn.execute("BEGIN")
+        try:
+            for index, write in enumerate(writes):
+                if write[0] == "save":
+                    _, job_id, owner, finished_at, data = write
+                    conn.execute("INSERT OR REPLACE INTO jobs (id, owner, finished_at, data) VALUES (?, ?, ?, ?)",
+                                 (job_id, owner, finished_at, data))
+                    if finished_at is not None:
+                        self._seqs.pop(job_id, None) # Saved last; no more events follow
+                elif write[0] == "event":
+                    _, job_id, data, tick = write
+                    if tick is not None and newest[tick] != index:
+                        continue
+                    self._insert_event(conn, job_id, data)
+                elif write[0] == "fail_orphan":
+                    _, job_id, finished_at, data, event = write
+                    # Only the first worker to notice records the failure
+                    if conn.execute("UPDATE jobs SET finished_at = ?, data = ? WHERE id = ? AND finished_at IS NULL",
+                                    (finished_at, data, job_id)).rowcount:
+                        self._insert_event(conn, job_id, event)
+                elif write[0] == "prune":
+                    self._prune(conn, write[1])
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            self._seqs.clear()
+            raise
+
+    def _insert_event(self, conn: sqlite3.Connection, job_id: str, data: str) -> None:
+        # Numbered by the store, so the log has no gaps where ticks were skipped
+        seq = self._seqs.get(job_id)
+        if seq is None:
+            (seq,) = conn.execute("SELECT COUNT(*) FROM events WHERE job_id = ?", (job_id,)).fetchone()
+        conn.execute("INSERT OR REPLACE INTO events (job_id, seq, data) VALUES (?, ?, ?)", (job_id, seq, data))
+        self._seqs[job_id] = seq + 1
+
+    def load(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Returns the record of a job, or None if the store does not know it.
+        """
+        try:
+            rows = self._read("SELECT owner, data FROM jobs WHERE id = ?", (job_id,))
+        except sqlite3.Error as e:
+            logger.warning("Failed to read job %s from the job store: %s", job_id, e)
+            return None
+        if not rows:
+            return None
+        [(owner, data)] = rows
+        record = json.loads(data)
+        # No grace period: the owner took its lock before it saved the job
+        if record["finished_at"] is None and not scratch.worker_alive(owner, grace=0):
+            record = self._fail_orphan(job_id, owner, record)
+        return record
+
+    def _fail_orphan(self, job_id: str, owner: str, record: Dict[str, Any]) -> Dict[str, Any]:
+        logger.warning("Job %s was left unfinished by worker %s, which is no longer running", job_id, owner)
+        record.update(status=FAILED, error="The server process running this job stopped. Please submit the video again.",
+                      error_status=None, finished_at=time.time())
+        event = {"event": "failed", "time": record["finished_at"], "error": record["error"]}
+        self._enqueue("fail_orphan", job_id, record["finished_at"], json.dumps(record), json.dumps(event))
+        # Written before the caller reads the events, so they end with the failure
+        self.flush()
+        return record
+
+    def events(self, job_id: str, start: int = 0) -> List[Dict[str, Any]]:
+        """
+        Returns the job's events from index `start` on.
+        """
+        try:
+            rows = self._read("SELECT data FROM events WHERE job_id = ? AND seq >= ? ORDER BY seq", (job_id, start))
+        except sqlite3.Error as e:
+            logger.warning("Failed to read events of job %s from the job store: %s", job_id, e)
+            return []
+        return [json.loads(data) for (data,) in rows]
+
+    def prune(self, cutoff: float) -> None:
+        """
+        Forgets jobs that finished before `cutoff`, whichever worker ran them,
+        deleting any result files they own. Runs on the writer thread.
+        """
+        self._enqueue("prune", cutoff)
+
+    @staticmethod
+    def _prune(conn: sqlite3.Connection, cutoff: float) -> None:
+        rows = conn.execute("SELECT id, data FROM jobs WHERE finished_at < ?", (cutoff,)).fetchall()
+        for job_id, data in rows:
+            record = json.loads(data)
+            if record["owns_result"] and record["result_path"]:
+                Path(record["result_path"]).unlink(missing_ok=True)
+            conn.execute("DELETE FROM events WHERE job_id = ?", (job_id,))
+            conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+
+
+class JobManager:
+    """
+    Job broker of one worker process. Jobs wait in a priority queue (lower
+    number runs first, clamped to 0..max_priority) and are picked up by a
+    fixed number of worker tasks. With a JobStore, jobs of the other worker
+    processes can be looked up too.
+
+    Within one priority level, clients are served fairly using start-time fair
+    queuing: each client's next job is stamped with a virtual start time one
+    slot after its previous job, so a client that submits a hundred jobs does
+    not delay another client's single job by a hundred slots.
+    """
+
+    def __init__(self, runner: Callable[[Job], Awaitable[None]], workers: int, retention: float,
+                 max_priority: int = 0, store: Optional[JobStore] = None) -> None:
+        self._runner = runner
+        self._store = store
+        self._worker_count = workers
+        self._retention = retention
+        self._max_priority = max_priority
+        self._queue: "asyncio.PriorityQueue[tuple]" = asyncio.PriorityQueue()
+        self._jobs: Dict[str, Job] = {}
+        self._client_finish: Dict[str, float] = {}
+        self._virtual_time = 0.0
+        self._seq = 0
+        self._workers: List[asyncio.Task] = []
+
+    def start(self) -> None:
+        for i in range(self._worker_count):
+            self._workers.append(asyncio.create_task(self._worker(i)))
+
+    async def stop(self) -> None:
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers.clear()
+        if self._store is not None:
+            # Waits for the writer thread to write what is still queued
+            await asyncio.to_thread(self._store.close)
+
+    async def flush(self) -> None:
+        """
+        Waits until the store has everything written so far, e.g. a new job
+        that the other workers must be able to look up.
+        """
+        if self._store is not None:
+            await asyncio.to_thread(self._store.flush)
+
+    @property
+    def queued_count(self) -> int:
+        return self._queue.qsize()
+
+    async def get(self, job_id: str) -> Optional[Job]:
+        """
+        Returns a job of this worker, or a snapshot of one that another
+        worker runs if there is a store.
+        """
+        job = self._jobs.get(job_id)
+        if job is None and self._store is not None:
+            record = await asyncio.to_thread(self._store.load, job_id)
+            if record is not None:
+                job = Job.from_record(record, self._store)
+        return job
+
+    def _register(self, job: Job) -> None:
+        self._jobs[job.id] = job
+        if self._store is not None:
+            job.attach(self._store)
+
+    def track(self, job: Job) -> None:
+        """
+        Registers a job that is run outside the queue (e.g. a batch item) so
+        the status, result and events endpoints work for it too.
+        """
+        self._prune()
+        self._register(job)
+
+    def submit(self, url: str, client_id: str, priority: int = 0, selection: Optional[Dict[str, Any]] = None) -> Job:
+        self._prune()
+        # Clients choose a priority only within 0..max_priority; anything else
+        # would let one client jump ahead of everyone and defeat fair queuing
+        priority = min(max(priority, 0), self._max_priority)
+        job = Job(url, client_id, priority, selection)
+        start = max(self._virtual_time, self._client_finish.get(client_id, 0.0))
+        self._client_finish[client_id] = start + 1
+        self._seq += 1
+        self._register(job)
+        self._queue.put_nowait((priority, start, self._seq, job))
+        logger.info("Queued job %s for %s (priority %s)", job.id, client_id, priority)
+        return job
+
+    async def _worker(self, index: int) -> None:
+        while True:
+            _, start, _, job = await self._queue.get()
+            self._virtual_time = max(self._virtual_time, start)
+            job.mark_running()
+            try:
+                await self._runner(job)
+                job.mark_done()
+            except asyncio.CancelledError:
+                job.mark_failed("Server shutting down", None)
+                job.finished_at = time.time()
+                raise
+            except HTTPException as e:
+                job.mark_failed(str(e.detail), e.status_code)
+            except Exception as e:
+                logger.error("Job %s failed unexpectedly: %s", job.id, e, exc_info=True)
+                job.mark_failed("An internal server error occurred.")
+            finally:
+                job.finish()
+                self._queue.task_done()
+            logger.info("Job %s finished with status %s", job.id, job.status)
+
+    def _prune(self) -> None:
+        """
+        Forgets finished jobs older than the retention window, deleting any
+        result files they own.
+        """
+        cutoff = time.time() - self._retention
+        expired = [job for job in self._jobs.values()
+                   if job.finished_at is not None and job.finished_at < cutoff]
+        for job in expired:
+            del self._jobs[job.id]
+            if job.owns_result and job.result_path is not None:
+                job.result_path.unlink(missing_ok=True)
+        if self._store is not None:
+            self._store.prune(cutoff)
+        # Clients whose last job is already behind the virtual clock need no entry
+        self._client_finish = {client: finish for client, finish in self._client_finish.items()
+                               if finish > self._virtual_time}
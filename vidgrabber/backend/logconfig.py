@@ -0,0 +1,16 @@
+import logging
+
+from .config import LOG_LEVEL
+
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(module)s - %(message)s'
+
+
+def configure_logging() -> None:
+    """
+    The application's only logging setup: one stderr handler on the root
+    logger at LOG_LEVEL, which the backend's module loggers and uvicorn's
+    loggers propagate to. Does nothing if the root logger already has a
+    handler, e.g. when the backend is embedded in another application.
+    """
+    level = logging.getLevelName(LOG_LEVEL)
+    logging.basicConfig(level=level if isinstance(level, int) else logging.INFO, format=LOG_FORMAT)
@@ -0,0 +1,381 @@
+import os
+import time
+import uuid
+import json
+import shutil
+import asyncio
+import bisect
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from .config import METRICS_SNAPSHOT_INTERVAL
+
+# Minimal Prometheus-compatible metrics. Updates are a lock plus a dict lookup,
+# so instrumentation is cheap enough to leave on in production; rendering the
+# text exposition format only happens when /metrics is scraped.
+#
+# With several worker processes (backend.serve --workers N) a scrape reaches
+# whichever worker accepted the connection. Each worker therefore writes a
+# snapshot of its metrics to SNAPSHOT_DIR every METRICS_SNAPSHOT_INTERVAL
+# seconds, and /metrics adds the other workers' latest snapshots to the live
+# values of the worker that answers. Counters and histograms of workers that
+# have exited are kept, so totals never go backwards; their gauges are not.
+
+logger = logging.getLogger(__name__)
+
+# Set VIDGRABBER_TRACE=1 to log a span line (trace ID, name, duration) for
+# every timed stage in addition to recording the histogram.
+TRACE_ENABLED = os.environ.get("VIDGRABBER_TRACE", "").lower() in ("1", "true", "yes")
+
+# Trace ID of the request or job currently being handled
+trace_id: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("trace_id", default=None)
+
+LabelValues = Tuple[str, ...]
+
+# Per metric, the entries of one other worker's snapshot and whether that worker is still running
+Others = Iterable[Tuple[List[Any], bool]]
+
+_registry: List["_Metric"] = []
+
+# Directory the workers of one server share their snapshots through; None when
+# there is only one process (see share_between_workers)
+SNAPSHOT_DIR: Optional[Path] = None
+
+
+def _format_labels(names: Tuple[str, ...], values: LabelValues, extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.label_names = labels
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _entries(self) -> List[Any]:
+        """This process's values in a JSON-serializable form, for snapshots."""
+        raise NotImplementedError
+
+    def _samples(self, others: Others) -> List[str]:
+        raise NotImplementedError
+
+    def render(self, others: Others = ()) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples(others))
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = ()) -> None:
+        super().__init__(name, documentation, labels)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, *labels: str) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def _entries(self) -> List[Any]:
+        with self._lock:
+            return [[list(labels), value] for labels, value in self._values.items()]
+
+    def _samples(self, others: Others) -> List[str]:
+        return _sum_samples(self, self._entries(), (entries for entries, _ in others))
+
+
+def _sum_samples(metric: _Metric, own: List[Any], others: Iterable[List[Any]]) -> List[str]:
+    """Renders one sample per label set, summed over this process and the other snapshots."""
+    values: Dict[LabelValues, float] = {}
+    for entries in (own, *others):
+        for labels, value in entries:
+            values[tuple(labels)] = values.get(tuple(labels), 0) + value
+    return [f"{metric.name}{_format_labels(metric.label_names, labels)} {value}" for labels, value in values.items()]
+
+
+class Gauge(_Metric):
+    """
+    Gauge that is either set directly or, with `callback`, computed at scrape time.
+    Values are summed over the running workers unless the gauge is `shared`,
+    i.e. measures something all workers see alike, such as the temp directory.
+    """
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = (),
+                 callback: Optional[Callable[[], float]] = None, shared: bool = False) -> None:
+        super().__init__(name, documentation, labels)
+        self._values: Dict[LabelValues, float] = {}
+        self._callback = callback
+        self.shared = shared
+
+    def inc(self, amount: float = 1.0, *labels: str) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, *labels: str) -> None:
+        self.inc(-amount, *labels)
+
+    def set(self, value: float, *labels: str) -> None:
+        with self._lock:
+            self._values[labels] = value
+
+    @contextmanager
+    def track(self, *labels: str) -> Iterator[None]:
+        """Counts the enclosed block as in progress."""
+        self.inc(1.0, *labels)
+        try:
+            yield
+        finally:
+            self.dec(1.0, *labels)
+
+    def _entries(self) -> List[Any]:
+        if self._callback is not None:
+            try:
+                return [[[], self._callback()]]
+            except Exception as e:
+                logger.warning("Gauge callback for %s failed: %s", self.name, e)
+                return []
+        with self._lock:
+            return [[list(labels), value] for labels, value in self._values.items()]
+
+    def _samples(self, others: Others) -> List[str]:
+        running = () if self.shared else (entries for entries, alive in others if alive)
+        return _sum_samples(self, self._entries(), running)
+
+
+# Bucket boundaries in seconds, from fast cache hits to multi-minute jobs
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> None:
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: [count per bucket (+Inf last), sum]
+        self._values: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = ([0] * (len(self.buckets) + 1), [0.0])
+            entry[0][index] += 1
+            entry[1][0] += value
+
+    def _entries(self) -> List[Any]:
+        with self._lock:
+            return [[list(labels), list(counts), total[0]] for labels, (counts, total) in self._values.items()]
+
+    def _samples(self, others: Others) -> List[str]:
+        merged: Dict[LabelValues, Tuple[List[int], float]] = {}
+        for entries in (self._entries(), *(entries for entries, _ in others)):
+            for labels, counts, total in entries:
+                previous = merged.get(tuple(labels))
+                if previous is not None:
+                    counts, total = [a + b for a, b in zip(previous[0], counts)], previous[1] + total
+                merged[tuple(labels)] = (counts, total)
+        lines = []
+        for labels, (counts, total) in merged.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(float(bound))
+                le_label = f'le="{le}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, labels, le_label)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, labels)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, labels)} {cumulative}")
+        return lines
+
+
+def render_all() -> str:
+    """
+    Renders every metric, merged with the other workers' snapshots if there
+    are any. Reads files, so call it off the event loop.
+    """
+    others = _read_snapshots()
+    return "\n".join(metric.render([(snapshot.get(metric.name, []), alive) for snapshot, alive in others])
+                     for metric in _registry) + "\n"
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError: # Exists, but belongs to someone else
+        pass
+    return True
+
+
+def share_between_workers(root: Path) -> Path:
+    """
+    Called by the server process before it forks its workers: makes them
+    share metrics through a fresh directory under `root`, and removes the
+    directories of earlier servers that are no longer running. Returns the
+    new directory, which the server removes when it exits.
+    """
+    global SNAPSHOT_DIR
+    root.mkdir(parents=True, exist_ok=True)
+    for entry in root.iterdir():
+        server = entry.name.partition("_")[2]
+        if entry.name.startswith("server_") and server.isdigit() and not _pid_alive(int(server)):
+            shutil.rmtree(entry, ignore_errors=True)
+    SNAPSHOT_DIR = root / f"server_{os.getpid()}"
+    SNAPSHOT_DIR.mkdir(exist_ok=True)
+    return SNAPSHOT_DIR
+
+
+def write_snapshot() -> None:
+    """
+    Writes this process's metrics to SNAPSHOT_DIR for the other workers to
+    merge. The file is replaced atomically, so readers never see half of it.
+    """
+    if SNAPSHOT_DIR is None:
+        return
+    path = SNAPSHOT_DIR / f"{os.getpid()}.json"
+    partial = path.with_suffix(".part")
+    partial.write_text(json.dumps({metric.name: metric._entries() for metric in _registry}))
+    os.replace(partial, path)
+
+
+def _read_snapshots() -> List[Tuple[Dict[str, List[Any]], bool]]:
+    """
+    Returns the latest snapshot of every other worker of this server, each
+    with whether that worker is still running.
+    """
+    if SNAPSHOT_DIR is None:
+        return []
+    snapshots = []
+    for path in SNAPSHOT_DIR.glob("*.json"):
+        if not path.stem.isdigit() or int(path.stem) == os.getpid():
+            continue
+        try:
+            snapshots.append((json.loads(path.read_text()), _pid_alive(int(path.stem))))
+        except (OSError, ValueError) as e:
+            logger.warning("Skipping unreadable metrics snapshot %s: %s", path.name, e)
+    return snapshots
+
+
+async def run_snapshots(interval: float = METRICS_SNAPSHOT_INTERVAL) -> None:
+    """
+    Writes a snapshot every `interval` seconds until cancelled, and a last
+    one then, so this worker's counts outlive it. Does nothing when there
+    is only one process.
+    """
+    if SNAPSHOT_DIR is None:
+        return
+    try:
+        while True:
+            try:
+                await asyncio.to_thread(write_snapshot)
+            except OSError as e:
+                logger.error("Failed to write metrics snapshot: %s", e)
+            await asyncio.sleep(interval)
+    finally:
+        try:
+            write_snapshot()
+        except OSError as e:
+            logger.error("Failed to write final metrics snapshot: %s", e)
+
+
+def new_trace_id() -> str:
+    return uuid.uuid4().hex[:16]
+
+
+# --- Metrics exported by the backend ---
+
+STAGE_SECONDS = Histogram("vidgrabber_stage_duration_seconds",
+                          "Time spent in each pipeline stage.", ("stage",))
+DOWNLOAD_BYTES = Counter("vidgrabber_download_bytes_total",
+                         "Bytes downloaded from upstream, by stream.", ("stream",))
+DOWNLOAD_THROUGHPUT = Histogram("vidgrabber_download_throughput_bytes_per_second",
+                                "Average throughput of completed stream downloads.", ("stream",),
+                                buckets=(1e5, 5e5, 1e6, 5e6, 1e7, 5e7, 1e8, 5e8))
+FFMPEG_SECONDS = Histogram("vidgrabber_ffmpeg_duration_seconds",
+                           "Wall-clock time of FFmpeg runs.", ("mode", "result"))
+CACHE_REQUESTS = Counter("vidgrabber_cache_requests_total",
+                         "Cache lookups by cache and result.", ("cache", "result"))
+JOBS_IN_FLIGHT = Gauge("vidgrabber_jobs_in_flight",
+                       "Download-and-mux jobs currently running.", ("mode",))
+ADMISSION_IN_USE = Gauge("vidgrabber_admission_slots_in_use",
+                         "Download and mux slots currently held, by gate.", ("gate",))
+ADMISSION_WAITING = Gauge("vidgrabber_admission_waiting",
+                          "Tasks queued for a download, mux or disk slot, by gate.", ("gate",))
+ADMISSION_REJECTED = Counter("vidgrabber_admission_rejected_total",
+                             "Requests turned away with 503 because capacity was exhausted, by gate.", ("gate",))
+DISK_RESERVED = Gauge("vidgrabber_disk_reserved_bytes",
+                      "Temp-dir disk space reserved by running jobs.")
+RESPONSE_SECONDS = Histogram("vidgrabber_response_send_seconds",
+                             "Time from response start to the last body byte, by route.", ("route",))
+
+
+@contextmanager
+def timed(stage: str, **attributes: object) -> Iterator[None]:
+    """
+    Records the duration of the enclosed block in STAGE_SECONDS and, when
+    tracing is enabled, logs it as a span of the current trace.
+    """
+    start = time.perf_counter()
+    failed = False
+    try:
+        yield
+    except BaseException:
+        failed = True
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, stage)
+        if TRACE_ENABLED:
+            extra = "".join(f" {key}={value}" for key, value in attributes.items())
+            logger.info("span trace=%s stage=%s duration_ms=%.1f failed=%s%s",
+                        trace_id.get(), stage, elapsed * 1000, failed, extra)
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware that gives every request a trace ID (taken from an incoming
+    X-Request-ID header when present) and records how long sending the response
+    took, labelled with the matched route template.
+    """
+
+    def __init__(self, app) -> None:
+        self.app = app
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers") or [])
+        request_id = headers.get(b"x-request-id", b"").decode("latin-1") or new_trace_id()
+        token = trace_id.set(request_id)
+        send_started: List[float] = []
+
+        async def timed_send(message) -> None:
+            if message["type"] == "http.response.start":
+                send_started.append(time.perf_counter())
+                message["headers"] = list(message.get("headers", [])) + [(b"x-request-id", request_id.encode("latin-1"))]
+            await send(message)
+            if message["type"] in ("http.response.body", "http.response.pathsend") and not message.get("more_body") and send_started:
+                route = scope.get("route")
+                RESPONSE_SECONDS.observe(time.perf_counter() - send_started[0], getattr(route, "path", "unmatched"))
+
+        try:
+            await self.app(scope, receive, timed_send)
+        finally:
+            trace_id.reset(token)
@@ -0,0 +1,113 @@
+import os
+import re
+from pathlib import Path
+from typing import Mapping, Optional
+from urllib.parse import quote
+
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, Response
+from starlette.types import Receive, Scope, Send
+
+from . import cache
+from .scratch import OUTPUTS_DIR
+from .config import OUTPUT_RETENTION
+
+# Finished files are served by ID at /api/outputs/<id>:
+#   - a 32-hex-digit ID names a file in OUTPUTS_DIR (see ScratchDir.keep)
+#   - a 64-hex-digit ID is a cache key (see cache.cache_key)
+# The strong ETag is the ID plus the file's mtime. An output ID is never
+# reused, but a cache key names a video and its formats, not the bytes: an
+# evicted entry can be produced again, e.g. by a streaming mux, which writes
+# a fragmented MP4. The mtime tells such files apart. Cache hits only refresh
+# the atime (see cache.py), so the ETag stays the same for as long as the
+# stored file does, which If-Range on a resumed download relies on.
+_OUTPUT_ID = re.compile(r"[0-9a-f]{32}")
+_CACHE_ID = re.compile(r"[0-9a-f]{64}")
+
+
+def output_id(path: Path) -> str:
+    return path.stem
+
+
+def output_url(path: Path, filename: Optional[str] = None) -> str:
+    """
+    The URL a finished file can be downloaded from, by any worker, for as long
+    as it is kept on disk.
+    """
+    url = f"/api/outputs/{output_id(path)}"
+    if filename:
+        url += f"?filename={quote(filename)}"
+    return url
+
+
+def find_output(output_id: str) -> Optional[Path]:
+    """
+    Returns the file for an output ID, or None if the ID is malformed or the
+    file is gone. Only the two ID formats are accepted, so the ID cannot be
+    used to reach any other path.
+    """
+    if _OUTPUT_ID.fullmatch(output_id):
+        matches = list(OUTPUTS_DIR.glob(f"{output_id}.*"))
+        path = matches[0] if matches else None
+    elif _CACHE_ID.fullmatch(output_id):
+        # Not cache.lookup: serving a range is not a cache hit, and must not
+        # change the entry's LRU position on every resumed chunk
+        path = cache.cache_path(output_id)
+    else:
+        return None
+    return path if path is not None and path.is_file() else None
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    # If-None-Match uses the weak comparison: W/ prefixes are ignored
+    if if_none_match.strip() == "*":
+        return True
+    tags = (tag.strip() for tag in if_none_match.split(","))
+    return etag in (tag[2:] if tag.startswith("W/") else tag for tag in tags)
+
+
+class OutputFileResponse(FileResponse):
+    """
+    FileResponse for a finished video, with a strong ETag derived from the
+    file's ID and mtime, and If-None-Match handling on top of what
+    FileResponse does.
+
+    FileResponse itself answers Range (including multiple ranges) with 206 and
+    416, honours If-Range against the ETag, and sends HEAD without a body.
+    A full response is handed to the server as a path (the ASGI pathsend
+    extension) where supported, so the server can use sendfile; ranges are read
+    in large chunks to keep the per-chunk overhead low on multi-GB files.
+
+    The file is stat'ed once here; raises FileNotFoundError if it is gone.
+    """
+
+    chunk_size = 1024 * 1024
+
+    def __init__(self, path: Path, filename: str, media_type: Optional[str] = None,
+                 headers: Optional[Mapping[str, str]] = None) -> None:
+        stat_result = os.stat(path)
+        self.etag = f'"{output_id(path)}-{stat_result.st_mtime_ns:x}"'
+        super().__init__(
+            path,
+            media_type=media_type,
+            filename=filename,
+            stat_result=stat_result,
+            headers={
+                "etag": self.etag,
+                # Private: outputs are per-request results, not shared assets
+                "cache-control": f"private, max-age={OUTPUT_RETENTION}",
+                **(headers or {}),
+            },
+        )
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if_none_match = Headers(scope=scope).get("if-none-match")
+        if (if_none_match is not None and scope["method"].upper() in ("GET", "HEAD")
+                and _etag_matches(if_none_match, self.etag)):
+            not_modified = Response(status_code=304, headers={
+                name: self.headers[name] for name in ("etag", "cache-control", "last-modified", "content-location")
+                if name in self.headers
+            })
+            await not_modified(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
@@ -1,65 +1,377 @@
 import os
-import uuid
-import requests # We'll add this to requirements.txt later
-import subprocess
+import re
+import time
+import random
+import shutil
+import asyncio
 import logging
+import threading
+import subprocess
 from pathlib import Path
+from typing import TYPE_CHECKING, Any, Optional, List, Tuple, AsyncIterator, Awaitable, Callable, Dict
+from collections import deque
 
-# Configure basic logging for this module
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
-logger = logging.getLogger(__name__)
+from .metrics import timed, DOWNLOAD_BYTES, DOWNLOAD_THROUGHPUT, FFMPEG_SECONDS
+from . import scheduler
+from .config import (TEMP_DIR, FFMPEG_PATH, HTTP_TIMEOUT, FFMPEG_TIMEOUT, DOWNLOAD_SEGMENTS, SEGMENT_MIN_SIZE,
+                     HTTP_MAX_CONNECTIONS, HTTP_MAX_KEEPALIVE, DOWNLOAD_RETRIES, RETRY_BACKOFF, RETRY_BACKOFF_MAX)
 
-FFMPEG_EXE_PATH = "C:\ffmpeg\bin\ffmpeg.exe" # Windows path, ensure FFmpeg is here
+if TYPE_CHECKING:
+    import httpx # Imported on first download (see get_http_client)
+
+logger = logging.getLogger(__name__)
 
 # Define a base directory for temporary files within the backend folder
 # This assumes processor.py is in vidgrabber/backend/
-TEMP_DIR_BASE = Path(__file__).resolve().parent / "temp_files"
+TEMP_DIR_BASE = Path(TEMP_DIR).resolve() if TEMP_DIR else Path(__file__).resolve().parent / "temp_files"
+
+def partial_path(path: Path) -> Path:
+    """
+    Name a file is written under until it is complete, then atomically renamed
+    to `path`, so a complete-looking file is never a truncated one. The
+    extension is kept so FFmpeg can still infer the container format.
+    """
+    return path.with_name(f"{path.stem}.part{path.suffix}")
+
+# --- FFmpeg ---
+# FFmpeg is located and validated once per process, on first use or at startup,
+# instead of on every mux. The preloading server (serve.py) probes before it
+# forks, so its workers inherit the result.
+_ffmpeg_info: Optional[Dict[str, Any]] = None
+_ffmpeg_lock = threading.Lock()
+
+def probe_ffmpeg() -> Dict[str, Any]:
+    """
+    Locates FFmpeg (FFMPEG_PATH if set, otherwise the PATH) and checks that it
+    runs. Returns a dictionary with path, version and https (whether it can
+    read HTTPS URLs itself, as streaming mode needs), or with error if no
+    usable FFmpeg was found. The result is cached for the life of the process.
+    """
+    global _ffmpeg_info
+    with _ffmpeg_lock:
+        if _ffmpeg_info is None:
+            _ffmpeg_info = _probe_ffmpeg()
+            if _ffmpeg_info.get("error"):
+                logger.error("FFmpeg is not usable: %s", _ffmpeg_info["error"])
+            else:
+                logger.info("Using FFmpeg %s at %s (https input: %s)",
+                            _ffmpeg_info["version"], _ffmpeg_info["path"], _ffmpeg_info["https"])
+        return _ffmpeg_info
+
+def _probe_ffmpeg() -> Dict[str, Any]:
+    path = FFMPEG_PATH or shutil.which("ffmpeg")
+    if not path:
+        return {"error": "ffmpeg was not found in PATH. Install it or set VIDGRABBER_FFMPEG_PATH."}
+    try:
+        version = subprocess.run([path, '-hide_banner', '-version'], capture_output=True, text=True, timeout=10, check=True)
+        protocols = subprocess.run([path, '-hide_banner', '-protocols'], capture_output=True, text=True, timeout=10, check=True)
+    except (OSError, subprocess.SubprocessError) as e:
+        return {"error": f"{path} could not be run: {e}"}
+    match = re.match(r'\S+ version (\S+)', version.stdout)
+    # The list of input protocols comes first, then "Output:" and the output protocols
+    inputs = protocols.stdout.partition('Output:')[0].split()
+    return {"path": path, "version": match.group(1) if match else "unknown", "https": 'https' in inputs}
+
+def ffmpeg_path() -> Optional[str]:
+    """Path of the validated FFmpeg executable, or None if there is none."""
+    return probe_ffmpeg().get("path")
+
+# Shared async HTTP client, created lazily on first use so that it is bound
+# to the running event loop. All jobs share its connection pool, so TCP and
+# TLS connections to the same CDN hosts are reused across downloads.
+_http_client: Optional["httpx.AsyncClient"] = None
+
+def get_http_client() -> "httpx.AsyncClient":
+    """
+    Returns the shared AsyncClient used for stream downloads, creating it on first use.
+    httpx itself is imported here, so a worker that has not downloaded anything
+    yet has not paid for it.
+    """
+    global _http_client
+    import httpx
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.AsyncClient(
+            timeout=HTTP_TIMEOUT,
+            follow_redirects=True,
+            limits=httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS,
+                                max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+                                keepalive_expiry=30.0),
+        )
+    return _http_client
+
+async def close_http_client() -> None:
+    """
+    Closes the shared AsyncClient. Called on application shutdown.
+    """
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+
+CHUNK_SIZE = 65536
 
-def generate_temp_filepath(prefix: str = "stream", extension: str = ".mp4") -> Path:
+# Progress callbacks. Downloads report (bytes_downloaded, total_bytes_or_None);
+# FFmpeg reports each block of its -progress key=value output as a dict.
+DownloadProgress = Callable[[int, Optional[int]], None]
+MuxProgress = Callable[[Dict[str, str]], None]
+
+class _ByteCounter:
     """
-    Generates a unique temporary filepath within the backend/temp_files directory.
-    Ensures the temp_files directory exists.
+    Running byte total shared by all segments of one download. Every chunk
+    also feeds the bytes-downloaded metric for the stream's label.
     """
-    os.makedirs(TEMP_DIR_BASE, exist_ok=True)
-    unique_id = uuid.uuid4()
-    filename = f"{prefix}_{unique_id}{extension}"
-    return TEMP_DIR_BASE / filename
+    def __init__(self, callback: Optional[DownloadProgress], label: str, total: Optional[int] = None) -> None:
+        self.callback = callback
+        self.label = label
+        self.total = total
+        self.done = 0
+
+    def add(self, count: int) -> None:
+        self.done += count
+        if count > 0:
+            DOWNLOAD_BYTES.inc(count, self.label)
+        if self.callback is not None:
+            self.callback(self.done, self.total)
 
-def download_stream(url: str, output_path: Path) -> bool:
+async def probe_range_support(url: str) -> Optional[int]:
+    """
+    Checks whether the server honours HTTP Range requests for url.
+    Returns the total size in bytes if it does, None otherwise.
+    """
+    import httpx
+    client = get_http_client()
+    try:
+        async with client.stream("GET", url, headers={"Range": "bytes=0-0"}) as r:
+            if r.status_code != 206:
+                return None
+            # Content-Range looks like "bytes 0-0/123456"; the total may be "*" if unknown
+            content_range = r.headers.get("Content-Range", "")
+            total = content_range.rpartition("/")[2]
+            return int(total) if total.isdigit() else None
+    except httpx.HTTPError as e:
+        logger.info("Range probe failed for %s, falling back to a single request. Error: %s", url, e)
+        return None
+
+def split_ranges(total_size: int, segments: int) -> List[Tuple[int, int]]:
+    """
+    Splits [0, total_size) into at most `segments` contiguous inclusive byte ranges.
+    """
+    segments = max(1, min(segments, total_size))
+    step = -(-total_size // segments) # Ceiling division
+    return [(start, min(start + step, total_size) - 1) for start in range(0, total_size, step)]
+
+class StreamDownloadError(Exception):
+    """A download failed in a way that retrying will not fix."""
+
+class TransientDownloadError(StreamDownloadError):
+    """A download was cut short and can be retried or resumed."""
+
+def _is_transient(error: Exception) -> bool:
+    """
+    Connection resets, timeouts, truncated bodies, 5xx and 429 responses are
+    worth retrying. Other 4xx responses (e.g. an expired signed URL) are not.
+    """
+    import httpx
+    if isinstance(error, (TransientDownloadError, httpx.TransportError)):
+        return True
+    if isinstance(error, httpx.HTTPStatusError):
+        status = error.response.status_code
+        return status >= 500 or status == 429
+    return False
+
+async def _with_retries(attempt: Callable[[], Awaitable[None]], description: str) -> None:
+    """
+    Runs attempt() until it succeeds, retrying transient failures with
+    exponential backoff and jitter up to DOWNLOAD_RETRIES times. Each attempt
+    is expected to resume from wherever the previous one stopped.
+    """
+    for retry in range(DOWNLOAD_RETRIES + 1):
+        try:
+            await attempt()
+            return
+        except Exception as e:
+            if retry >= DOWNLOAD_RETRIES or not _is_transient(e):
+                raise
+            delay = min(RETRY_BACKOFF_MAX, RETRY_BACKOFF * 2 ** retry) * random.uniform(0.5, 1.0)
+            logger.warning("Transient error on %s (%r); retry %s/%s in %.1fs", description, e, retry + 1, DOWNLOAD_RETRIES, delay)
+            await asyncio.sleep(delay)
+
+async def _download_segment(url: str, output_path: Path, start: int, end: int, counter: _ByteCounter) -> None:
+    """
+    Fetches bytes [start, end] of url and writes them at the same offset of output_path,
+    which must already be preallocated. Interrupted transfers resume from the
+    last byte written. Raises on any failure that survives the retries.
+    """
+    client = get_http_client()
+    position = start
+
+    async def attempt() -> None:
+        nonlocal position
+        async with client.stream("GET", url, headers={"Range": f"bytes={position}-{end}"}) as r:
+            r.raise_for_status()
+            if r.status_code != 206:
+                raise StreamDownloadError(f"Server ignored Range header for segment {start}-{end}")
+            with open(output_path, 'r+b') as f:
+                f.seek(position)
+                async for chunk in r.aiter_bytes(chunk_size=CHUNK_SIZE):
+                    f.write(chunk)
+                    position += len(chunk)
+                    counter.add(len(chunk))
+                    await scheduler.pace(url, len(chunk))
+        if position != end + 1:
+            raise TransientDownloadError(f"Segment {start}-{end} ended early at offset {position}")
+
+    await _with_retries(attempt, f"segment {start}-{end} of {output_path.name}")
+
+async def _download_segments(url: str, output_path: Path, ranges: List[Tuple[int, int]], counter: _ByteCounter) -> None:
+    """
+    Downloads all ranges concurrently. If one segment fails, the others are
+    cancelled and awaited before the error propagates, so nothing keeps
+    downloading once the caller has released its slot and removed the file.
+    """
+    segments = [asyncio.ensure_future(_download_segment(url, output_path, start, end, counter)) for start, end in ranges]
+    try:
+        await asyncio.gather(*segments)
+    except BaseException:
+        for segment in segments:
+            segment.cancel()
+        await asyncio.gather(*segments, return_exceptions=True)
+        raise
+
+async def _download_single(url: str, output_path: Path, counter: _ByteCounter) -> None:
+    """
+    Fetches url with one sequential GET into output_path. After an interruption
+    the transfer resumes with a Range request from the end of the partial file,
+    or restarts from zero if the server does not honour it.
+    Raises on any failure that survives the retries.
+    """
+    client = get_http_client()
+    position = 0
+    open(output_path, 'wb').close()
+
+    async def attempt() -> None:
+        nonlocal position
+        headers = {"Range": f"bytes={position}-"} if position else {}
+        async with client.stream("GET", url, headers=headers) as r:
+            r.raise_for_status()  # Will raise an HTTPStatusError for bad responses (4XX, 5XX)
+            if position and r.status_code != 206:
+                logger.info("Server ignored resume request for %s; restarting from zero", output_path.name)
+                counter.add(-position)
+                position = 0
+            content_length = r.headers.get("Content-Length")
+            if counter.total is None and position == 0 and content_length and content_length.isdigit():
+                counter.total = int(content_length)
+            with open(output_path, 'r+b') as f:
+                f.seek(position)
+                f.truncate()
+                async for chunk in r.aiter_bytes(chunk_size=CHUNK_SIZE):
+                    f.write(chunk)
+                    position += len(chunk)
+                    counter.add(len(chunk))
+                    await scheduler.pace(url, len(chunk))
+        if counter.total is not None and position < counter.total:
+            raise TransientDownloadError(f"Download of {output_path.name} ended early at {position}/{counter.total} bytes")
+
+    await _with_retries(attempt, f"download of {output_path.name}")
+
+async def download_stream(url: str, output_path: Path, segments: int = DOWNLOAD_SEGMENTS,
+                          progress: Optional[DownloadProgress] = None, label: str = "stream") -> bool:
     """
     Downloads content from a URL and saves it to output_path.
-    Uses streaming to handle potentially large files.
+    Large streams on servers that support Range requests are split into
+    `segments` parallel requests written into a preallocated file; anything
+    else is fetched with a single streaming GET. Transient failures are
+    retried with backoff and resume where they left off.
+    `progress` is called with the running byte count after every chunk.
+    `label` (e.g. "video" or "audio") names the stream in metrics and traces.
+    The download holds a global slot from the scheduler and one connection
+    to the site per request it runs at once, and is paced to its bandwidth
+    caps; scheduler.AdmissionRejected propagates if no slot frees up in time.
+    A segmented download uses fewer segments when the site has fewer
+    connections to spare.
     Returns True on success, False on failure.
     """
-    logger.info(f"Attempting to download stream from {url} to {output_path}")
+    logger.info("Attempting to download stream from %s to %s", url, output_path)
+    partial = partial_path(output_path)
+    async with scheduler.download_slot(url) as connections:
+        ok = False
+        try:
+            ok = await _download_stream(url, partial, segments, progress, label, connections)
+            if ok:
+                os.replace(partial, output_path)
+            return ok
+        finally:
+            if not ok:
+                partial.unlink(missing_ok=True)
+
+async def _download_stream(url: str, output_path: Path, segments: int, progress: Optional[DownloadProgress],
+                           label: str, connections: scheduler.Connections) -> bool:
+    import httpx
+    started = time.perf_counter()
     try:
-        with requests.get(url, stream=True, timeout=30) as r: # Added timeout
-            r.raise_for_status()  # Will raise an HTTPError for bad responses (4XX, 5XX)
-            with open(output_path, 'wb') as f:
-                for chunk in r.iter_content(chunk_size=8192):
-                    f.write(chunk)
-        logger.info(f"Successfully downloaded to {output_path}")
+        with timed(f"download_{label}"):
+            total_size = await probe_range_support(url) if segments > 1 else None
+            counter = _ByteCounter(progress, label, total_size)
+            if total_size is not None and total_size >= SEGMENT_MIN_SIZE:
+                ranges = split_ranges(total_size, connections.widen(segments))
+                logger.info("Downloading %s bytes in %s segments to %s", total_size, len(ranges), output_path)
+                with open(output_path, 'wb') as f:
+                    f.truncate(total_size) # Preallocate so every segment can write at its own offset
+                await _download_segments(url, output_path, ranges, counter)
+            else:
+                await _download_single(url, output_path, counter)
+        DOWNLOAD_THROUGHPUT.observe(counter.done / max(time.perf_counter() - started, 1e-6), label)
+        logger.info("Successfully downloaded to %s", output_path)
         return True
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Failed to download {url}. Error: {e}")
+    except (httpx.HTTPError, StreamDownloadError) as e:
+        logger.error("Failed to download %s. Error: %s", url, e)
         return False
     except IOError as e:
-        logger.error(f"Failed to write to {output_path}. Error: {e}")
+        logger.error("Failed to write to %s. Error: %s", output_path, e)
         return False
 
-def run_ffmpeg_mux(video_path: Path, audio_path: Path, output_path: Path, ffmpeg_exe_path: str = FFMPEG_EXE_PATH) -> bool:
+async def _read_ffmpeg_output(stream: asyncio.StreamReader, tail: deque, progress: Optional[MuxProgress]) -> None:
+    """
+    Reads an FFmpeg output pipe until EOF. Lines written by -progress
+    (key=value, with each block ending in a progress= line) are collected and
+    passed to `progress`; other lines are kept in `tail` for error reporting.
+    Draining is required so FFmpeg never blocks on a full pipe.
+    """
+    fields: Dict[str, str] = {}
+    while True:
+        line = await stream.readline()
+        if not line:
+            break
+        text = line.decode(errors='replace').rstrip()
+        key, sep, value = text.partition('=')
+        if sep and key and ' ' not in key:
+            fields[key] = value.strip()
+            if key == 'progress':
+                if progress is not None:
+                    progress(fields)
+                fields = {}
+        elif text:
+            tail.append(text)
+
+async def run_ffmpeg_mux(video_path: Path, audio_path: Path, output_path: Path, ffmpeg_exe_path: Optional[str] = None,
+                         progress: Optional[MuxProgress] = None) -> bool:
     """
     Muxes video and audio streams into an output file using FFmpeg.
+    FFmpeg runs as an asyncio subprocess so the event loop is never blocked.
+    Mux progress is read from `-progress pipe:1` and passed to `progress`.
+    FFmpeg writes to a partial file that is renamed to output_path on success.
+    Uses the probed FFmpeg unless ffmpeg_exe_path is given.
     Returns True on success, False on failure.
     """
-    if not Path(ffmpeg_exe_path).exists():
-        logger.error(f"FFmpeg executable not found at {ffmpeg_exe_path}. Please check the path.")
+    ffmpeg_exe_path = ffmpeg_exe_path or ffmpeg_path()
+    if not ffmpeg_exe_path:
+        logger.error("Cannot mux %s: %s", output_path, probe_ffmpeg().get("error"))
         return False
     if not video_path.exists():
-        logger.error(f"Input video file not found: {video_path}")
+        logger.error("Input video file not found: %s", video_path)
         return False
     if not audio_path.exists():
-        logger.error(f"Input audio file not found: {audio_path}")
+        logger.error("Input audio file not found: %s", audio_path)
         return False
 
     command = [
@@ -68,27 +380,126 @@ def run_ffmpeg_mux(video_path: Path, audio_path: Path, output_path: Path, ffmpeg
         '-i', str(audio_path),
         '-c:v', 'copy',          # Copy video stream without re-encoding
         '-c:a', 'copy',          # Copy audio stream without re-encoding
+        '-progress', 'pipe:1',   # Machine-readable progress on stdout
+        '-nostats',
         '-y',                    # Overwrite output file if it exists
-        str(output_path)
+        str(partial_path(output_path))
     ]
 
-    logger.info(f"Running FFmpeg command: {' '.join(command)}")
+    logger.info("Running FFmpeg command: %s", ' '.join(command))
+    process = None
+    started = time.perf_counter()
+    result = "error"
     try:
-        process = subprocess.run(command, capture_output=True, text=True, check=False, timeout=300) # Added timeout, check=False
+        process = await asyncio.create_subprocess_exec(
+            *command,
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        progress_tail: deque = deque(maxlen=20)
+        stderr_tail: deque = deque(maxlen=20)
+        await asyncio.wait_for(asyncio.gather(
+            _read_ffmpeg_output(process.stdout, progress_tail, progress),
+            _read_ffmpeg_output(process.stderr, stderr_tail, None),
+            process.wait(),
+        ), timeout=FFMPEG_TIMEOUT)
         if process.returncode == 0:
-            logger.info(f"FFmpeg muxing successful: {output_path}")
+            os.replace(partial_path(output_path), output_path)
+            logger.info("FFmpeg muxing successful: %s", output_path)
+            result = "ok"
             return True
         else:
-            logger.error(f"FFmpeg failed for {output_path}.")
-            logger.error(f"FFmpeg stdout: {process.stdout}")
-            logger.error(f"FFmpeg stderr: {process.stderr}")
+            stderr_text = '\n'.join(stderr_tail)
+            logger.error("FFmpeg failed for %s.", output_path)
+            logger.error("FFmpeg stderr: %s", stderr_text)
             return False
-    except subprocess.TimeoutExpired:
-        logger.error(f"FFmpeg command timed out for {output_path}.")
+    except asyncio.TimeoutError:
+        logger.error("FFmpeg command timed out for %s.", output_path)
+        result = "timeout"
         return False
-    except Exception as e: # Catch any other exception during subprocess.run
-        logger.error(f"An unexpected error occurred while running FFmpeg: {e}")
+    except Exception as e: # Catch any other exception while starting or waiting on FFmpeg
+        logger.error("An unexpected error occurred while running FFmpeg: %s", e)
         return False
+    finally:
+        # Make sure a timed-out or cancelled FFmpeg does not outlive the request
+        if process is not None and process.returncode is None:
+            process.kill()
+            await process.wait()
+        if result != "ok":
+            partial_path(output_path).unlink(missing_ok=True)
+        FFMPEG_SECONDS.observe(time.perf_counter() - started, "file", result)
+
+
+async def stream_ffmpeg_mux(video_source: str, audio_source: str, ffmpeg_exe_path: Optional[str] = None,
+                            progress: Optional[MuxProgress] = None) -> AsyncIterator[bytes]:
+    """
+    Streaming variant of run_ffmpeg_mux. FFmpeg reads the video and audio sources
+    (stream URLs or local paths) directly and writes fragmented MP4 to stdout, which
+    is yielded chunk by chunk. No intermediate files are written.
+    Stdout carries the media, so mux progress is read from stderr instead.
+    Raises RuntimeError if FFmpeg is missing, cannot read the sources, or exits
+    with an error.
+    """
+    ffmpeg = probe_ffmpeg()
+    ffmpeg_exe_path = ffmpeg_exe_path or ffmpeg.get("path")
+    if not ffmpeg_exe_path:
+        raise RuntimeError(f"FFmpeg is not usable: {ffmpeg.get('error')}")
+    if not ffmpeg.get("https") and any(source.startswith('https://') for source in (video_source, audio_source)):
+        raise RuntimeError("FFmpeg was built without HTTPS support, so it cannot read the streams itself.")
+
+    # Reconnect options only apply to network inputs
+    reconnect = ['-reconnect', '1', '-reconnect_streamed', '1', '-reconnect_delay_max', '5']
+    command = [ffmpeg_exe_path, '-nostdin', '-loglevel', 'error']
+    for source in (video_source, audio_source):
+        if source.startswith(('http://', 'https://')):
+            command += reconnect
+        command += ['-i', source]
+    command += [
+        '-map', '0:v:0',         # Video from the first input
+        '-map', '1:a:0',         # Audio from the second input
+        '-c', 'copy',            # No re-encoding
+        # Fragmented MP4 can be written to a non-seekable pipe and played as it arrives
+        '-movflags', 'frag_keyframe+empty_moov+default_base_moof',
+        '-f', 'mp4',
+        '-progress', 'pipe:2',
+        '-nostats',
+        'pipe:1',
+    ]
+
+    logger.info("Running streaming FFmpeg mux")
+    process = await asyncio.create_subprocess_exec(
+        *command,
+        stdin=asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    stderr_tail: deque = deque(maxlen=20)
+    stderr_task = asyncio.create_task(_read_ffmpeg_output(process.stderr, stderr_tail, progress))
+    started = time.perf_counter()
+    result = "error"
+    try:
+        while True:
+            chunk = await process.stdout.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+        await process.wait()
+        await stderr_task
+        if process.returncode != 0:
+            stderr_text = '\n'.join(stderr_tail)
+            logger.error("Streaming FFmpeg mux failed with code %s: %s", process.returncode, stderr_text)
+            raise RuntimeError(f"FFmpeg exited with code {process.returncode}")
+        logger.info("Streaming FFmpeg mux finished")
+        result = "ok"
+    finally:
+        # Client disconnects close this generator early; stop FFmpeg with it
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+            result = "aborted"
+        stderr_task.cancel()
+        FFMPEG_SECONDS.observe(time.perf_counter() - started, "stream", result)
 
 
 def cleanup_files(paths: list) -> None:
@@ -101,34 +512,10 @@ def cleanup_files(paths: list) -> None:
             p = Path(file_path) # Ensure it's a Path object
             if p.exists():
                 p.unlink()
-                logger.info(f"Successfully deleted temporary file: {p}")
+                logger.info("Successfully deleted temporary file: %s", p)
             else:
-                logger.info(f"Temporary file not found for deletion (already deleted?): {p}")
+                logger.info("Temporary file not found for deletion (already deleted?): %s", p)
         except OSError as e: # Catching OSError for file deletion issues
-            logger.error(f"Error deleting temporary file {file_path}: {e}")
+            logger.error("Error deleting temporary file %s: %s", file_path, e)
         except Exception as e:
-            logger.error(f"Unexpected error deleting file {file_path}: {e}")
-
-if __name__ == '__main__':
-    # Basic test for generate_temp_filepath
-    # Create a dummy temp_files directory at the same level as processor.py for this test
-    # This is just for a direct `python processor.py` run, actual app will use the path relative to __file__
-
-    # test_temp_dir = Path("temp_files") # For direct script run test
-    # os.makedirs(test_temp_dir, exist_ok=True)
-    # temp_video_path = generate_temp_filepath(prefix="test_video", extension=".mp4")
-    # temp_audio_path = generate_temp_filepath(prefix="test_audio", extension=".m4a")
-    # temp_output_path = generate_temp_filepath(prefix="test_output", extension=".mp4")
-    # print(f"Generated video path: {temp_video_path}")
-    # print(f"Generated audio path: {temp_audio_path}")
-    # print(f"Generated output path: {temp_output_path}")
-
-    # Note: download_stream and run_ffmpeg_mux would require actual URLs and files for testing here.
-    # print("\nTo test download_stream and run_ffmpeg_mux, you would need:")
-    # print("1. Valid stream URLs.")
-    # print("2. FFmpeg installed and FFMPEG_EXE_PATH correctly set.")
-    # print("3. Actual video and audio files created from those URLs.")
-
-    # Example cleanup test
-    # cleanup_files([temp_video_path, temp_audio_path, temp_output_path, "non_existent_file.txt"])
-    pass
+            logger.error("Unexpected error deleting file %s: %s", file_path, e)
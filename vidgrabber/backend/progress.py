@@ -0,0 +1,106 @@
+import time
+import asyncio
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional
+
+# Byte counters fire on every chunk; events are emitted at most this often per stream.
+EMIT_INTERVAL = 0.5
+
+
+class ProgressReporter:
+    """
+    Ordered log of structured progress events for one job. emit() is a plain
+    function so it can be called from download and FFmpeg callbacks; any number
+    of subscribers can follow the log, each starting from the first event.
+    """
+
+    def __init__(self) -> None:
+        self.events: List[Dict[str, Any]] = []
+        self.closed = False
+        self._new_event = asyncio.Event()
+        # Called with the index and contents of every new event, e.g. to persist it
+        self.listener: Optional[Callable[[int, Dict[str, Any]], None]] = None
+
+    def emit(self, event: str, **data: Any) -> None:
+        if self.closed:
+            return
+        record = {"event": event, "time": time.time(), **data}
+        self.events.append(record)
+        if self.listener is not None:
+            self.listener(len(self.events) - 1, record)
+        self._wake()
+
+    def close(self) -> None:
+        self.closed = True
+        self._wake()
+
+    def _wake(self) -> None:
+        # Swap in a fresh Event so waiters only see the transition they waited for
+        new_event, self._new_event = self._new_event, asyncio.Event()
+        new_event.set()
+
+    async def subscribe(self, heartbeat: Optional[float] = None) -> AsyncIterator[Optional[Dict[str, Any]]]:
+        """
+        Yields every event from the beginning until the reporter is closed.
+        With a heartbeat interval, yields None whenever that long passes without
+        an event so callers can keep idle connections alive.
+        """
+        index = 0
+        while True:
+            while index < len(self.events):
+                yield self.events[index]
+                index += 1
+            if self.closed:
+                return
+            waiter = self._new_event
+            try:
+                await asyncio.wait_for(waiter.wait(), timeout=heartbeat)
+            except asyncio.TimeoutError:
+                yield None
+
+    async def relay(self, source: "ProgressReporter") -> None:
+        """
+        Copies events from another reporter into this one until it closes.
+        Used when a job attaches to work that another job already started.
+        """
+        async for event in source.subscribe():
+            if event is not None:
+                data = {k: v for k, v in event.items() if k not in ("event", "time")}
+                self.emit(event["event"], **data)
+
+
+def download_callback(reporter: ProgressReporter, stream: str) -> Callable[[int, Optional[int]], None]:
+    """
+    Returns a download_stream progress callback that emits throttled
+    'download' events with bytes done, total size and average throughput.
+    """
+    started = time.monotonic()
+    last_emit = [0.0]
+
+    def on_progress(downloaded: int, total: Optional[int]) -> None:
+        now = time.monotonic()
+        finished = total is not None and downloaded >= total
+        if not finished and now - last_emit[0] < EMIT_INTERVAL:
+            return
+        last_emit[0] = now
+        elapsed = max(now - started, 1e-6)
+        reporter.emit("download", stream=stream, bytes=downloaded, total=total,
+                      throughput_bps=int(downloaded / elapsed))
+
+    return on_progress
+
+
+def mux_callback(reporter: ProgressReporter, duration: Optional[float]) -> Callable[[Dict[str, str]], None]:
+    """
+    Returns an FFmpeg progress callback that emits 'mux' events. The percentage
+    is only included when the media duration is known.
+    """
+    def on_progress(fields: Dict[str, str]) -> None:
+        try:
+            out_time = int(fields.get("out_time_us", "0")) / 1_000_000
+        except ValueError: # FFmpeg reports "N/A" before the first packet
+            out_time = 0.0
+        percent = round(min(100.0, out_time * 100 / duration), 1) if duration else None
+        reporter.emit("mux", out_time=out_time, percent=percent,
+                      speed=fields.get("speed"), finished=fields.get("progress") == "end")
+
+    return on_progress
@@ -0,0 +1,412 @@
+import os
+import math
+import time
+import shutil
+import asyncio
+import logging
+import contextvars
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from pathlib import Path
+from typing import AsyncIterator, Deque, Dict, Iterator, Optional
+from urllib.parse import urlsplit
+
+from fastapi import HTTPException
+
+from .metrics import ADMISSION_IN_USE, ADMISSION_WAITING, ADMISSION_REJECTED, DISK_RESERVED
+from .config import (MAX_CONCURRENT_DOWNLOADS, MAX_DOWNLOADS_PER_HOST, MAX_CONCURRENT_MUXES,
+                     DOWNLOAD_BANDWIDTH, HOST_BANDWIDTH, ADMISSION_TIMEOUT,
+                     ADMISSION_QUEUE_LIMIT, ADMISSION_RETRY_AFTER)
+
+try:
+    import fcntl # POSIX only; serializes disk reservations between processes
+except ImportError: # pragma: no cover - Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Admission control for upstream fetches and FFmpeg runs. Downloads pass a
+# global and a per-site concurrency gate and are paced by token buckets; muxes
+# pass their own gate; jobs reserve temp-dir disk space up front. Request
+# handlers wait up to ADMISSION_TIMEOUT for capacity and then get a 503 with
+# Retry-After. Background jobs and batches set wait_for_capacity and queue
+# for as long as it takes instead.
+#
+# With several worker processes the concurrency and bandwidth limits are
+# split evenly between them (see divide_limits), while disk reservations are
+# shared through the temp dir, so the configured limits hold for the server
+# as a whole.
+wait_for_capacity: contextvars.ContextVar[bool] = contextvars.ContextVar("wait_for_capacity", default=False)
+
+# How often a task waiting for disk space re-checks the filesystem (seconds)
+DISK_POLL_INTERVAL = 1.0
+
+
+class AdmissionRejected(HTTPException):
+    """Capacity is exhausted; the client should retry after a while."""
+
+    def __init__(self, gate: str, retry_after: float = ADMISSION_RETRY_AFTER) -> None:
+        super().__init__(status_code=503,
+                         detail=f"The server is busy ({gate}). Please try again later.",
+                         headers={"Retry-After": str(max(1, math.ceil(retry_after)))})
+        self.gate = gate
+
+
+def _admission_limits() -> tuple:
+    """
+    Returns (timeout, queue_limit) for the current task: bounded for request
+    handlers, unbounded for background work.
+    """
+    if wait_for_capacity.get():
+        return None, None
+    return ADMISSION_TIMEOUT, ADMISSION_QUEUE_LIMIT
+
+
+class Gate:
+    """
+    FIFO counting semaphore with a bounded wait. A limit of 0 or less means
+    unlimited. Slots are handed directly to the longest waiter on release, so
+    a burst of new arrivals cannot overtake tasks that are already queued.
+    """
+
+    def __init__(self, name: str, limit: int) -> None:
+        self.name = name
+        self.limit = limit
+        self.active = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+
+    @property
+    def idle(self) -> bool:
+        return self.active == 0 and not self._waiters
+
+    async def acquire(self) -> None:
+        if self.limit <= 0 or (self.active < self.limit and not self._waiters):
+            self.active += 1
+            ADMISSION_IN_USE.inc(1, self.name)
+            return
+        timeout, queue_limit = _admission_limits()
+        if queue_limit is not None and len(self._waiters) >= queue_limit:
+            ADMISSION_REJECTED.inc(1, self.name)
+            raise AdmissionRejected(self.name)
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        ADMISSION_WAITING.inc(1, self.name)
+        try:
+            await asyncio.wait((waiter,), timeout=timeout)
+        except BaseException:
+            if waiter.done() and not waiter.cancelled():
+                self.release() # A slot was handed over just as we were cancelled
+            else:
+                waiter.cancel()
+            raise
+        finally:
+            ADMISSION_WAITING.dec(1, self.name)
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+        if not waiter.done():
+            waiter.cancel()
+            ADMISSION_REJECTED.inc(1, self.name)
+            raise AdmissionRejected(self.name)
+        # release() transferred its slot to us, so active is already counted
+
+    def try_acquire(self, wanted: int) -> int:
+        """
+        Takes up to `wanted` slots that are free right now, without waiting,
+        and returns how many it took. Nothing is taken while tasks are queued.
+        """
+        if self.limit <= 0:
+            granted = wanted
+        elif self._waiters:
+            granted = 0
+        else:
+            granted = max(0, min(wanted, self.limit - self.active))
+        self.active += granted
+        ADMISSION_IN_USE.inc(granted, self.name)
+        return granted
+
+    def release(self) -> None:
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+        ADMISSION_IN_USE.dec(1, self.name)
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        await self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+
+class TokenBucket:
+    """
+    Paces a byte stream to `rate` bytes per second with bursts of up to one
+    second's worth. Callers that overdraw the bucket sleep off the debt, so
+    concurrent consumers share the rate roughly evenly. A rate of 0 disables it.
+    """
+
+    def __init__(self, rate: int) -> None:
+        self.rate = rate
+        self.capacity = float(rate)
+        self.tokens = float(rate)
+        self.updated = time.monotonic()
+
+    async def consume(self, amount: int) -> None:
+        if self.rate <= 0:
+            return
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= amount
+        if self.tokens < 0:
+            await asyncio.sleep(-self.tokens / self.rate)
+
+
+    def set_rate(self, rate: int) -> None:
+        self.rate = rate
+        self.capacity = float(rate)
+        self.tokens = min(self.tokens, self.capacity)
+
+
+# This process's share of the per-site limits (see divide_limits)
+_host_limit = MAX_DOWNLOADS_PER_HOST
+_host_bandwidth = HOST_BANDWIDTH
+
+
+class _Host:
+    def __init__(self) -> None:
+        # Counts connections rather than downloads, as a segmented download opens several
+        self.gate = Gate("host", _host_limit)
+        self.bucket = TokenBucket(_host_bandwidth)
+
+
+download_gate = Gate("download", MAX_CONCURRENT_DOWNLOADS)
+mux_gate = Gate("mux", MAX_CONCURRENT_MUXES)
+download_bucket = TokenBucket(DOWNLOAD_BANDWIDTH)
+_hosts: Dict[str, _Host] = {}
+
+
+def _share(limit: int, workers: int) -> int:
+    return limit if limit <= 0 else max(1, limit // workers)
+
+
+def divide_limits(workers: int) -> None:
+    """
+    Cuts this process's concurrency and bandwidth limits to its share when
+    the server runs `workers` processes. Called by backend.serve before it
+    forks the workers. Shares are rounded down but at least 1, so the totals
+    stay within the configured limits unless a limit is below the number of
+    workers.
+    """
+    global _host_limit, _host_bandwidth
+    download_gate.limit = _share(MAX_CONCURRENT_DOWNLOADS, workers)
+    mux_gate.limit = _share(MAX_CONCURRENT_MUXES, workers)
+    download_bucket.set_rate(_share(DOWNLOAD_BANDWIDTH, workers))
+    _host_limit = _share(MAX_DOWNLOADS_PER_HOST, workers)
+    _host_bandwidth = _share(HOST_BANDWIDTH, workers)
+
+
+def host_key(url: str) -> str:
+    """
+    Groups stream URLs by upstream site: the last two labels of the hostname,
+    so the many edge hosts of one CDN (e.g. rr1---sn-abc.googlevideo.com)
+    share one limit.
+    """
+    hostname = (urlsplit(url).hostname or "").lower()
+    labels = hostname.split(".")
+    return ".".join(labels[-2:]) if len(labels) > 2 and not hostname.replace(".", "").isdigit() else hostname
+
+
+class Connections:
+    """
+    The connections to one site held by a download. It starts with one;
+    a segmented download widens it to open more.
+    """
+
+    def __init__(self, gate: Gate) -> None:
+        self._gate = gate
+        self.count = 1
+
+    def widen(self, wanted: int) -> int:
+        """
+        Takes connections to the site that are free right now, up to `wanted`
+        in total, and returns how many are held. Never waits, so downloads
+        holding one connection each cannot deadlock waiting for more.
+        """
+        if wanted > self.count:
+            self.count += self._gate.try_acquire(wanted - self.count)
+        return self.count
+
+
+@asynccontextmanager
+async def download_slot(url: str) -> AsyncIterator[Connections]:
+    """
+    Holds a connection to the site and a global download slot for the
+    enclosed download. The per-site connection comes first so a download
+    waiting on a busy site does not sit on a global slot that downloads from
+    other sites could use. Yields the held connections so a segmented
+    download can take more.
+    """
+    key = host_key(url)
+    host = _hosts.get(key)
+    if host is None:
+        host = _hosts[key] = _Host()
+    try:
+        await host.gate.acquire()
+        connections = Connections(host.gate)
+        try:
+            async with download_gate.slot():
+                yield connections
+        finally:
+            for _ in range(connections.count):
+                host.gate.release()
+    finally:
+        if host.gate.idle and _hosts.get(key) is host:
+            del _hosts[key]
+
+
+async def pace(url: str, amount: int) -> None:
+    """
+    Accounts `amount` downloaded bytes against the global and per-site
+    bandwidth caps, sleeping as needed to stay under them.
+    """
+    await download_bucket.consume(amount)
+    host = _hosts.get(host_key(url))
+    if host is not None:
+        await host.bucket.consume(amount)
+
+
+class DiskReservation:
+    def __init__(self, budget: "DiskBudget", amount: int) -> None:
+        self._budget = budget
+        self.amount = amount
+
+    def release(self) -> None:
+        """Returns the reserved space; safe to call more than once."""
+        if self.amount:
+            self._budget._release(self.amount)
+            self.amount = 0
+
+
+def _process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError: # Exists, but belongs to someone else
+        pass
+    return True
+
+
+class DiskBudget:
+    """
+    Tracks temp-dir disk space promised to running jobs, across every process
+    using the same temp dir. Each process records the total it has reserved in
+    reservations/<pid> there. A reservation is granted, under an exclusive
+    lock on that directory, only if the filesystem's free space minus the
+    reservations of every running process still leaves DISK_HEADROOM
+    afterwards. Records of processes that have exited are removed.
+
+    Free space shrinks as reserved files are written, so the check is
+    conservative while jobs are running.
+    """
+
+    def __init__(self, path: Path, headroom: int) -> None:
+        self.path = path
+        self.headroom = headroom
+        # Reserved by this process
+        self.reserved = 0
+        self._ledger = path / "reservations"
+        self._released = asyncio.Event()
+
+    def _free_space(self) -> int:
+        self.path.mkdir(parents=True, exist_ok=True)
+        return shutil.disk_usage(self.path).free
+
+    @contextmanager
+    def _locked(self) -> Iterator[None]:
+        self._ledger.mkdir(parents=True, exist_ok=True)
+        with open(self._ledger / ".lock", "a") as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX) # Held for a few small file operations at most
+            yield
+
+    def _reserved_elsewhere(self) -> int:
+        """Space reserved by other running processes. Call with the lock held."""
+        total = 0
+        for entry in self._ledger.iterdir():
+            if not entry.name.isdigit() or int(entry.name) == os.getpid():
+                continue
+            if not _process_alive(int(entry.name)):
+                entry.unlink(missing_ok=True)
+                continue
+            try:
+                total += int(entry.read_text() or 0)
+            except (OSError, ValueError):
+                pass
+        return total
+
+    def _record(self) -> None:
+        """Publishes this process's total. Call with the lock held."""
+        (self._ledger / str(os.getpid())).write_text(str(self.reserved))
+        DISK_RESERVED.set(self.reserved)
+
+    def _try_reserve(self, amount: int) -> Optional[int]:
+        """
+        Reserves `amount` bytes and returns None if they fit. Otherwise returns
+        the space reserved by all processes, which waiting may free.
+        """
+        with self._locked():
+            reserved = self.reserved + self._reserved_elsewhere()
+            if self._free_space() - reserved - amount < self.headroom:
+                return reserved
+            self.reserved += amount
+            self._record()
+            return None
+
+    async def reserve(self, amount: int) -> DiskReservation:
+        """
+        Reserves `amount` bytes, waiting for other jobs to release space if
+        needed. Raises AdmissionRejected on timeout, or right away if the
+        space could not be freed by waiting.
+        """
+        timeout, _ = _admission_limits()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        waiting = False
+        try:
+            while True:
+                reserved = self._try_reserve(amount)
+                if reserved is None:
+                    break
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if reserved == 0 or (remaining is not None and remaining <= 0):
+                    logger.warning("Not enough disk space for a %s byte reservation (%s bytes reserved)", amount, reserved)
+                    ADMISSION_REJECTED.inc(1, "disk")
+                    raise AdmissionRejected("disk space")
+                if not waiting:
+                    waiting = True
+                    ADMISSION_WAITING.inc(1, "disk")
+                # Releases in this process wake the wait early; other processes' are seen on the next poll
+                released = self._released
+                wait = DISK_POLL_INTERVAL if remaining is None else min(DISK_POLL_INTERVAL, remaining)
+                try:
+                    await asyncio.wait_for(released.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            if waiting:
+                ADMISSION_WAITING.dec(1, "disk")
+        return DiskReservation(self, amount)
+
+    def _release(self, amount: int) -> None:
+        with self._locked():
+            self.reserved -= amount
+            self._record()
+        # Swap in a fresh Event so waiters only see the release they waited for
+        released, self._released = self._released, asyncio.Event()
+        released.set()
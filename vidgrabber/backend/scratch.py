@@ -0,0 +1,301 @@
+import os
+import time
+import uuid
+import shutil
+import asyncio
+import logging
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple
+
+from .processor import TEMP_DIR_BASE
+from .config import (SCRATCH_MAX_AGE, OUTPUT_RETENTION, SCRATCH_MAX_BYTES, JANITOR_INTERVAL, MEMORY_SCRATCH_DIR,
+                     MEMORY_SCRATCH_MAX_FILE, MEMORY_SCRATCH_MAX_BYTES)
+from . import cache
+
+try:
+    import fcntl # POSIX only; marks which worker directories are still in use
+except ImportError: # pragma: no cover - Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Scratch layout under TEMP_DIR_BASE:
+#   scratch/<worker>/.lock       held (flock) for the lifetime of the worker process
+#   scratch/<worker>/<job>/      one directory per job: downloads and the mux output
+#   outputs/                     finished outputs that are not in the cache
+#   cache/                       see cache.py
+# A worker directory whose lock can be taken belongs to a dead process and is
+# removed by the sweep, so nothing a crashed worker left behind survives.
+SCRATCH_ROOT = TEMP_DIR_BASE / "scratch"
+OUTPUTS_DIR = TEMP_DIR_BASE / "outputs"
+MEMORY_ROOT = Path(MEMORY_SCRATCH_DIR) / "vidgrabber" if MEMORY_SCRATCH_DIR else None
+
+# Worker directories younger than this are never treated as orphaned (seconds)
+CLAIM_GRACE = 60
+
+# Loose files written directly into TEMP_DIR_BASE by earlier versions
+_LEGACY_PREFIXES = ("vid_", "aud_", "muxed_")
+
+# This process's worker directory name, its open lock file, and the PID that
+# claimed it (a forked child must claim its own)
+_worker_name: Optional[str] = None
+_worker_lock = None
+_worker_pid: Optional[int] = None
+# Bytes of memory-backed scratch handed out by this process
+_memory_in_use = 0
+
+
+def _worker_dir() -> Path:
+    """
+    Returns this process's scratch directory, creating and locking it on first
+    use. Created lazily so that forked workers each get their own.
+    """
+    if _worker_name is None or _worker_pid != os.getpid():
+        _claim_worker_dir()
+    return SCRATCH_ROOT / _worker_name
+
+
+def worker_name() -> str:
+    """
+    Name of this process's scratch directory, which also identifies the
+    process to other workers (see worker_alive).
+    """
+    _worker_dir()
+    return _worker_name
+
+
+def _claim_worker_dir() -> None:
+    global _worker_name, _worker_lock, _worker_pid
+    name = f"w{os.getpid()}_{uuid.uuid4().hex[:8]}"
+    path = SCRATCH_ROOT / name
+    path.mkdir(parents=True, exist_ok=True)
+    lock = open(path / ".lock", "a")
+    if fcntl is not None:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    _worker_name, _worker_lock, _worker_pid = name, lock, os.getpid()
+
+
+def worker_alive(name: str, grace: float = CLAIM_GRACE) -> bool:
+    """
+    True if the worker that owns scratch/<name> is still running, judged by
+    whether its lock is held. Directories younger than `grace` seconds count
+    as alive. Without fcntl every worker is assumed alive and only the age
+    limit applies.
+    """
+    if name == _worker_name and _worker_pid == os.getpid():
+        return True
+    if fcntl is None:
+        return True
+    lock_path = SCRATCH_ROOT / name / ".lock"
+    try:
+        if time.time() - (SCRATCH_ROOT / name).stat().st_mtime < grace:
+            return True # Just created; its owner may not have taken the lock yet
+    except OSError:
+        return False
+    try:
+        with open(lock_path, "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            fcntl.flock(lock, fcntl.LOCK_UN)
+            return False
+    except BlockingIOError:
+        return True
+    except OSError: # Directory already gone or unreadable
+        return False
+
+
+class ScratchDir:
+    """
+    A private directory for one job's intermediate files. cleanup() removes
+    it along with everything in it; finished files that must outlive the job
+    are moved out first with keep() (or into the cache with cache.store).
+    """
+
+    def __init__(self, prefix: str = "job") -> None:
+        self.name = f"{prefix}_{uuid.uuid4().hex}"
+        self.path = _worker_dir() / self.name
+        self.path.mkdir(parents=True)
+        self._memory_path: Optional[Path] = None
+        self._memory_bytes = 0
+
+    def __enter__(self) -> "ScratchDir":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.cleanup()
+
+    def file(self, name: str, expected_size: Optional[int] = None) -> Path:
+        """
+        Returns the path for a new file in this directory. Files with a known
+        size of at most MEMORY_SCRATCH_MAX_FILE are placed in the memory-backed
+        scratch directory instead, while its per-worker budget allows.
+        """
+        global _memory_in_use
+        if (MEMORY_ROOT is not None and expected_size is not None and expected_size <= MEMORY_SCRATCH_MAX_FILE
+                and _memory_in_use + expected_size <= MEMORY_SCRATCH_MAX_BYTES):
+            if self._memory_path is None:
+                self._memory_path = MEMORY_ROOT / _worker_name / self.name
+                self._memory_path.mkdir(parents=True)
+            _memory_in_use += expected_size
+            self._memory_bytes += expected_size
+            return self._memory_path / name
+        return self.path / name
+
+    def keep(self, path: Path) -> Path:
+        """
+        Moves a finished file into OUTPUTS_DIR so it survives cleanup().
+        Returns its new path.
+        """
+        OUTPUTS_DIR.mkdir(parents=True, exist_ok=True)
+        destination = OUTPUTS_DIR / f"{uuid.uuid4().hex}{path.suffix}"
+        os.replace(path, destination)
+        return destination
+
+    def cleanup(self) -> None:
+        """Removes the directory and its files; safe to call more than once."""
+        global _memory_in_use
+        shutil.rmtree(self.path, ignore_errors=True)
+        if self._memory_path is not None:
+            shutil.rmtree(self._memory_path, ignore_errors=True)
+            _memory_in_use -= self._memory_bytes
+            self._memory_bytes = 0
+            self._memory_path = None
+
+
+# --- Sweeping ---
+
+def _tree_size_and_mtime(path: Path) -> Tuple[int, float]:
+    """
+    Total size of the files under path and the newest modification time found.
+    """
+    size, newest = 0, 0.0
+    try:
+        newest = path.stat().st_mtime
+    except OSError:
+        return 0, 0.0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                st = os.stat(os.path.join(root, name))
+            except OSError: # Deleted while walking
+                continue
+            size += st.st_size
+            newest = max(newest, st.st_mtime)
+    return size, newest
+
+
+def _children(path: Optional[Path]) -> Iterator[Path]:
+    if path is None:
+        return
+    try:
+        yield from path.iterdir()
+    except FileNotFoundError:
+        return
+
+
+def _remove(path: Path) -> None:
+    if path.is_dir() and not path.is_symlink():
+        shutil.rmtree(path, ignore_errors=True)
+    else:
+        path.unlink(missing_ok=True)
+
+
+def sweep_orphans() -> int:
+    """
+    Removes scratch directories of workers that are no longer running (on disk
+    and in memory-backed scratch) and loose temp files left by earlier
+    versions. Returns the number of entries removed.
+    """
+    removed = 0
+    for worker in _children(SCRATCH_ROOT):
+        if not worker_alive(worker.name):
+            logger.info("Removing orphaned scratch directory %s", worker)
+            _remove(worker)
+            removed += 1
+    for worker in _children(MEMORY_ROOT):
+        if not worker_alive(worker.name):
+            _remove(worker)
+            removed += 1
+    for entry in _children(TEMP_DIR_BASE):
+        if entry.is_file() and entry.name.startswith(_LEGACY_PREFIXES):
+            logger.info("Removing leftover temp file %s", entry.name)
+            _remove(entry)
+            removed += 1
+    return removed
+
+
+def enforce_quotas(now: Optional[float] = None) -> None:
+    """
+    Removes job directories that have not been touched for SCRATCH_MAX_AGE
+    seconds and finished outputs older than OUTPUT_RETENTION seconds, then
+    deletes the oldest finished outputs
+    until scratch space is back under SCRATCH_MAX_BYTES. Directories of jobs
+    that are still running are never removed for size alone.
+    """
+    now = time.time() if now is None else now
+    cutoff = now - SCRATCH_MAX_AGE
+    total = 0
+    job_dirs = [job for worker in _children(SCRATCH_ROOT) if worker.is_dir() for job in _children(worker) if job.is_dir()]
+    job_dirs += [job for worker in _children(MEMORY_ROOT) if worker.is_dir() for job in _children(worker) if job.is_dir()]
+    for job in job_dirs:
+        size, mtime = _tree_size_and_mtime(job)
+        if mtime < cutoff:
+            logger.warning("Removing stale job directory %s (idle for %.0fs)", job, now - mtime)
+            _remove(job)
+        else:
+            total += size
+
+    outputs: List[Tuple[float, int, Path]] = []
+    output_cutoff = now - OUTPUT_RETENTION
+    for output in _children(OUTPUTS_DIR):
+        try:
+            st = output.stat()
+        except OSError:
+            continue
+        if st.st_mtime < output_cutoff:
+            _remove(output)
+        else:
+            outputs.append((st.st_mtime, st.st_size, output))
+            total += st.st_size
+
+    if SCRATCH_MAX_BYTES > 0 and total > SCRATCH_MAX_BYTES:
+        for _, size, output in sorted(outputs):
+            if total <= SCRATCH_MAX_BYTES:
+                break
+            logger.warning("Scratch space over quota; removing finished output %s", output.name)
+            _remove(output)
+            total -= size
+        if total > SCRATCH_MAX_BYTES:
+            logger.warning("Scratch space is %s bytes, over the %s byte quota, with only running jobs left", total, SCRATCH_MAX_BYTES)
+
+
+def janitor_pass() -> None:
+    sweep_orphans()
+    enforce_quotas()
+    cache.evict() # Applies the cache TTL even when nothing new is being stored
+
+
+async def run_janitor(interval: float = JANITOR_INTERVAL) -> None:
+    """
+    Runs a janitor pass every `interval` seconds until cancelled. The file
+    system work happens on a thread so the event loop is not blocked.
+    """
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await asyncio.to_thread(janitor_pass)
+        except Exception as e:
+            logger.error("Janitor pass failed: %s", e, exc_info=True)
+
+
+def release_worker_dir() -> None:
+    """
+    Removes this worker's scratch directory on a clean shutdown.
+    """
+    global _worker_name, _worker_lock, _worker_pid
+    if _worker_name is None or _worker_pid != os.getpid():
+        return
+    _remove(SCRATCH_ROOT / _worker_name)
+    if MEMORY_ROOT is not None:
+        _remove(MEMORY_ROOT / _worker_name)
+    _worker_lock.close()
+    _worker_name, _worker_lock, _worker_pid = None, None, None
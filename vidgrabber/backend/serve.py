@@ -0,0 +1,166 @@
+import gc
+import os
+import time
+import shutil
+import socket
+import signal
+import logging
+import argparse
+from typing import Set
+
+from .config import WORKERS, HOST, PORT
+from .logconfig import configure_logging
+
+logger = logging.getLogger(__name__)
+
+# Preload-and-fork server:
+#
+#   python -m backend.serve --workers 4 --port 8000
+#
+# The parent process imports the application and the dependencies the workers
+# would otherwise each load lazily (yt-dlp and its extractor registry, httpx),
+# probes FFmpeg and binds the listening socket. Only then does it fork the
+# workers, which share all of that copy-on-write instead of importing it again.
+# A new or restarted worker is ready as soon as its lifespan has run, and adds
+# only its own working set to the machine's memory use.
+#
+# The garbage collector is kept off in the parent and the preloaded objects are
+# frozen before forking (see gc.freeze), so collections in the workers do not
+# write to the shared pages and un-share them.
+
+# Seconds before a worker that died is replaced, so a crash on startup cannot spin
+RESTART_DELAY = 1.0
+# Seconds workers get to finish in-flight requests on shutdown before being killed
+SHUTDOWN_TIMEOUT = 30.0
+# How often the parent checks on its workers while they run (seconds)
+POLL_INTERVAL = 0.5
+
+
+def preload() -> None:
+    """
+    Imports and initializes everything that is the same in every worker.
+    """
+    import httpx # noqa: F401 - imported lazily by the workers otherwise
+    from . import app # noqa: F401
+    from .downloader import preload_extractors
+    from .processor import probe_ffmpeg
+    preload_extractors()
+    probe_ffmpeg()
+
+
+def bind_socket(host: str, port: int) -> socket.socket:
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.set_inheritable(True)
+    return sock
+
+
+def run_worker(sock: socket.socket) -> None:
+    """
+    Serves the application on an already bound socket until signalled to stop.
+    """
+    import uvicorn
+    from .app import app
+    # log_config=None: uvicorn's loggers propagate to the one configured by configure_logging
+    config = uvicorn.Config(app, log_config=None, timeout_graceful_shutdown=SHUTDOWN_TIMEOUT)
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+def serve(host: str = HOST, port: int = PORT, workers: int = WORKERS) -> None:
+    gc.disable() # Collections would leave freed holes in pages the workers are about to share
+    configure_logging()
+    started = time.perf_counter()
+    preload()
+    sock = bind_socket(host, port)
+    logger.info("Preloaded in %.2fs; listening on %s:%s", time.perf_counter() - started, host, port)
+
+    gc.freeze()
+    if workers <= 1 or not hasattr(os, "fork"):
+        gc.enable()
+        run_worker(sock)
+        return
+
+    from . import metrics, scheduler
+    from .processor import TEMP_DIR_BASE
+    metrics_dir = metrics.share_between_workers(TEMP_DIR_BASE / "metrics")
+    scheduler.divide_limits(workers)
+
+    children: Set[int] = set()
+    stopping = False
+
+    def spawn() -> None:
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                # Own process group: a Ctrl+C in the terminal reaches only the
+                # parent, which stops every worker exactly once
+                os.setpgid(0, 0)
+                signal.signal(signal.SIGINT, signal.SIG_DFL)
+                signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                gc.enable()
+                run_worker(sock)
+                code = 0
+            except BaseException:
+                logger.exception("Worker %s crashed", os.getpid())
+            finally:
+                os._exit(code)
+        children.add(pid)
+
+    def stop(signum, frame) -> None:
+        nonlocal stopping
+        if stopping:
+            return
+        stopping = True
+        logger.info("Stopping %s workers", len(children))
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    for _ in range(workers):
+        spawn()
+    logger.info("Started %s workers", workers)
+
+    deadline = None
+    while children:
+        if stopping and deadline is None:
+            deadline = time.monotonic() + SHUTDOWN_TIMEOUT + 5
+        if deadline is not None and time.monotonic() > deadline:
+            for pid in children:
+                logger.warning("Worker %s did not stop in time; killing it", pid)
+                os.kill(pid, signal.SIGKILL)
+            deadline = float("inf")
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            break
+        if pid == 0:
+            time.sleep(POLL_INTERVAL)
+            continue
+        children.discard(pid)
+        if not stopping:
+            logger.warning("Worker %s exited with code %s; starting a replacement",
+                           pid, os.waitstatus_to_exitcode(status))
+            time.sleep(RESTART_DELAY)
+            if not stopping:
+                spawn()
+    sock.close()
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run the VidGrabber API with preloaded, forked workers.")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    args = parser.parse_args()
+    serve(args.host, args.port, args.workers)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+import os
+import re
+import time
+import shutil
+import argparse
+import threading
+import subprocess
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Local stand-in for a media CDN. It serves a generated video-only MP4, an
+# audio-only M4A and a progressive (video with audio) MP4 under
+# /media/<video_id>/video.mp4, audio.m4a and progressive.mp4 for any video ID,
+# supports Range requests, and can inject latency and
+# per-connection throttling so benchmarks are reproducible without live sites.
+
+CHUNK_SIZE = 65536
+
+
+def generate_media(directory: Path, duration: int = 30, ffmpeg: Optional[str] = None) -> Tuple[Path, Path, Path]:
+    """
+    Generates a test-pattern video stream, a sine-tone audio stream of
+    `duration` seconds and a progressive file of the two in `directory`,
+    reusing them if they already exist.
+    Returns (video_path, audio_path, progressive_path).
+    """
+    ffmpeg = ffmpeg or shutil.which("ffmpeg")
+    if not ffmpeg:
+        raise RuntimeError("ffmpeg is required to generate benchmark media")
+    os.makedirs(directory, exist_ok=True)
+    video_path = directory / f"video_{duration}s.mp4"
+    audio_path = directory / f"audio_{duration}s.m4a"
+    progressive_path = directory / f"progressive_{duration}s.mp4"
+    if not video_path.exists():
+        subprocess.run([ffmpeg, '-loglevel', 'error', '-y', '-f', 'lavfi',
+                        '-i', f'testsrc2=size=1280x720:rate=30:duration={duration}',
+                        '-c:v', 'mpeg4', '-q:v', '5', '-an', str(video_path)], check=True)
+    if not audio_path.exists():
+        subprocess.run([ffmpeg, '-loglevel', 'error', '-y', '-f', 'lavfi',
+                        '-i', f'sine=frequency=440:duration={duration}',
+                        '-c:a', 'aac', '-b:a', '128k', str(audio_path)], check=True)
+    if not progressive_path.exists():
+        subprocess.run([ffmpeg, '-loglevel', 'error', '-y', '-i', str(video_path), '-i', str(audio_path),
+                        '-c', 'copy', '-movflags', '+faststart', str(progressive_path)], check=True)
+    return video_path, audio_path, progressive_path
+
+
+class MediaCDN:
+    """
+    Threaded HTTP server for the generated media.
+
+    latency:       seconds to wait before sending response headers
+    throttle:      bytes per second per connection (0 = unlimited)
+    support_range: when False, Range headers are ignored and 200 is returned
+    """
+
+    def __init__(self, video_path: Path, audio_path: Path, progressive_path: Optional[Path] = None,
+                 host: str = "127.0.0.1", port: int = 0, latency: float = 0.0, throttle: int = 0,
+                 support_range: bool = True) -> None:
+        self.files: Dict[str, bytes] = {
+            "video.mp4": video_path.read_bytes(),
+            "audio.m4a": audio_path.read_bytes(),
+        }
+        if progressive_path is not None:
+            self.files["progressive.mp4"] = progressive_path.read_bytes()
+        self.latency = latency
+        self.throttle = throttle
+        self.support_range = support_range
+        self.bytes_served = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "MediaCDN":
+        self._thread = threading.Thread(target=self._server.serve_forever, name="media-cdn", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _handler_class(self):
+        cdn = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args) -> None:
+                pass
+
+            def do_GET(self) -> None:
+                data = cdn.files.get(self.path.split("?")[0].rsplit("/", 1)[-1])
+                if data is None:
+                    self.send_error(404)
+                    return
+                if cdn.latency:
+                    time.sleep(cdn.latency)
+
+                start, end, status = 0, len(data) - 1, 200
+                match = re.match(r"bytes=(\d+)-(\d*)$", self.headers.get("Range", ""))
+                if match and cdn.support_range:
+                    start = int(match.group(1))
+                    end = min(int(match.group(2) or end), end)
+                    if start > end:
+                        self.send_response(416)
+                        self.send_header("Content-Range", f"bytes */{len(data)}")
+                        self.send_header("Content-Length", "0")
+                        self.end_headers()
+                        return
+                    status = 206
+
+                self.send_response(status)
+                self.send_header("Content-Type", "video/mp4" if self.path.endswith(".mp4") else "audio/mp4")
+                self.send_header("Content-Length", str(end - start + 1))
+                if cdn.support_range:
+                    self.send_header("Accept-Ranges", "bytes")
+                if status == 206:
+                    self.send_header("Content-Range", f"bytes {start}-{end}/{len(data)}")
+                self.end_headers()
+
+                position = start
+                try:
+                    while position <= end:
+                        chunk = data[position:min(position + CHUNK_SIZE, end + 1)]
+                        self.wfile.write(chunk)
+                        position += len(chunk)
+                        with cdn._lock:
+                            cdn.bytes_served += len(chunk)
+                        if cdn.throttle:
+                            time.sleep(len(chunk) / cdn.throttle)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+
+        return Handler
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Serve generated benchmark media with Range support.")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--duration", type=int, default=30, help="Media length in seconds")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds before each response")
+    parser.add_argument("--throttle", type=int, default=0, help="Bytes per second per connection (0 = unlimited)")
+    parser.add_argument("--no-range", action="store_true", help="Ignore Range headers")
+    parser.add_argument("--media-dir", type=Path, default=Path("bench_media"))
+    args = parser.parse_args()
+
+    video_path, audio_path, progressive_path = generate_media(args.media_dir, args.duration)
+    cdn = MediaCDN(video_path, audio_path, progressive_path, port=args.port, latency=args.latency,
+                   throttle=args.throttle, support_range=not args.no_range).start()
+    print(f"Serving {video_path.name}, {audio_path.name} and {progressive_path.name} at {cdn.base_url}/media/<id>/")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        cdn.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,265 @@
+import os
+import sys
+import json
+import time
+import signal
+import socket
+import asyncio
+import argparse
+import tempfile
+import statistics
+import subprocess
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+from .cdn import MediaCDN, generate_media
+
+# Load generator for /api/process_and_download_video (or the job API).
+# Starts the media CDN in-process and the API server as a subprocess with a
+# fresh temp directory, drives it at a fixed concurrency and reports latency
+# percentiles, throughput, peak server RSS and temp-dir disk usage.
+#
+#   cd vidgrabber && python -m bench.run --requests 200 --concurrency 20 --unique 10
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _dir_size(path: Path) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+def _disk_sample(temp_dir: Path) -> Dict[str, int]:
+    """
+    Bytes used under the server's temp dir: in total, by the per-job scratch
+    directories (scratch/<worker>/<job>), by the cache and by kept outputs,
+    plus the number of job directories, i.e. jobs holding scratch space.
+    """
+    scratch_root = temp_dir / "scratch"
+    job_dirs = [job for worker in (scratch_root.iterdir() if scratch_root.is_dir() else ()) if worker.is_dir()
+                for job in worker.iterdir() if job.is_dir()]
+    return {
+        "total": _dir_size(temp_dir),
+        "scratch": sum(_dir_size(job) for job in job_dirs),
+        "jobs": len(job_dirs),
+        "cache": _dir_size(temp_dir / "cache"),
+        "outputs": _dir_size(temp_dir / "outputs"),
+    }
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def _peak_rss(pid: int) -> Optional[int]:
+    """
+    Peak resident set size of process `pid` alone, in bytes (VmHWM from
+    /proc), or None where /proc is not available. Unlike RUSAGE_CHILDREN this
+    excludes the FFmpeg runs of generate_media and of the server.
+    """
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+async def _wait_until_ready(client: httpx.AsyncClient, timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if (await client.get("/")).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.1)
+    raise RuntimeError("API server did not become ready")
+
+
+async def _one_request(client: httpx.AsyncClient, mode: str, url: str, selection: Dict[str, Any]) -> int:
+    """
+    Runs one job to completion and returns the number of body bytes received.
+    """
+    if mode == "job":
+        response = await client.post("/api/jobs", json={"url": url, **selection})
+        response.raise_for_status()
+        job_id = response.json()["job_id"]
+        while True:
+            status = (await client.get(f"/api/jobs/{job_id}")).json()["status"]
+            if status in ("done", "failed"):
+                break
+            await asyncio.sleep(0.05)
+        path, method, body = f"/api/jobs/{job_id}/result", "GET", None
+    else:
+        path, method, body = "/api/process_and_download_video", "POST", {"url": url, "stream": mode == "stream", **selection}
+
+    received = 0
+    async with client.stream(method, path, json=body) as response:
+        response.raise_for_status()
+        async for chunk in response.aiter_bytes():
+            received += len(chunk)
+    return received
+
+
+async def run_load(base_url: str, mode: str, requests: int, concurrency: int, unique: int,
+                   temp_dir: Path, selection: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    latencies: List[float] = []
+    errors: List[str] = []
+    received_bytes = 0
+    # Highest value of each figure over all samples; `scratch_jobs` is the job count in the peak scratch sample
+    peak = {"total": 0, "scratch": 0, "scratch_jobs": 0, "cache": 0, "outputs": 0}
+    queue: "asyncio.Queue[int]" = asyncio.Queue()
+    for i in range(requests):
+        queue.put_nowait(i)
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=600) as client:
+        await _wait_until_ready(client)
+
+        async def worker() -> None:
+            nonlocal received_bytes
+            while True:
+                try:
+                    i = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                url = f"https://bench.invalid/watch?v=video{i % unique}"
+                start = time.perf_counter()
+                try:
+                    received = await _one_request(client, mode, url, selection or {})
+                    received_bytes += received
+                    latencies.append(time.perf_counter() - start)
+                except Exception as e:
+                    errors.append(repr(e))
+
+        def record(sample: Dict[str, int]) -> None:
+            for name in ("total", "cache", "outputs"):
+                peak[name] = max(peak[name], sample[name])
+            if sample["scratch"] > peak["scratch"]:
+                peak["scratch"], peak["scratch_jobs"] = sample["scratch"], sample["jobs"]
+
+        async def sample_disk() -> None:
+            while True:
+                # Walked on a thread so sampling does not hold up the load generator
+                record(await asyncio.to_thread(_disk_sample, temp_dir))
+                await asyncio.sleep(0.2)
+
+        sampler = asyncio.create_task(sample_disk())
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+        sampler.cancel()
+        final = _disk_sample(temp_dir)
+        record(final)
+        metrics_text = (await client.get("/metrics")).text
+
+    completed = len(latencies)
+    return {
+        "mode": mode,
+        "requests": requests,
+        "concurrency": concurrency,
+        "unique_videos": unique,
+        "selection": selection or {},
+        "completed": completed,
+        "errors": len(errors),
+        "error_samples": errors[:5],
+        "elapsed_s": round(elapsed, 3),
+        "jobs_per_s": round(completed / elapsed, 3) if elapsed else 0.0,
+        "latency_p50_s": round(percentile(latencies, 50), 4),
+        "latency_p99_s": round(percentile(latencies, 99), 4),
+        "latency_mean_s": round(statistics.mean(latencies), 4) if latencies else None,
+        "received_bytes": received_bytes,
+        "peak_temp_dir_bytes": peak["total"],
+        "final_temp_dir_bytes": final["total"],
+        "peak_scratch_bytes": peak["scratch"],
+        "jobs_in_flight_at_peak_scratch": peak["scratch_jobs"],
+        "peak_disk_per_inflight_job_bytes": peak["scratch"] // max(1, peak["scratch_jobs"]),
+        "peak_cache_bytes": peak["cache"],
+        "final_cache_bytes": final["cache"],
+        "peak_outputs_bytes": peak["outputs"],
+        "final_outputs_bytes": final["outputs"],
+        "server_metrics": metrics_text,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the VidGrabber API against a local media CDN.")
+    parser.add_argument("--mode", choices=("file", "stream", "job"), default="file")
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--unique", type=int, default=10, help="Distinct video IDs; fewer means more cache hits")
+    parser.add_argument("--duration", type=int, default=30, help="Length of the generated media in seconds")
+    parser.add_argument("--latency", type=float, default=0.0, help="CDN latency per response in seconds")
+    parser.add_argument("--throttle", type=int, default=0, help="CDN bytes per second per connection (0 = unlimited)")
+    parser.add_argument("--max-height", type=int, help="Request formats up to this height; 360 or less selects "
+                                                       "the stub's progressive format, which is passed through unmuxed")
+    parser.add_argument("--no-range", action="store_true", help="Make the CDN ignore Range requests")
+    parser.add_argument("--extract-latency", type=float, default=0.5, help="Simulated yt-dlp extraction time")
+    parser.add_argument("--media-dir", type=Path, default=Path(tempfile.gettempdir()) / "vidgrabber_bench_media")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    parser.add_argument("--show-metrics", action="store_true", help="Include the server's /metrics output")
+    args = parser.parse_args()
+
+    video_path, audio_path, progressive_path = generate_media(args.media_dir, args.duration)
+    cdn = MediaCDN(video_path, audio_path, progressive_path, latency=args.latency, throttle=args.throttle,
+                   support_range=not args.no_range).start()
+
+    port = _free_port()
+    with tempfile.TemporaryDirectory(prefix="vidgrabber_bench_") as work_dir:
+        temp_dir = Path(work_dir) / "temp_files"
+        log_path = Path(work_dir) / "server.log"
+        env = dict(os.environ, VIDGRABBER_TEMP_DIR=str(temp_dir))
+        with open(log_path, "w") as log:
+            server = subprocess.Popen(
+                [sys.executable, "-m", "bench.server", "--cdn", cdn.base_url, "--port", str(port),
+                 "--extract-latency", str(args.extract_latency), "--duration", str(args.duration)],
+                env=env, stdout=log, stderr=subprocess.STDOUT,
+            )
+        try:
+            report = asyncio.run(run_load(f"http://127.0.0.1:{port}", args.mode, args.requests,
+                                          args.concurrency, args.unique, temp_dir,
+                                          {"max_height": args.max_height} if args.max_height else None))
+        finally:
+            # Sampled while the server is still running; /proc/<pid> goes away once it is reaped
+            peak_rss = _peak_rss(server.pid)
+            server.send_signal(signal.SIGINT)
+            try:
+                server.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                server.kill()
+                server.wait()
+            cdn.stop()
+
+    report["server_peak_rss_bytes"] = peak_rss
+    report["cdn_bytes_served"] = cdn.bytes_served
+    metrics_text = report.pop("server_metrics")
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        for key, value in report.items():
+            print(f"{key:36} {value}")
+    if args.show_metrics:
+        print(metrics_text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,25 @@
+import argparse
+
+import uvicorn
+
+from .stub import install_stub
+
+# Runs the real API with extraction stubbed out to point at the local media CDN.
+# Started as a subprocess by bench.run so its peak RSS can be measured on its own.
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run the VidGrabber API against the local media CDN.")
+    parser.add_argument("--cdn", required=True, help="Base URL of the media CDN")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--extract-latency", type=float, default=0.0)
+    parser.add_argument("--duration", type=float, default=30.0)
+    args = parser.parse_args()
+
+    install_stub(args.cdn, args.extract_latency, args.duration)
+    from backend.app import app
+    uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+import time
+from typing import Any, Dict
+from urllib.parse import parse_qs, urlsplit
+
+from backend import downloader
+
+# Stand-in for yt-dlp extraction. Any URL with a ?v=<id> query maps to the
+# local media CDN; format indexing and selection, the metadata cache,
+# extractor coalescing and everything downstream of get_video_info stay real.
+
+# Video sizes are approximate; they only drive disk reservations and max_filesize
+STUB_VIDEO_SIZE = 8 * 1024 * 1024
+STUB_AUDIO_SIZE = 512 * 1024
+
+
+def install_stub(cdn_base_url: str, extract_latency: float = 0.0, duration: float = 30.0) -> None:
+    """
+    Replaces the yt-dlp call behind downloader.get_video_info with a stub that
+    reports the local CDN's files as formats after `extract_latency` seconds:
+    a 720p video-only stream, an audio-only stream, and a progressive file
+    labelled 360p, so that requests with max_height of 360 or less take the
+    passthrough path.
+    """
+    def fake_extract(video_url: str) -> Dict[str, Any]:
+        if extract_latency:
+            time.sleep(extract_latency)
+        video_id = parse_qs(urlsplit(video_url).query).get("v", ["bench"])[0]
+        media = f"{cdn_base_url}/media/{video_id}"
+        return downloader.build_video_info(video_url, {
+            "title": f"Benchmark {video_id}",
+            "thumbnail": None,
+            "duration": duration,
+            "extractor_key": "Bench",
+            "id": video_id,
+            "formats": [
+                {"format_id": "progressive", "url": f"{media}/progressive.mp4", "protocol": "http", "ext": "mp4",
+                 "vcodec": "mp4v.20.9", "acodec": "mp4a.40.2", "height": 360,
+                 "filesize_approx": STUB_VIDEO_SIZE + STUB_AUDIO_SIZE},
+                {"format_id": "video", "url": f"{media}/video.mp4", "protocol": "http", "ext": "mp4",
+                 "vcodec": "mp4v.20.9", "acodec": "none", "height": 720, "filesize_approx": STUB_VIDEO_SIZE},
+                {"format_id": "audio", "url": f"{media}/audio.m4a", "protocol": "http", "ext": "m4a",
+                 "vcodec": "none", "acodec": "mp4a.40.2", "abr": 128, "filesize_approx": STUB_AUDIO_SIZE},
+            ],
+        })
+
+    downloader._extract_video_info = fake_extract
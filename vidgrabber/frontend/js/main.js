@@ -1,3 +1,5 @@
+const API_BASE = 'http://127.0.0.1:8000';
+
 document.addEventListener('DOMContentLoaded', () => {
     const videoUrlInput = document.getElementById('videoUrl');
     const submitBtn = document.getElementById('submitBtn');
@@ -16,8 +18,8 @@ document.addEventListener('DOMContentLoaded', () => {
             displayMessage('Requesting video... This may take a moment.', 'info');
 
             try {
-                // Point to the new backend endpoint for muxing and direct download
-                const response = await fetch('http://127.0.0.1:8000/api/process_and_download_video', {
+                // Submit the video as a background job, then follow its progress over SSE
+                const response = await fetch(`${API_BASE}/api/jobs`, {
                     method: 'POST',
                     headers: {
                         'Content-Type': 'application/json',
@@ -38,23 +40,13 @@ document.addEventListener('DOMContentLoaded', () => {
                     throw new Error(errorDetail);
                 }
 
-                // If response.ok is true, the browser should be initiating a download
-                // due to Content-Disposition header from the backend.
-                // We can try to get the filename from the Content-Disposition header for the message.
-                let filename = "your video";
-                const disposition = response.headers.get('content-disposition');
-                if (disposition && disposition.indexOf('attachment') !== -1) {
-                    const filenameRegex = /filename[^;=\n]*=((['"]).*?\2|[^;\n]*)/;
-                    const matches = filenameRegex.exec(disposition);
-                    if (matches != null && matches[1]) {
-                        filename = matches[1].replace(/['"]/g, '');
-                    }
-                }
+                const job = await response.json();
+                const filename = await followJobProgress(job.job_id);
 
+                // The result endpoint sends Content-Disposition: attachment,
+                // so navigating to it starts the download without leaving the page.
+                window.location.href = `${API_BASE}/api/jobs/${job.job_id}/result`;
                 displayMessage(`Download for "${filename}" should start automatically. If not, please check your browser's download manager.`, 'success');
-                // No redirection to result.html for this direct download flow.
-                // The existing result.html logic (displayVideoResults, localStorage) is now bypassed for this button.
-                // We can decide later if we want a hybrid approach or separate buttons.
 
             } catch (error) {
                 console.error('Error processing video:', error);
@@ -66,6 +58,58 @@ document.addEventListener('DOMContentLoaded', () => {
         });
     }
 
+    // Subscribes to a job's Server-Sent Events and shows its progress.
+    // Resolves with the output filename when the job is done, rejects if it fails.
+    function followJobProgress(jobId) {
+        return new Promise((resolve, reject) => {
+            const source = new EventSource(`${API_BASE}/api/jobs/${jobId}/events`);
+            const downloads = {};
+
+            const handle = (name, callback) => {
+                source.addEventListener(name, (e) => callback(JSON.parse(e.data)));
+            };
+
+            handle('queued', () => displayMessage('Queued... waiting for a free worker.', 'info'));
+            handle('extracting', () => displayMessage('Fetching video details...', 'info'));
+            handle('extracted', (data) => displayMessage(`Found "${data.title}". Starting download...`, 'info'));
+            handle('download', (data) => {
+                downloads[data.stream] = data;
+                const parts = Object.values(downloads).map((d) => {
+                    const done = formatBytes(d.bytes);
+                    const total = d.total ? ` / ${formatBytes(d.total)}` : '';
+                    return `${d.stream}: ${done}${total} (${formatBytes(d.throughput_bps)}/s)`;
+                });
+                displayMessage(`Downloading... ${parts.join(', ')}`, 'info');
+            });
+            handle('mux', (data) => {
+                const percent = data.percent !== null ? ` ${data.percent}%` : '';
+                displayMessage(`Merging video and audio...${percent}`, 'info');
+            });
+            handle('done', (data) => {
+                source.close();
+                resolve(data.filename || 'your video');
+            });
+            handle('failed', (data) => {
+                source.close();
+                reject(new Error(data.error || 'Processing failed.'));
+            });
+            source.onerror = () => {
+                // EventSource reconnects on its own while the job is running;
+                // a closed stream without a final event means the job is gone.
+                if (source.readyState === EventSource.CLOSED) {
+                    reject(new Error('Lost connection to the server.'));
+                }
+            };
+        });
+    }
+
+    function formatBytes(bytes) {
+        if (!bytes) return '0 B';
+        const units = ['B', 'KB', 'MB', 'GB'];
+        const exponent = Math.min(Math.floor(Math.log(bytes) / Math.log(1024)), units.length - 1);
+        return `${(bytes / Math.pow(1024, exponent)).toFixed(1)} ${units[exponent]}`;
+    }
+
     // Function to display messages on the page
     function displayMessage(message, type = 'info') {
         if (messageDiv) {
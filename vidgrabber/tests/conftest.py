@@ -0,0 +1,27 @@
+import os
+import sys
+import shutil
+import tempfile
+from pathlib import Path
+
+import pytest
+
+# Keep everything the backend writes (scratch, cache, job store) out of the
+# source tree. Set before any backend module is imported, as config reads it
+# at import time.
+os.environ.setdefault("VIDGRABBER_TEMP_DIR", tempfile.mkdtemp(prefix="vidgrabber_tests_"))
+
+# Run from any directory: make `backend` importable like `python -m pytest` in vidgrabber/ does
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+@pytest.fixture(scope="session")
+def media(tmp_path_factory):
+    """
+    Short generated (video, audio, progressive) files, as served by the bench CDN.
+    Tests that need FFmpeg are skipped where it is not installed.
+    """
+    if shutil.which("ffmpeg") is None:
+        pytest.skip("ffmpeg is not installed")
+    from bench.cdn import generate_media
+    return generate_media(tmp_path_factory.mktemp("media"), duration=2)
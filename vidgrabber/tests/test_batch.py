@@ -0,0 +1,189 @@
+import asyncio
+import io
+import zipfile
+
+import pytest
+
+from fastapi import HTTPException
+
+from backend.batch import BatchItem, ZipStreamWriter, run_pipeline
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_pipeline_keeps_order_and_skips_failed_items():
+    calls = []
+
+    async def first(item):
+        calls.append(("first", item.index))
+        if item.index == 1:
+            raise HTTPException(status_code=404, detail="not found")
+        await asyncio.sleep(0.01 * (3 - item.index)) # Later items finish this stage faster
+        item.filename = f"{item.index}.mp4"
+
+    async def second(item):
+        calls.append(("second", item.index))
+
+    async def scenario():
+        items = [BatchItem(i, f"https://example.com/{i}") for i in range(3)]
+        return [item async for item in run_pipeline(items, [first, second], depth=1)]
+
+    done = run(scenario())
+    assert [item.index for item in done] == [0, 1, 2]
+    assert (done[1].error, done[1].error_status) == ("not found", 404)
+    assert ("second", 1) not in calls
+    assert done[2].filename == "2.mp4"
+
+
+def test_unexpected_errors_become_internal_errors():
+    async def stage(item):
+        raise ValueError("bug")
+
+    async def scenario():
+        return [item async for item in run_pipeline([BatchItem(0, "u")], [stage])]
+
+    (item,) = run(scenario())
+    assert item.error_status == 500
+
+
+def test_early_exit_cancels_stages_and_discards_in_flight_items():
+    discarded = []
+    started = []
+
+    async def slow(item):
+        started.append(item.index)
+        await asyncio.sleep(0 if item.index == 0 else 10)
+
+    async def scenario():
+        items = [BatchItem(i, f"https://example.com/{i}") for i in range(20)]
+        pipeline = run_pipeline(items, [slow, slow], depth=1, discard=discarded.append)
+        async for item in pipeline:
+            assert item.index == 0
+            break
+        await pipeline.aclose()
+        return items
+
+    items = run(scenario())
+    # Bounded queues: only a few items were ever fed in, and all of those were discarded
+    assert len(started) < 10
+    assert discarded and all(item.index > 0 for item in discarded)
+    assert {item.index for item in discarded} >= set(started) - {0}
+    assert all(item.index < 10 for item in discarded)
+    assert items[-1] not in discarded
+
+
+def test_zip_stream_is_a_valid_archive(tmp_path):
+    source = tmp_path / "video.mp4"
+    source.write_bytes(b"x" * 3_000_000)
+    writer = ZipStreamWriter()
+    data = b"".join(writer.add_file("a.mp4", source))
+    data += b"".join(writer.add_file("a.mp4", source))
+    data += writer.add_bytes("errors.txt", b"none")
+    data += writer.close()
+    archive = zipfile.ZipFile(io.BytesIO(data))
+    assert archive.namelist() == ["a.mp4", "a (2).mp4", "errors.txt"]
+    assert archive.read("a (2).mp4") == source.read_bytes()
+
+
+@pytest.fixture
+def cdn_batch(media, monkeypatch):
+    """
+    Serves the generated media from the benchmark CDN and resolves batch URLs
+    to it, each ?v= ID with a cacheable identity of its own. Yields the
+    video_info for a given ID and the list of mux runs.
+    """
+    from bench.cdn import MediaCDN
+    from backend import app as api
+    cdn = MediaCDN(*media).start()
+    muxes = []
+
+    def info(video_id):
+        return {"video_url": f"{cdn.base_url}/media/{video_id}/video.mp4",
+                "audio_url": f"{cdn.base_url}/media/{video_id}/audio.m4a",
+                "extractor": "Test", "video_id": video_id, "video_format_id": "v", "audio_format_id": "a",
+                "suggested_filename": f"{video_id}.mp4", "duration": 2}
+
+    async def get_stream_urls(url, selection=None):
+        return info(url.rpartition("=")[2])
+
+    mux_inputs = api._mux_inputs
+
+    async def counting_mux(*args, **kwargs):
+        muxes.append(args[0]["video_id"])
+        await mux_inputs(*args, **kwargs)
+
+    monkeypatch.setattr(api, "_get_stream_urls", get_stream_urls)
+    monkeypatch.setattr(api, "_mux_inputs", counting_mux)
+    yield info, muxes
+    cdn.stop()
+    for video_id in ("a", "b", "c"):
+        api.cache.cache_path(api._output_cache_key(info(video_id))).unlink(missing_ok=True)
+
+
+async def _serve(response, disconnect_after=None):
+    """Runs an ASGI response; the client goes away after `disconnect_after` body messages if given."""
+    body = []
+
+    async def receive():
+        await asyncio.Event().wait()
+
+    async def send(message):
+        if message["type"] == "http.response.body":
+            if disconnect_after is not None and len(body) >= disconnect_after:
+                raise OSError("client went away")
+            body.append(message.get("body", b""))
+
+    scope = {"type": "http", "asgi": {"spec_version": "2.4"}, "method": "GET", "headers": []}
+    try:
+        await response(scope, receive, send)
+    except Exception:
+        if disconnect_after is None:
+            raise
+    return b"".join(body)
+
+
+def _zip_request(*video_ids):
+    from backend import app as api
+    return api.process_batch(api.BatchRequest(urls=[f"https://example.com/watch?v={v}" for v in video_ids],
+                                              output="zip"), None)
+
+
+def test_requests_join_a_batch_item_in_flight(cdn_batch):
+    from backend import app as api
+    info, muxes = cdn_batch
+
+    async def scenario():
+        serving = asyncio.create_task(_serve(await _zip_request("a")))
+        while api._output_cache_key(info("a")) not in api.inflight_jobs and not serving.done():
+            await asyncio.sleep(0.01)
+        joined = await api._produce_shared_file(api._output_cache_key(info("a")), info("a"))
+        return await serving, joined
+
+    archive, joined = run(scenario())
+    assert muxes == ["a"]
+    with zipfile.ZipFile(io.BytesIO(archive)) as zf:
+        assert zf.read("001 - a.mp4") == joined.read_bytes()
+    assert not api.inflight_progress
+
+
+def test_zip_batch_stops_when_the_client_disconnects(cdn_batch, monkeypatch):
+    from backend import app as api
+    info, muxes = cdn_batch
+    archives = []
+    zip_batch = api._zip_batch
+    monkeypatch.setattr(api, "_zip_batch", lambda items: archives.append(zip_batch(items)) or archives[-1])
+
+    async def scenario():
+        await _serve(await _zip_request("a", "b", "c"), disconnect_after=1)
+        # Closed right away, not whenever the generator happens to be collected
+        closed = archives[0].ag_frame is None
+        await asyncio.sleep(0.05)
+        return closed, [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+
+    assert run(scenario()) == (True, [])
+    assert api.disk_budget.reserved == 0
+    assert api.job_semaphore._value == api.MAX_CONCURRENT_JOBS
+    assert not api.inflight_jobs._tasks and not api.inflight_progress
+    assert len(muxes) < 3
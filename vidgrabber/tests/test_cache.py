@@ -0,0 +1,60 @@
+import os
+import shutil
+import time
+
+import pytest
+
+from backend import cache
+
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    yield
+    shutil.rmtree(cache.CACHE_DIR, ignore_errors=True)
+
+
+def _store(tmp_path, key: str, size: int):
+    source = tmp_path / f"{key}.src"
+    source.write_bytes(b"x" * size)
+    return cache.store(key, source)
+
+
+def test_cache_key_needs_a_complete_identity():
+    assert cache.cache_key("Youtube", "abc", "137", "140") == cache.cache_key("Youtube", "abc", "137", "140")
+    assert cache.cache_key("Youtube", "abc", "137", "140") != cache.cache_key("Youtube", "abc", "136", "140")
+    assert cache.cache_key("Youtube", None, "137") is None
+    assert cache.cache_key("Youtube", "abc", "137", None) is None
+
+
+def test_store_moves_the_file_and_lookup_finds_it(tmp_path):
+    path = _store(tmp_path, "a" * 64, 10)
+    assert path == cache.cache_path("a" * 64)
+    assert not (tmp_path / f"{'a' * 64}.src").exists()
+    assert cache.lookup("a" * 64) == path
+    assert cache.lookup("b" * 64) is None
+
+
+def test_expired_entries_are_misses(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache, "CACHE_TTL", 60)
+    path = _store(tmp_path, "a" * 64, 10)
+    old = time.time() - 120
+    os.utime(path, (old, old))
+    assert cache.lookup("a" * 64) is None
+    assert not path.exists()
+
+
+def test_eviction_removes_least_recently_used_first(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache, "CACHE_MAX_BYTES", 25)
+    old, recent = _store(tmp_path, "b" * 64, 10), _store(tmp_path, "c" * 64, 10)
+    now = time.time()
+    os.utime(old, (now - 100, now))
+    os.utime(recent, (now - 50, now - 200)) # Older content, but used more recently
+    kept = _store(tmp_path, "d" * 64, 10)
+    assert not old.exists()
+    assert recent.exists() and kept.exists()
+
+
+def test_the_file_being_stored_is_never_evicted(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache, "CACHE_MAX_BYTES", 5)
+    path = _store(tmp_path, "e" * 64, 10)
+    assert path.exists()
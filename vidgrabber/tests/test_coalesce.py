@@ -0,0 +1,131 @@
+import asyncio
+
+import pytest
+
+from backend.coalesce import SharedStream, SingleFlight
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_concurrent_callers_share_one_run():
+    calls = []
+
+    async def work():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "result"
+
+    async def scenario():
+        flight = SingleFlight()
+        results = await asyncio.gather(*(flight.do("key", work) for _ in range(5)))
+        assert "key" not in flight
+        # Once finished, the next call runs again
+        await flight.do("key", work)
+        return results
+
+    assert run(scenario()) == ["result"] * 5
+    assert len(calls) == 2
+
+
+def test_errors_reach_every_caller_and_are_not_remembered():
+    attempts = []
+
+    async def failing():
+        attempts.append(1)
+        await asyncio.sleep(0.01)
+        raise ValueError("boom")
+
+    async def scenario():
+        flight = SingleFlight()
+        results = await asyncio.gather(*(flight.do("key", failing) for _ in range(3)), return_exceptions=True)
+        assert all(isinstance(result, ValueError) for result in results)
+        with pytest.raises(ValueError):
+            await flight.do("key", failing)
+
+    run(scenario())
+    assert len(attempts) == 2
+
+
+def test_a_cancelled_caller_does_not_cancel_the_others():
+    async def work():
+        await asyncio.sleep(0.02)
+        return "result"
+
+    async def scenario():
+        flight = SingleFlight()
+        first = asyncio.create_task(flight.do("key", work))
+        second = asyncio.create_task(flight.do("key", work))
+        await asyncio.sleep(0)
+        first.cancel()
+        return await second
+
+    assert run(scenario()) == "result"
+
+
+async def _chunks(parts, delay=0.01, error=None):
+    for part in parts:
+        await asyncio.sleep(delay)
+        yield part
+    if error is not None:
+        raise error
+
+
+async def _read_all(reader):
+    return b"".join([chunk async for chunk in reader])
+
+
+def test_late_readers_get_the_whole_output(tmp_path):
+    parts = [bytes([i]) * 1000 for i in range(10)]
+
+    async def scenario():
+        shared = SharedStream(tmp_path / "out.mp4")
+        producer = asyncio.create_task(shared.produce(_chunks(parts)))
+        early = asyncio.create_task(_read_all(shared.reader()))
+        await shared.wait_for_output()
+        await asyncio.sleep(0.05) # Joins halfway through
+        late = asyncio.create_task(_read_all(shared.reader()))
+        await producer
+        after = await _read_all(shared.reader()) # Joins after the end
+        return await early, await late, after
+
+    assert run(scenario()) == (b"".join(parts),) * 3
+
+
+def test_readers_keep_working_after_the_file_is_moved(tmp_path):
+    async def scenario():
+        shared = SharedStream(tmp_path / "out.mp4")
+        producer = asyncio.create_task(shared.produce(_chunks([b"a" * 10, b"b" * 10])))
+        await shared.wait_for_output()
+        reader = shared.reader()
+        (tmp_path / "out.mp4").rename(tmp_path / "cached.mp4")
+        await producer
+        return await _read_all(reader)
+
+    assert run(scenario()) == b"a" * 10 + b"b" * 10
+
+
+def test_failed_producer_fails_its_readers(tmp_path):
+    async def scenario():
+        shared = SharedStream(tmp_path / "out.mp4")
+        producer = asyncio.create_task(shared.produce(_chunks([b"partial"], error=OSError("ffmpeg died"))))
+        reader = asyncio.create_task(_read_all(shared.reader()))
+        with pytest.raises(OSError):
+            await producer
+        with pytest.raises(RuntimeError):
+            await reader
+
+    run(scenario())
+
+
+def test_wait_for_output_raises_if_nothing_was_produced(tmp_path):
+    async def scenario():
+        shared = SharedStream(tmp_path / "out.mp4")
+        producer = asyncio.create_task(shared.produce(_chunks([], error=OSError("no input"))))
+        with pytest.raises(RuntimeError):
+            await shared.wait_for_output()
+        with pytest.raises(OSError):
+            await producer
+
+    run(scenario())
@@ -0,0 +1,115 @@
+from backend.downloader import FormatIndex, codec_family, select_formats, build_video_info
+
+MB = 1024 * 1024
+
+
+def _video(format_id, height, vcodec="avc1.640028", ext="mp4", filesize=None, tbr=None):
+    return {"format_id": format_id, "url": f"https://cdn/{format_id}", "protocol": "https", "ext": ext,
+            "vcodec": vcodec, "acodec": "none", "height": height, "filesize": filesize, "tbr": tbr}
+
+
+def _audio(format_id, abr, ext="m4a", filesize=None):
+    return {"format_id": format_id, "url": f"https://cdn/{format_id}", "protocol": "https", "ext": ext,
+            "vcodec": "none", "acodec": "mp4a.40.2", "abr": abr, "filesize": filesize}
+
+
+def _progressive(format_id, height, filesize=None):
+    return {"format_id": format_id, "url": f"https://cdn/{format_id}", "protocol": "https", "ext": "mp4",
+            "vcodec": "avc1.42001E", "acodec": "mp4a.40.2", "height": height, "filesize": filesize}
+
+
+FORMATS = [
+    _video("1080-h264", 1080, filesize=80 * MB),
+    _video("1080-vp9", 1080, vcodec="vp09.00.40.08", ext="webm", filesize=60 * MB),
+    _video("720-h264", 720, filesize=40 * MB),
+    _video("480-av1", 480, vcodec="av01.0.05M.08", filesize=10 * MB),
+    _audio("aac-128", 128, filesize=4 * MB),
+    _audio("aac-48", 48, filesize=1 * MB),
+    _audio("opus-160", 160, ext="webm", filesize=5 * MB),
+    _progressive("360-prog", 360, filesize=20 * MB),
+    {"format_id": "hls-720", "url": "https://cdn/hls.m3u8", "protocol": "m3u8_native",
+     "vcodec": "avc1", "acodec": "mp4a", "height": 720},
+    {"format_id": "sb0", "url": "https://cdn/sb", "protocol": "https", "vcodec": "none", "acodec": "none"},
+]
+
+
+def test_codec_family():
+    assert codec_family("avc1.640028") == "h264"
+    assert codec_family("hevc") == "h265"
+    assert codec_family("hvc1.1.6.L93") == "h265"
+    assert codec_family("vp09.00.40.08") == "vp9"
+    assert codec_family("av01.0.05M.08") == "av1"
+    assert codec_family("none") is None
+    assert codec_family(None) is None
+
+
+def test_index_skips_manifests_and_ranks_container_first():
+    index = FormatIndex(FORMATS)
+    # mp4 ranks ahead of the equally tall webm; the HLS format is not indexed
+    assert [fmt.format_id for fmt in index.video] == ["1080-h264", "720-h264", "480-av1", "1080-vp9"]
+    # m4a ranks ahead of the higher bitrate webm audio
+    assert [fmt.format_id for fmt in index.audio] == ["aac-128", "aac-48", "opus-160"]
+    assert [fmt.format_id for fmt in index.progressive] == ["360-prog"]
+
+
+def test_select_without_limits_muxes_the_best_pair():
+    selected = FormatIndex(FORMATS).select()
+    assert selected["progressive"] is False
+    assert (selected["video_format_id"], selected["audio_format_id"]) == ("1080-h264", "aac-128")
+    assert selected["height"] == 1080
+    assert selected["ext"] == "mp4"
+
+
+def test_select_max_height():
+    selected = FormatIndex(FORMATS).select(max_height=720)
+    assert selected["video_format_id"] == "720-h264"
+
+
+def test_select_prefers_progressive_at_equal_or_better_height():
+    selected = FormatIndex(FORMATS).select(max_height=360)
+    assert selected["progressive"] is True
+    assert selected["video_format_id"] == "360-prog"
+    assert selected["audio_url"] is None
+
+
+def test_select_codec_family():
+    selected = FormatIndex(FORMATS).select(vcodec="vp9")
+    assert selected["video_format_id"] == "1080-vp9"
+    selected = FormatIndex(FORMATS).select(vcodec="av01")
+    assert selected["video_format_id"] == "480-av1"
+
+
+def test_select_max_filesize_fits_video_and_audio_together():
+    # 40 MB video leaves 2 MB, which only the 1 MB audio fits into
+    selected = FormatIndex(FORMATS).select(max_filesize=42 * MB)
+    assert (selected["video_format_id"], selected["audio_format_id"]) == ("720-h264", "aac-48")
+    # No pair fits under 15 MB except the 10 MB av1 video with 4 MB audio
+    selected = FormatIndex(FORMATS).select(max_filesize=15 * MB)
+    assert (selected["video_format_id"], selected["audio_format_id"]) == ("480-av1", "aac-128")
+
+
+def test_unknown_height_or_size_does_not_satisfy_a_limit():
+    index = FormatIndex([_video("v", None, filesize=None), _audio("a", 128, filesize=MB)])
+    assert index.select() is not None
+    assert index.select(max_height=1080) is None
+    assert index.select(max_filesize=100 * MB) is None
+
+
+def test_select_returns_none_when_nothing_fits():
+    assert FormatIndex(FORMATS).select(max_height=144) is None
+    assert FormatIndex(FORMATS).select(vcodec="h265") is None
+
+
+def test_select_formats_reports_available_qualities():
+    info = build_video_info("https://example.com/v", {"title": "A title", "id": "v", "formats": FORMATS})
+    assert info["video_format_id"] == "1080-h264"
+    error = select_formats(info, max_height=144)["error"]
+    assert "1080p h264" in error and "360p h264" in error
+    progressive = select_formats(info, max_height=360)
+    assert progressive["progressive"] is True
+    assert progressive["suggested_filename"] == "A_title.mp4"
+
+
+def test_build_video_info_without_usable_formats():
+    info = build_video_info("https://example.com/v", {"title": "x", "formats": [_audio("a", 128)]})
+    assert info["error"] == "The content appears to be audio-only."
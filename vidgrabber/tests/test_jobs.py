@@ -0,0 +1,130 @@
+import asyncio
+import sqlite3
+
+from backend.jobs import DONE, FAILED, Job, JobManager, JobStore
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+async def _noop(job: Job) -> None:
+    pass
+
+
+def test_priorities_are_clamped():
+    async def scenario():
+        manager = JobManager(_noop, workers=1, retention=60, max_priority=9)
+        return [manager.submit("https://example.com/v", "client", priority).priority for priority in (-1000, 0, 5, 99)]
+    assert run(scenario()) == [0, 0, 5, 9]
+
+
+def test_clients_are_served_fairly():
+    order = []
+
+    async def runner(job: Job) -> None:
+        order.append(job.client_id)
+
+    async def scenario():
+        manager = JobManager(runner, workers=1, retention=60)
+        for _ in range(3):
+            manager.submit("https://example.com/v", "busy")
+        manager.submit("https://example.com/v", "other")
+        manager.start()
+        while len(order) < 4:
+            await asyncio.sleep(0.01)
+        await manager.stop()
+
+    run(scenario())
+    assert order.index("other") == 1
+
+
+def test_other_workers_see_jobs_through_the_store(tmp_path):
+    path = tmp_path / "jobs.sqlite3"
+
+    async def runner(job: Job) -> None:
+        job.progress.emit("extracting")
+        job.result_path = tmp_path / "out.mp4"
+        job.filename = "out.mp4"
+
+    async def scenario():
+        owner = JobManager(runner, workers=1, retention=60, store=JobStore(path))
+        # A second manager with its own connection stands in for another worker process
+        other = JobManager(_noop, workers=1, retention=60, store=JobStore(path))
+        job = owner.submit("https://example.com/v", "client")
+        await owner.flush()
+        owner.start()
+        events = [event["event"] async for event in (await other.get(job.id)).progress.subscribe()]
+        await owner.stop()
+        return await other.get(job.id), events
+
+    snapshot, events = run(scenario())
+    assert snapshot.status == DONE
+    assert snapshot.result_path == tmp_path / "out.mp4"
+    assert events == ["queued", "started", "extracting", "done"]
+
+
+def test_superseded_progress_ticks_are_not_written(tmp_path):
+    path = tmp_path / "jobs.sqlite3"
+    store = JobStore(path)
+    job = Job("https://example.com/v", "client", 0, {})
+    job.attach(store)
+    job.mark_running()
+    for downloaded in range(100):
+        job.progress.emit("download", stream="video", downloaded=downloaded)
+        job.progress.emit("download", stream="audio", downloaded=downloaded)
+    job.mark_done()
+    job.finish()
+    store.close()
+
+    events = JobStore(path).events(job.id)
+    assert [(event["event"], event.get("stream")) for event in events] == [
+        ("queued", None), ("started", None), ("download", "video"), ("download", "audio"), ("done", None)]
+    # The newest tick of each stream is the one kept
+    assert events[2]["downloaded"] == events[3]["downloaded"] == 99
+
+
+def test_jobs_of_a_dead_worker_are_reported_failed(tmp_path):
+    path = tmp_path / "jobs.sqlite3"
+
+    async def scenario():
+        store = JobStore(path)
+        manager = JobManager(_noop, workers=1, retention=60, store=store)
+        job = manager.submit("https://example.com/v", "client")
+        await manager.flush()
+        # Pretend the job belongs to a worker whose scratch directory is gone
+        with sqlite3.connect(path) as db:
+            db.execute("UPDATE jobs SET owner = 'w0_gone' WHERE id = ?", (job.id,))
+        reader = JobManager(_noop, workers=1, retention=60, store=JobStore(path))
+        snapshot = await reader.get(job.id)
+        events = [event["event"] async for event in snapshot.progress.subscribe()]
+        return snapshot, events
+
+    snapshot, events = run(scenario())
+    assert snapshot.status == FAILED
+    assert snapshot.finished_at is not None
+    assert events[-1] == "failed"
+
+
+def test_prune_forgets_expired_jobs_and_their_results(tmp_path):
+    result = tmp_path / "result.mp4"
+    result.write_bytes(b"x")
+
+    async def runner(job: Job) -> None:
+        job.result_path, job.owns_result = result, True
+
+    async def scenario():
+        store = JobStore(tmp_path / "jobs.sqlite3")
+        manager = JobManager(runner, workers=1, retention=0, store=store)
+        job = manager.submit("https://example.com/v", "client")
+        manager.start()
+        while (await manager.get(job.id)).status != DONE:
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(0.01)
+        manager.submit("https://example.com/w", "client") # Prunes
+        await manager.stop()
+        return job, store
+
+    job, store = run(scenario())
+    assert not result.exists()
+    assert store.load(job.id) is None
@@ -0,0 +1,93 @@
+import time
+
+import pytest
+
+from backend import downloader
+from backend.downloader import get_video_info, normalize_url
+
+
+@pytest.mark.parametrize("url, expected", [
+    ("https://youtu.be/abc123?si=tracking", "https://www.youtube.com/watch?v=abc123"),
+    ("https://www.youtube.com/shorts/abc123", "https://www.youtube.com/watch?v=abc123"),
+    ("https://m.youtube.com/watch?v=abc123&feature=share", "https://www.youtube.com/watch?v=abc123"),
+    ("https://www.youtube.com/embed/abc123?start=10", "https://www.youtube.com/watch?v=abc123"),
+    ("http://WWW.Example.com/video/42/?utm_source=x&b=2&a=1#t=3", "https://example.com/video/42?a=1&b=2"),
+    ("https://vimeo.com/42?fbclid=abc", "https://vimeo.com/42"),
+])
+def test_normalize_url(url, expected):
+    assert normalize_url(url) == expected
+
+
+class _Calls(list):
+    """URLs extracted so far, plus the stream URLs the next extractions report."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.stream_urls = {}
+
+
+@pytest.fixture
+def extractions(monkeypatch):
+    """Stands in for yt-dlp and counts the extractions it runs."""
+    calls = _Calls()
+    stream_urls = calls.stream_urls
+
+    def fake_extract(video_url):
+        calls.append(video_url)
+        if "broken" in video_url:
+            return {"error": "Failed to process URL: unavailable"}
+        return {"title": "Video", "video_url": stream_urls.get("video", "https://cdn/v"), "audio_url": "https://cdn/a"}
+
+    monkeypatch.setattr(downloader, "_extract_video_info", fake_extract)
+    monkeypatch.setattr(downloader, "_metadata_cache", type(downloader._metadata_cache)())
+    return calls
+
+
+def test_equivalent_urls_share_one_extraction(extractions):
+    first = get_video_info("https://youtu.be/abc123")
+    second = get_video_info("https://www.youtube.com/watch?v=abc123&si=x")
+    assert len(extractions) == 1
+    assert first["title"] == second["title"]
+    # Each caller gets its own copy, with its own original URL
+    assert second["original_url"] == "https://www.youtube.com/watch?v=abc123&si=x"
+    second["title"] = "changed"
+    assert get_video_info("https://youtu.be/abc123")["title"] == "Video"
+
+
+def test_errors_are_not_cached(extractions):
+    assert get_video_info("https://example.com/broken").get("error")
+    get_video_info("https://example.com/broken")
+    assert len(extractions) == 2
+
+
+def test_entries_expire_after_the_ttl(extractions, monkeypatch):
+    monkeypatch.setattr(downloader, "METADATA_CACHE_TTL", 60)
+    get_video_info("https://example.com/v")
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + 61)
+    get_video_info("https://example.com/v")
+    assert len(extractions) == 2
+
+
+def test_signed_stream_urls_shorten_the_ttl(extractions, monkeypatch):
+    now = time.time()
+    # Expires within the safety margin, so the info is not worth caching at all
+    extractions.stream_urls["video"] = f"https://cdn/v?expire={int(now) + 60}"
+    get_video_info("https://example.com/v")
+    get_video_info("https://example.com/v")
+    assert len(extractions) == 2
+
+    extractions.stream_urls["video"] = f"https://cdn/v?expire={int(now) + 600}"
+    get_video_info("https://example.com/w")
+    monkeypatch.setattr(time, "time", lambda: now + 500) # Before METADATA_CACHE_TTL, after the signed expiry
+    get_video_info("https://example.com/w")
+    assert len(extractions) == 4
+
+
+def test_least_recently_used_entries_are_dropped(extractions, monkeypatch):
+    monkeypatch.setattr(downloader, "METADATA_CACHE_MAX_ENTRIES", 2)
+    for name in ("a", "b", "a", "c"):
+        get_video_info(f"https://example.com/{name}")
+    get_video_info("https://example.com/a")
+    get_video_info("https://example.com/b")
+    assert extractions == [f"https://example.com/{name}" for name in ("a", "b", "c", "b")]
@@ -0,0 +1,123 @@
+import asyncio
+import os
+
+import pytest
+
+from backend import metrics
+from backend.metrics import Counter, Gauge, Histogram
+
+
+@pytest.fixture(autouse=True)
+def isolated_registry(monkeypatch):
+    monkeypatch.setattr(metrics, "_registry", [])
+
+
+def test_counter_renders_one_sample_per_label_set():
+    counter = Counter("test_requests_total", "Requests.", ("route", "result"))
+    counter.inc(1, "/a", "ok")
+    counter.inc(2, "/a", "ok")
+    counter.inc(1, "/b", "error")
+    assert counter.render().splitlines() == [
+        "# HELP test_requests_total Requests.",
+        "# TYPE test_requests_total counter",
+        'test_requests_total{route="/a",result="ok"} 3.0',
+        'test_requests_total{route="/b",result="error"} 1.0',
+    ]
+
+
+def test_gauge_tracks_blocks_in_progress():
+    gauge = Gauge("test_in_flight", "In flight.", ("mode",))
+    with gauge.track("file"):
+        assert 'test_in_flight{mode="file"} 1.0' in gauge.render()
+    assert 'test_in_flight{mode="file"} 0.0' in gauge.render()
+
+
+def test_gauge_callback_is_read_at_scrape_time():
+    values = [1]
+    gauge = Gauge("test_queued", "Queued.", callback=lambda: values[-1])
+    values.append(7)
+    assert gauge.render().splitlines()[-1] == "test_queued 7"
+
+
+def test_failing_gauge_callback_renders_no_sample():
+    gauge = Gauge("test_broken", "Broken.", callback=lambda: 1 / 0)
+    assert gauge.render().splitlines()[2:] == []
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram("test_seconds", "Durations.", ("stage",), buckets=(0.1, 1))
+    for value in (0.05, 0.1, 0.5, 5):
+        histogram.observe(value, "mux")
+    assert histogram.render().splitlines()[2:] == [
+        'test_seconds_bucket{stage="mux",le="0.1"} 2',
+        'test_seconds_bucket{stage="mux",le="1.0"} 3',
+        'test_seconds_bucket{stage="mux",le="+Inf"} 4',
+        'test_seconds_sum{stage="mux"} 5.65',
+        'test_seconds_count{stage="mux"} 4',
+    ]
+
+
+def test_render_all_covers_every_registered_metric():
+    Counter("test_a_total", "A.").inc()
+    Gauge("test_b", "B.").set(2)
+    text = metrics.render_all()
+    assert "test_a_total 1.0" in text and "test_b 2" in text
+    assert text.endswith("\n")
+
+
+def test_timed_records_failures_too(monkeypatch):
+    histogram = Histogram("test_stage_seconds", "Stages.", ("stage",))
+    monkeypatch.setattr(metrics, "STAGE_SECONDS", histogram)
+    with pytest.raises(ValueError):
+        with metrics.timed("extract"):
+            raise ValueError("boom")
+    assert 'test_stage_seconds_count{stage="extract"} 1' in histogram.render()
+
+
+def test_middleware_tags_responses_with_the_request_id():
+    sent = []
+
+    async def app(scope, receive, send):
+        assert metrics.trace_id.get() == "abc"
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"ok"})
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {"type": "http", "headers": [(b"x-request-id", b"abc")]}
+    asyncio.run(metrics.MetricsMiddleware(app)(scope, None, send))
+    assert (b"x-request-id", b"abc") in sent[0]["headers"]
+
+
+def test_snapshots_of_other_workers_are_merged(tmp_path, monkeypatch):
+    counter = Counter("test_bytes_total", "Bytes.", ("stream",))
+    gauge = Gauge("test_jobs", "Jobs.")
+    shared = Gauge("test_disk", "Disk.", callback=lambda: 100, shared=True)
+    histogram = Histogram("test_seconds", "Durations.", buckets=(1,))
+    counter.inc(5, "video")
+    gauge.set(2)
+    histogram.observe(0.5)
+    monkeypatch.setattr(metrics, "SNAPSHOT_DIR", tmp_path)
+    metrics.write_snapshot()
+    # The same values again, as snapshots of a running and an exited worker
+    own = (tmp_path / f"{os.getpid()}.json").read_text()
+    (tmp_path / "1.json").write_text(own)
+    (tmp_path / "999999999.json").write_text(own)
+    monkeypatch.setattr(metrics, "_pid_alive", lambda pid: pid == 1)
+
+    text = metrics.render_all()
+    assert 'test_bytes_total{stream="video"} 15.0' in text
+    assert "test_jobs 4" in text # The exited worker's gauge no longer counts
+    assert "test_disk 100" in text
+    assert 'test_seconds_bucket{le="1.0"} 3' in text and "test_seconds_count 3" in text
+
+
+def test_share_between_workers_removes_dirs_of_stopped_servers(tmp_path, monkeypatch):
+    stale = tmp_path / "server_999999999"
+    stale.mkdir()
+    monkeypatch.setattr(metrics, "SNAPSHOT_DIR", None)
+    path = metrics.share_between_workers(tmp_path)
+    assert path == tmp_path / f"server_{os.getpid()}" and path.is_dir()
+    assert metrics.SNAPSHOT_DIR == path
+    assert not stale.exists()
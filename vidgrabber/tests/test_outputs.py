@@ -0,0 +1,101 @@
+import os
+import shutil
+
+import pytest
+from starlette.testclient import TestClient
+
+from backend import cache, scratch
+from backend.app import app
+from backend.outputs import find_output, output_url
+
+KEY = "f" * 64
+PAYLOAD = bytes(range(256)) * 16
+
+
+@pytest.fixture
+def client():
+    # Without a `with` block the lifespan (janitor, job workers) does not run
+    yield TestClient(app)
+    shutil.rmtree(cache.CACHE_DIR, ignore_errors=True)
+
+
+def _store(tmp_path, data: bytes = PAYLOAD):
+    source = tmp_path / "muxed.mp4"
+    source.write_bytes(data)
+    return cache.store(KEY, source)
+
+
+def test_outputs_are_found_by_id_only(tmp_path):
+    with scratch.ScratchDir() as job:
+        output = job.file("muxed.mp4")
+        output.write_bytes(PAYLOAD)
+        kept = job.keep(output)
+    assert find_output(kept.stem) == kept
+    assert find_output(_store(tmp_path).stem) == cache.cache_path(KEY)
+    assert find_output("../" + kept.stem) is None
+    assert find_output("0" * 32) is None
+    assert output_url(kept, "My video.mp4") == f"/api/outputs/{kept.stem}?filename=My%20video.mp4"
+    kept.unlink()
+
+
+def test_full_download_with_etag(client, tmp_path):
+    _store(tmp_path)
+    response = client.get(f"/api/outputs/{KEY}?filename=clip.mp4")
+    assert response.status_code == 200
+    assert response.content == PAYLOAD
+    assert response.headers["accept-ranges"] == "bytes"
+    assert response.headers["etag"].startswith(f'"{KEY}-')
+    assert 'filename="clip.mp4"' in response.headers["content-disposition"]
+
+
+def test_if_none_match_returns_304(client, tmp_path):
+    _store(tmp_path)
+    etag = client.get(f"/api/outputs/{KEY}").headers["etag"]
+    response = client.get(f"/api/outputs/{KEY}", headers={"If-None-Match": f'"other", W/{etag}'})
+    assert response.status_code == 304
+    assert response.content == b""
+    assert response.headers["etag"] == etag
+    assert client.get(f"/api/outputs/{KEY}", headers={"If-None-Match": '"other"'}).status_code == 200
+
+
+def test_range_requests(client, tmp_path):
+    _store(tmp_path)
+    response = client.get(f"/api/outputs/{KEY}", headers={"Range": "bytes=100-199"})
+    assert response.status_code == 206
+    assert response.content == PAYLOAD[100:200]
+    assert response.headers["content-range"] == f"bytes 100-199/{len(PAYLOAD)}"
+    assert client.get(f"/api/outputs/{KEY}", headers={"Range": f"bytes={len(PAYLOAD)}-"}).status_code == 416
+
+
+def test_if_range_resumes_only_the_same_file(client, tmp_path):
+    _store(tmp_path)
+    etag = client.get(f"/api/outputs/{KEY}").headers["etag"]
+    resumed = client.get(f"/api/outputs/{KEY}", headers={"Range": "bytes=100-", "If-Range": etag})
+    assert resumed.status_code == 206
+
+    # The entry is evicted and produced again: same cache key, different bytes
+    cache.cache_path(KEY).unlink()
+    path = _store(tmp_path, PAYLOAD[::-1])
+    stat = path.stat()
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000)) # In case the clock did not tick
+    stale = client.get(f"/api/outputs/{KEY}", headers={"Range": "bytes=100-", "If-Range": etag})
+    assert stale.status_code == 200
+    assert stale.content == PAYLOAD[::-1]
+    assert stale.headers["etag"] != etag
+
+
+def test_cache_hits_keep_the_etag(client, tmp_path):
+    path = _store(tmp_path)
+    etag = client.get(f"/api/outputs/{KEY}").headers["etag"]
+    stat = path.stat()
+    os.utime(path, ns=(stat.st_atime_ns - 10**9, stat.st_mtime_ns))
+    assert cache.lookup(KEY) == path
+    # The hit refreshed the atime, for LRU eviction, and left the mtime alone
+    assert path.stat().st_atime_ns > stat.st_atime_ns - 10**9
+    assert path.stat().st_mtime_ns == stat.st_mtime_ns
+    assert client.get(f"/api/outputs/{KEY}").headers["etag"] == etag
+
+
+def test_unknown_outputs_are_404(client):
+    assert client.get("/api/outputs/" + "0" * 32).status_code == 404
+    assert client.get("/api/outputs/not-an-id").status_code == 404
@@ -0,0 +1,188 @@
+import asyncio
+import re
+
+import httpx
+import pytest
+
+from backend import processor
+from backend.processor import download_stream, split_ranges
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+class _Upstream:
+    """
+    Serves `payload` through httpx.MockTransport like a CDN that honours Range
+    requests. `fail` maps a requested start offset to the status to answer
+    with instead, `cut` lists byte counts after which successive responses
+    drop the connection, and `delay` slows every chunk down.
+    """
+
+    def __init__(self, payload: bytes, chunk_size: int = 100, delay: float = 0.0) -> None:
+        self.payload = payload
+        self.chunk_size = chunk_size
+        self.delay = delay
+        self.support_range = True
+        self.fail = {}
+        self.cut = []
+        self.ranges = []
+        self.streaming = 0
+
+    def client(self) -> httpx.AsyncClient:
+        return httpx.AsyncClient(transport=httpx.MockTransport(self.handle))
+
+    async def handle(self, request: httpx.Request) -> httpx.Response:
+        match = re.fullmatch(r"bytes=(\d+)-(\d*)", request.headers.get("range", ""))
+        self.ranges.append(request.headers.get("range"))
+        cut = self.cut.pop(0) if self.cut else None
+        if match is None or not self.support_range:
+            return httpx.Response(200, content=self._body(self.payload, cut),
+                                  headers={"Content-Length": str(len(self.payload))})
+        start = int(match.group(1))
+        end = int(match.group(2)) if match.group(2) else len(self.payload) - 1
+        if start in self.fail:
+            return httpx.Response(self.fail[start])
+        body = self.payload[start:end + 1]
+        return httpx.Response(206, content=self._body(body, cut), headers={
+            "Content-Range": f"bytes {start}-{end}/{len(self.payload)}", "Content-Length": str(len(body))})
+
+    async def _body(self, data: bytes, cut=None):
+        self.streaming += 1
+        try:
+            for offset in range(0, len(data), self.chunk_size):
+                if cut is not None and offset >= cut:
+                    raise httpx.ReadError("connection reset")
+                await asyncio.sleep(self.delay)
+                yield data[offset:offset + self.chunk_size]
+        finally:
+            self.streaming -= 1
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    upstream = _Upstream(bytes(range(256)) * 40)
+    monkeypatch.setattr(processor, "_http_client", upstream.client())
+    monkeypatch.setattr(processor, "SEGMENT_MIN_SIZE", 1)
+    monkeypatch.setattr(processor, "RETRY_BACKOFF", 0.0)
+    # Chunks are written as they arrive, so a resume starts exactly where the cut was
+    monkeypatch.setattr(processor, "CHUNK_SIZE", upstream.chunk_size)
+    return upstream
+
+
+@pytest.mark.parametrize("total_size, segments", [(100, 4), (101, 4), (7, 3), (10, 1), (3, 8), (1, 4), (1000003, 7)])
+def test_split_ranges_covers_the_file_exactly_once(total_size, segments):
+    ranges = split_ranges(total_size, segments)
+    assert 1 <= len(ranges) <= segments
+    assert ranges[0][0] == 0
+    assert ranges[-1][1] == total_size - 1
+    for (_, end), (next_start, _) in zip(ranges, ranges[1:]):
+        assert next_start == end + 1
+    assert all(start <= end for start, end in ranges)
+
+
+def test_split_ranges_examples():
+    assert split_ranges(100, 4) == [(0, 24), (25, 49), (50, 74), (75, 99)]
+    assert split_ranges(10, 3) == [(0, 3), (4, 7), (8, 9)]
+    # Never more segments than bytes
+    assert split_ranges(2, 4) == [(0, 0), (1, 1)]
+
+
+def test_segmented_download_reassembles_the_file(upstream, tmp_path):
+    output = tmp_path / "video.mp4"
+    assert run(download_stream("https://cdn.example/v", output, segments=4))
+    assert output.read_bytes() == upstream.payload
+    assert upstream.ranges[0] == "bytes=0-0" # The probe
+    assert sorted(upstream.ranges[1:]) == ["bytes=0-2559", "bytes=2560-5119", "bytes=5120-7679", "bytes=7680-10239"]
+    assert not processor.partial_path(output).exists()
+
+
+def test_failed_segment_cancels_its_siblings(upstream, tmp_path):
+    upstream.delay = 0.01
+    upstream.fail[7680] = 404 # Not transient, so it is not retried
+    output = tmp_path / "video.mp4"
+
+    async def scenario():
+        ok = await download_stream("https://cdn.example/v", output, segments=4)
+        # Nothing is still reading from upstream once the download has returned
+        return ok, upstream.streaming
+
+    assert run(scenario()) == (False, 0)
+    assert not output.exists()
+    assert not processor.partial_path(output).exists()
+
+
+def _failing(*errors):
+    """An attempt that raises the given errors in turn, then succeeds."""
+    remaining = list(errors)
+    attempts = []
+
+    async def attempt():
+        attempts.append(1)
+        if remaining:
+            raise remaining.pop(0)
+
+    return attempt, attempts
+
+
+def _status_error(status: int) -> httpx.HTTPStatusError:
+    request = httpx.Request("GET", "https://cdn.example/v")
+    return httpx.HTTPStatusError("failed", request=request, response=httpx.Response(status, request=request))
+
+
+def test_transient_errors_are_retried(monkeypatch):
+    monkeypatch.setattr(processor, "RETRY_BACKOFF", 0.0)
+    attempt, attempts = _failing(httpx.ReadError("reset"), _status_error(503), _status_error(429),
+                                 processor.TransientDownloadError("short"))
+    run(processor._with_retries(attempt, "test"))
+    assert len(attempts) == 5
+
+
+@pytest.mark.parametrize("error", [_status_error(403), _status_error(404), processor.StreamDownloadError("no range")])
+def test_permanent_errors_are_not_retried(error):
+    attempt, attempts = _failing(error)
+    with pytest.raises(type(error)):
+        run(processor._with_retries(attempt, "test"))
+    assert len(attempts) == 1
+
+
+def test_retries_give_up_after_the_limit(monkeypatch):
+    monkeypatch.setattr(processor, "RETRY_BACKOFF", 0.0)
+    monkeypatch.setattr(processor, "DOWNLOAD_RETRIES", 2)
+    attempt, attempts = _failing(*[httpx.ConnectError("refused")] * 5)
+    with pytest.raises(httpx.ConnectError):
+        run(processor._with_retries(attempt, "test"))
+    assert len(attempts) == 3
+
+
+def test_single_stream_resumes_where_it_stopped(upstream, tmp_path):
+    upstream.cut = [3000]
+    output = tmp_path / "video.mp4"
+    progress = []
+    assert run(download_stream("https://cdn.example/v", output, segments=1,
+                               progress=lambda done, total: progress.append((done, total))))
+    assert output.read_bytes() == upstream.payload
+    assert upstream.ranges == [None, "bytes=3000-"]
+    assert progress[-1] == (len(upstream.payload), len(upstream.payload))
+
+
+def test_single_stream_restarts_if_the_server_ignores_range(upstream, tmp_path):
+    upstream.support_range = False
+    upstream.cut = [3000]
+    output = tmp_path / "video.mp4"
+    progress = []
+    assert run(download_stream("https://cdn.example/v", output, segments=1,
+                               progress=lambda done, total: progress.append(done)))
+    assert output.read_bytes() == upstream.payload
+    assert upstream.ranges == [None, "bytes=3000-"]
+    # The bytes of the first attempt are taken back off the count
+    assert max(progress) == len(upstream.payload)
+
+
+def test_interrupted_segment_resumes_within_its_range(upstream, tmp_path):
+    upstream.cut = [None, 1000] # The probe, then the first segment
+    output = tmp_path / "video.mp4"
+    assert run(download_stream("https://cdn.example/v", output, segments=2))
+    assert output.read_bytes() == upstream.payload
+    assert "bytes=1000-5119" in upstream.ranges
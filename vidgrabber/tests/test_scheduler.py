@@ -0,0 +1,221 @@
+import asyncio
+import os
+
+import pytest
+
+from backend import scheduler
+from backend.scheduler import AdmissionRejected, Gate
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+async def _settle() -> None:
+    """Lets woken waiters run; asyncio.wait needs a few loop iterations to return."""
+    await asyncio.sleep(0.01)
+
+
+async def _waiting(gate: Gate) -> asyncio.Task:
+    """Starts an acquire that has to queue, and returns once it is queued."""
+    task = asyncio.create_task(gate.acquire())
+    await _settle()
+    assert not task.done()
+    return task
+
+
+def test_unlimited_gate_never_waits():
+    async def scenario():
+        gate = Gate("test", 0)
+        for _ in range(100):
+            await gate.acquire()
+        assert gate.active == 100
+    run(scenario())
+
+
+def test_slots_are_handed_to_waiters_in_order():
+    async def scenario():
+        gate = Gate("test", 1)
+        await gate.acquire()
+        first = await _waiting(gate)
+        second = await _waiting(gate)
+        gate.release()
+        await _settle()
+        assert first.done() and not second.done()
+        # The slot moved to the waiter; it was never free for a newcomer to take
+        assert gate.active == 1
+        late = asyncio.create_task(gate.acquire())
+        await _settle()
+        assert not late.done()
+        gate.release()
+        await _settle()
+        assert second.done() and not late.done()
+        gate.release()
+        await late
+        gate.release()
+        assert gate.idle
+    run(scenario())
+
+
+def test_timeout_rejects_and_leaves_no_waiter(monkeypatch):
+    monkeypatch.setattr(scheduler, "ADMISSION_TIMEOUT", 0.05)
+    async def scenario():
+        gate = Gate("test", 1)
+        await gate.acquire()
+        with pytest.raises(AdmissionRejected) as rejected:
+            await gate.acquire()
+        assert rejected.value.status_code == 503
+        assert "Retry-After" in rejected.value.headers
+        assert gate.active == 1
+        gate.release()
+        assert gate.idle
+    run(scenario())
+
+
+def test_queue_limit_rejects_right_away(monkeypatch):
+    monkeypatch.setattr(scheduler, "ADMISSION_QUEUE_LIMIT", 1)
+    async def scenario():
+        gate = Gate("test", 1)
+        await gate.acquire()
+        waiter = await _waiting(gate)
+        with pytest.raises(AdmissionRejected):
+            await gate.acquire()
+        gate.release()
+        await waiter
+        gate.release()
+        assert gate.idle
+    run(scenario())
+
+
+def test_background_work_waits_without_limits(monkeypatch):
+    monkeypatch.setattr(scheduler, "ADMISSION_TIMEOUT", 0.01)
+    async def scenario():
+        gate = Gate("test", 1)
+        await gate.acquire()
+        async def background():
+            scheduler.wait_for_capacity.set(True)
+            await gate.acquire()
+        task = asyncio.create_task(background())
+        await asyncio.sleep(0.05) # Well past the request timeout
+        assert not task.done()
+        gate.release()
+        await task
+        assert gate.active == 1
+    run(scenario())
+
+
+def test_cancelled_waiter_is_removed():
+    async def scenario():
+        gate = Gate("test", 1)
+        await gate.acquire()
+        waiter = await _waiting(gate)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert gate.active == 1
+        gate.release()
+        assert gate.idle
+    run(scenario())
+
+
+def test_cancel_after_hand_off_returns_the_slot():
+    async def scenario():
+        gate = Gate("test", 1)
+        await gate.acquire()
+        waiter = await _waiting(gate)
+        # The slot is handed over, but the waiter is cancelled before it resumes
+        gate.release()
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert gate.active == 0
+        assert gate.idle
+    run(scenario())
+
+
+def test_slot_context_releases_on_error():
+    async def scenario():
+        gate = Gate("test", 2)
+        with pytest.raises(RuntimeError):
+            async with gate.slot():
+                assert gate.active == 1
+                raise RuntimeError("boom")
+        assert gate.idle
+    run(scenario())
+
+
+def test_host_key_groups_cdn_edges():
+    assert scheduler.host_key("https://rr1---sn-abc.googlevideo.com/videoplayback") == "googlevideo.com"
+    assert scheduler.host_key("http://127.0.0.1:8000/a") == "127.0.0.1"
+
+
+def test_widening_takes_only_free_connections():
+    async def scenario():
+        gate = Gate("test", 4)
+        await gate.acquire() # Another download's connection
+        await gate.acquire()
+        connections = scheduler.Connections(gate)
+        assert connections.widen(4) == 3
+        assert gate.active == 4
+        waiter = await _waiting(gate)
+        gate.release()
+        await waiter
+        # Widening never jumps the queue, even when there is room beyond it
+        queued = await _waiting(gate)
+        gate.limit = 5
+        assert gate.try_acquire(1) == 0
+        queued.cancel()
+    run(scenario())
+
+
+def test_download_slot_returns_every_connection():
+    async def scenario():
+        url = "https://cdn.example.com/v"
+        async with scheduler.download_slot(url) as connections:
+            assert connections.widen(4) == min(4, scheduler.MAX_DOWNLOADS_PER_HOST)
+            host = scheduler._hosts["example.com"]
+            assert host.gate.active == connections.count
+        assert host.gate.idle and "example.com" not in scheduler._hosts
+        assert scheduler.download_gate.idle
+    run(scenario())
+
+
+def test_limits_are_divided_between_workers(monkeypatch):
+    monkeypatch.setattr(scheduler, "download_gate", Gate("download", 16))
+    monkeypatch.setattr(scheduler, "mux_gate", Gate("mux", 4))
+    monkeypatch.setattr(scheduler, "download_bucket", scheduler.TokenBucket(1000))
+    monkeypatch.setattr(scheduler, "MAX_CONCURRENT_DOWNLOADS", 16)
+    monkeypatch.setattr(scheduler, "MAX_CONCURRENT_MUXES", 4)
+    monkeypatch.setattr(scheduler, "MAX_DOWNLOADS_PER_HOST", 6)
+    monkeypatch.setattr(scheduler, "DOWNLOAD_BANDWIDTH", 1000)
+    monkeypatch.setattr(scheduler, "HOST_BANDWIDTH", 0)
+    monkeypatch.setattr(scheduler, "_host_limit", 6)
+    monkeypatch.setattr(scheduler, "_host_bandwidth", 0)
+    scheduler.divide_limits(4)
+    assert scheduler.download_gate.limit == 4
+    assert scheduler.mux_gate.limit == 1
+    assert scheduler.download_bucket.rate == 250
+    assert scheduler._Host().gate.limit == 1 # Rounded down, but never to nothing
+    assert scheduler._Host().bucket.rate == 0 # Unlimited stays unlimited
+
+
+def test_disk_reservations_count_other_processes(tmp_path, monkeypatch):
+    monkeypatch.setattr(scheduler, "ADMISSION_TIMEOUT", 0.05)
+    monkeypatch.setattr(scheduler, "DISK_POLL_INTERVAL", 0.01)
+    budget = scheduler.DiskBudget(tmp_path, headroom=1000)
+    monkeypatch.setattr(budget, "_free_space", lambda: 1100)
+    ledger = tmp_path / "reservations"
+    ledger.mkdir()
+    (ledger / str(os.getppid())).write_text("60") # A running worker
+    (ledger / "999999999").write_text("100") # A worker that exited
+
+    async def scenario():
+        with pytest.raises(AdmissionRejected):
+            await budget.reserve(50)
+        reservation = await budget.reserve(40)
+        assert (ledger / str(os.getpid())).read_text() == "40"
+        reservation.release()
+        assert (ledger / str(os.getpid())).read_text() == "0"
+
+    run(scenario())
+    assert not (ledger / "999999999").exists()
@@ -0,0 +1,115 @@
+import fcntl
+import os
+import time
+
+import pytest
+
+from backend import scratch
+from backend.scratch import ScratchDir, enforce_quotas, sweep_orphans, worker_alive
+
+
+@pytest.fixture
+def temp_dir(tmp_path, monkeypatch):
+    """Points the scratch layout at an empty directory."""
+    monkeypatch.setattr(scratch, "TEMP_DIR_BASE", tmp_path)
+    monkeypatch.setattr(scratch, "SCRATCH_ROOT", tmp_path / "scratch")
+    monkeypatch.setattr(scratch, "OUTPUTS_DIR", tmp_path / "outputs")
+    monkeypatch.setattr(scratch, "MEMORY_ROOT", None)
+    monkeypatch.setattr(scratch, "_worker_name", None)
+    monkeypatch.setattr(scratch, "_worker_lock", None)
+    monkeypatch.setattr(scratch, "_worker_pid", None)
+    yield tmp_path
+    scratch.release_worker_dir()
+
+
+def _age(path, seconds):
+    past = time.time() - seconds
+    os.utime(path, (past, past))
+
+
+def _worker(temp_dir, name, held=False, age=3600):
+    """Creates another worker's directory; `held` keeps its lock taken, as a running worker does."""
+    path = temp_dir / "scratch" / name
+    path.mkdir(parents=True)
+    lock = open(path / ".lock", "a")
+    if held:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    else:
+        lock.close()
+    _age(path, age)
+    return path, lock
+
+
+def _write(path, size, age=0):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(b"x" * size)
+    _age(path, age)
+    return path
+
+
+def test_worker_alive_follows_the_lock(temp_dir):
+    _, lock = _worker(temp_dir, "w1_running", held=True)
+    _worker(temp_dir, "w2_dead")
+    _worker(temp_dir, "w3_starting", age=0)
+    try:
+        assert worker_alive(scratch.worker_name())
+        assert worker_alive("w1_running")
+        assert not worker_alive("w2_dead")
+        # Too new to judge: its owner may not have taken the lock yet
+        assert worker_alive("w3_starting")
+        assert not worker_alive("w3_starting", grace=0)
+        assert not worker_alive("w4_gone")
+    finally:
+        lock.close()
+
+
+def test_sweep_removes_what_dead_workers_left(temp_dir):
+    running, lock = _worker(temp_dir, "w1_running", held=True)
+    dead, _ = _worker(temp_dir, "w2_dead")
+    _write(dead / "job_1" / "video.mp4", 10)
+    _age(dead, 3600)
+    legacy = _write(temp_dir / "vid_123.mp4", 10)
+    unrelated = _write(temp_dir / "jobs.sqlite3", 10)
+    try:
+        assert sweep_orphans() == 2
+        assert running.exists() and unrelated.exists()
+        assert not dead.exists() and not legacy.exists()
+    finally:
+        lock.close()
+
+
+def test_quotas_remove_stale_jobs_and_expired_outputs(temp_dir, monkeypatch):
+    monkeypatch.setattr(scratch, "SCRATCH_MAX_AGE", 600)
+    monkeypatch.setattr(scratch, "OUTPUT_RETENTION", 300)
+    monkeypatch.setattr(scratch, "SCRATCH_MAX_BYTES", 0)
+    stale = _write(temp_dir / "scratch" / "w1" / "job_stale" / "video.mp4", 10, age=1200).parent
+    _age(stale, 1200)
+    active = _write(temp_dir / "scratch" / "w1" / "job_active" / "video.mp4", 10).parent
+    expired = _write(temp_dir / "outputs" / "a.mp4", 10, age=400)
+    fresh = _write(temp_dir / "outputs" / "b.mp4", 10, age=100)
+    enforce_quotas()
+    assert not stale.exists() and not expired.exists()
+    assert active.exists() and fresh.exists()
+
+
+def test_quotas_drop_the_oldest_outputs_but_never_running_jobs(temp_dir, monkeypatch):
+    monkeypatch.setattr(scratch, "SCRATCH_MAX_BYTES", 250)
+    running = _write(temp_dir / "scratch" / "w1" / "job_1" / "video.mp4", 200)
+    oldest = _write(temp_dir / "outputs" / "a.mp4", 50, age=30)
+    newer = _write(temp_dir / "outputs" / "b.mp4", 50, age=20)
+    newest = _write(temp_dir / "outputs" / "c.mp4", 50, age=10)
+    enforce_quotas()
+    assert running.exists()
+    assert not oldest.exists() and not newer.exists()
+    assert newest.exists()
+
+
+def test_scratch_dir_cleanup_and_keep(temp_dir):
+    with ScratchDir() as job:
+        job.file("video.mp4").write_bytes(b"video")
+        output = job.file("muxed.mp4")
+        output.write_bytes(b"muxed")
+        kept = job.keep(output)
+    assert not job.path.exists()
+    assert kept.parent == temp_dir / "outputs"
+    assert kept.read_bytes() == b"muxed"
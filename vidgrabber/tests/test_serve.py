@@ -0,0 +1,32 @@
+import subprocess
+import sys
+from pathlib import Path
+
+from backend import serve
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def _imported_after(statement: str):
+    """Runs `statement` in a fresh interpreter and returns the heavy modules it loaded."""
+    code = f"import sys; {statement}; print(' '.join(m for m in ('yt_dlp', 'httpx') if m in sys.modules))"
+    result = subprocess.run([sys.executable, "-c", code], cwd=ROOT,
+                            capture_output=True, text=True, check=True)
+    return result.stdout.split()
+
+
+def test_importing_the_app_loads_neither_yt_dlp_nor_httpx():
+    assert _imported_after("import backend.app") == []
+
+
+def test_preload_loads_both_for_the_workers_to_share():
+    assert _imported_after("import backend.serve as s; s.preload()") == ["yt_dlp", "httpx"]
+
+
+def test_bound_socket_is_inherited_by_forked_workers():
+    sock = serve.bind_socket("127.0.0.1", 0)
+    try:
+        assert sock.get_inheritable()
+        assert sock.getsockname()[1] > 0
+    finally:
+        sock.close()
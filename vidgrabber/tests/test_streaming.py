@@ -0,0 +1,219 @@
+import asyncio
+
+import pytest
+
+from backend import app as api
+from backend import scheduler
+from backend.processor import stream_ffmpeg_mux
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+@pytest.fixture
+def processes(monkeypatch):
+    """Records the FFmpeg processes started by the code under test."""
+    started = []
+    create = asyncio.create_subprocess_exec
+
+    async def tracking_create(*args, **kwargs):
+        process = await create(*args, **kwargs)
+        started.append(process)
+        return process
+
+    monkeypatch.setattr(asyncio, "create_subprocess_exec", tracking_create)
+    return started
+
+
+async def _serve(response, disconnect_after=None):
+    """
+    Runs an ASGI response and returns the body it sent. The client goes away
+    after `disconnect_after` body messages if given.
+    """
+    body = []
+
+    async def receive():
+        await asyncio.Event().wait()
+
+    async def send(message):
+        if message["type"] == "http.response.body":
+            if disconnect_after is not None and len(body) >= disconnect_after:
+                raise OSError("client went away")
+            body.append(message.get("body", b""))
+
+    scope = {"type": "http", "asgi": {"spec_version": "2.4"}, "method": "GET", "headers": []}
+    try:
+        await response(scope, receive, send)
+    except Exception:
+        if disconnect_after is None:
+            raise
+    return b"".join(body)
+
+
+def test_streaming_mux_yields_a_fragmented_mp4(media, processes):
+    video, audio, _ = media
+
+    async def scenario():
+        return b"".join([chunk async for chunk in stream_ffmpeg_mux(str(video), str(audio))])
+
+    output = run(scenario())
+    assert output[4:8] == b"ftyp"
+    assert b"moof" in output
+    assert processes[0].returncode == 0
+
+
+def test_closing_the_stream_early_stops_ffmpeg(media, processes):
+    video, audio, _ = media
+
+    async def scenario():
+        chunks = stream_ffmpeg_mux(str(video), str(audio))
+        await chunks.__anext__()
+        await chunks.aclose()
+
+    run(scenario())
+    assert processes[0].returncode is not None
+
+
+def test_unreadable_input_raises(media, tmp_path, processes):
+    async def scenario():
+        return [chunk async for chunk in stream_ffmpeg_mux(str(tmp_path / "missing.mp4"), str(tmp_path / "missing.m4a"))]
+
+    with pytest.raises(RuntimeError):
+        run(scenario())
+
+
+def test_direct_stream_releases_its_slots_when_the_client_disconnects(media, processes):
+    video, audio, _ = media
+    video_info = {"video_url": str(video), "audio_url": str(audio)}
+
+    async def scenario():
+        response = await api._direct_stream(video_info, {})
+        await _serve(response, disconnect_after=1)
+        return scheduler.mux_gate.idle, api.job_semaphore._value
+
+    assert run(scenario()) == (True, api.MAX_CONCURRENT_JOBS)
+    assert processes[0].returncode is not None
+
+
+def test_direct_stream_sends_the_whole_output(media, processes):
+    video, audio, _ = media
+    video_info = {"video_url": str(video), "audio_url": str(audio)}
+
+    async def scenario():
+        return await _serve(await api._direct_stream(video_info, {}))
+
+    assert run(scenario())[4:8] == b"ftyp"
+    assert processes[0].returncode == 0
+
+
+@pytest.mark.parametrize("filename, expected", [
+    ("clip.mp4", 'attachment; filename="clip.mp4"'),
+    ("Ünïcode 動画.mp4", "attachment; filename=\"_n_code __.mp4\"; filename*=utf-8''%C3%9Cn%C3%AFcode%20%E5%8B%95%E7%94%BB.mp4"),
+    ('a "quoted" name.mp4', "attachment; filename=\"a _quoted_ name.mp4\"; filename*=utf-8''a%20%22quoted%22%20name.mp4"),
+])
+def test_content_disposition_is_latin1(filename, expected):
+    header = api._content_disposition(filename)
+    assert header == expected
+    header.encode("latin-1")
+
+
+@pytest.fixture
+def shared_video(media, monkeypatch):
+    """Makes every streaming request resolve to the generated media, with a cacheable identity."""
+    video, audio, _ = media
+    video_info = {"video_url": str(video), "audio_url": str(audio), "extractor": "Test", "video_id": "shared",
+                  "video_format_id": "v", "audio_format_id": "a", "suggested_filename": "shared.mp4"}
+
+    async def get_stream_urls(url, selection=None):
+        return dict(video_info)
+
+    monkeypatch.setattr(api, "_get_stream_urls", get_stream_urls)
+    yield video_info
+    api.cache.cache_path(api._output_cache_key(video_info)).unlink(missing_ok=True)
+
+
+async def _producers_done():
+    while api._producer_tasks:
+        await asyncio.sleep(0.01)
+
+
+def test_concurrent_streams_share_one_mux_and_fill_the_cache(shared_video, processes):
+    async def scenario():
+        responses = await asyncio.gather(*(api._stream_video("https://example.com/v") for _ in range(3)))
+        bodies = await asyncio.gather(*(_serve(response) for response in responses))
+        await _producers_done()
+        return bodies
+
+    bodies = run(scenario())
+    assert len(processes) == 1
+    assert bodies[0][4:8] == b"ftyp" and bodies.count(bodies[0]) == 3
+    assert api.cache.lookup(api._output_cache_key(shared_video)).read_bytes() == bodies[0]
+
+
+def test_shared_stream_reader_is_closed_when_the_client_disconnects(shared_video, processes, monkeypatch):
+    readers = []
+    reader = api.SharedStream.reader
+    monkeypatch.setattr(api.SharedStream, "reader", lambda self: readers.append(reader(self)) or readers[-1])
+
+    async def scenario():
+        await _serve(await api._stream_video("https://example.com/v"), disconnect_after=1)
+        # Closed right away, not whenever the generator happens to be collected
+        closed = readers[0].ag_frame is None
+        await _producers_done()
+        return closed
+
+    assert run(scenario())
+    # The mux carried on without the client and its output was cached
+    assert processes[0].returncode == 0
+    assert api.cache.lookup(api._output_cache_key(shared_video)) is not None
+
+
+@pytest.fixture
+def progressive_source(monkeypatch):
+    """Serves a progressive format from a mock source that counts its fetches."""
+    import httpx
+    payload = bytes(range(256)) * 1024
+    fetches = []
+
+    async def body():
+        for start in range(0, len(payload), 65536):
+            await asyncio.sleep(0.01)
+            yield payload[start:start + 65536]
+
+    async def handle(request):
+        fetches.append(request.url)
+        return httpx.Response(200, headers={"Content-Length": str(len(payload))}, content=body())
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handle))
+    monkeypatch.setattr(api, "get_http_client", lambda: client)
+    video_info = {"video_url": "https://cdn.example.com/v.mp4", "audio_url": None, "progressive": True,
+                  "filesize": len(payload), "extractor": "Test", "video_id": "progressive",
+                  "video_format_id": "18", "audio_format_id": None, "suggested_filename": "progressive.mp4"}
+
+    async def get_stream_urls(url, selection=None):
+        return dict(video_info)
+
+    monkeypatch.setattr(api, "_get_stream_urls", get_stream_urls)
+    yield video_info, payload, fetches
+    api.cache.cache_path(api._output_cache_key(video_info)).unlink(missing_ok=True)
+
+
+def test_progressive_requests_share_one_fetch_and_fill_the_cache(progressive_source):
+    video_info, payload, fetches = progressive_source
+    key = api._output_cache_key(video_info)
+
+    async def scenario():
+        responses = await asyncio.gather(*(api._stream_video("https://example.com/v") for _ in range(3)))
+        # A file job for the same output joins the stream instead of downloading it again
+        joined = await api._produce_shared_file(key, video_info)
+        bodies = await asyncio.gather(*(_serve(response) for response in responses))
+        await _producers_done()
+        return bodies, joined
+
+    bodies, joined = run(scenario())
+    assert len(fetches) == 1
+    assert bodies == [payload] * 3
+    assert joined == api.cache.lookup(key)
+    assert joined.read_bytes() == payload
+    assert api.job_semaphore._value == api.MAX_CONCURRENT_JOBS